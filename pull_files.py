@@ -1,26 +1,41 @@
 import os
+import ctypes
+import errno
 import fnmatch
+import hashlib
+import heapq
+import inspect
+import json
+import random
+import shlex
+import shutil
+import socket
+import sqlite3
+import struct
+import tarfile
+import zlib
 import paramiko
-from scp import SCPClient
-from threading import Thread, Event
-from queue import Queue
-import traceback
+from threading import Thread, Event, Lock, BoundedSemaphore, Condition, local
+from queue import Queue, Empty
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import time
 
 def get_user_input():
     """
-    通过交互方式获取用户输入
+    通过交互方式获取用户输入；默认只询问连接和路径，其余选项在选择设置高级选项后才询问，否则使用 pull_files() 的默认值
     """
     remote_path = input("请输入远程文件或文件夹路径: ").strip()
     pattern = input("请输入文件名匹配模式（例如 *.txt，默认全部文件）: ").strip() or "*"
-    remote_host = input("请输入远程服务器地址: ").strip()
+    remote_host = input("请输入远程服务器地址（多台用逗号分隔，可写成 host:port，各主机拉取到本地目标路径下的子目录）: ").strip()
     remote_port = int(input("请输入远程服务器端口（默认 22）: ").strip() or 22)
     remote_user = input("请输入远程服务器用户名: ").strip()
     remote_password = input("请输入远程服务器密码: ").strip()
     local_path = input("请输入本地目标路径: ").strip()
-    threads = int(input("请输入并发线程数（默认 4）: ").strip() or 4)
-
-    return {
+    threads = int(input("请输入并发线程数（默认 4，自动调整时为初始值）: ").strip() or 4)
+    config = {
         "remote_path": remote_path,
         "pattern": pattern,
         "remote_host": remote_host,
@@ -31,141 +46,3393 @@ def get_user_input():
         "threads": threads,
     }
 
-def remote_file_exists(ssh, remote_file_path):
+    if input("是否设置高级选项（同步模式、自动调整并发、限速、校验、状态库、传输参数、压缩和筛选等）y/N: ").strip().lower() != "y":
+        return dict(config, **default_options())
+    adaptive_threads = input("是否根据吞吐、错误率和连接耗时自动调整并发线程数 Y/n: ").strip().lower() != "n"
+    min_threads, max_threads = 1, threads
+    if adaptive_threads:
+        min_threads = int(input("自动调整时的最小线程数（默认 1）: ").strip() or 1)
+        max_threads = int(input(f"自动调整时的最大线程数（默认 {threads * 4}）: ").strip() or threads * 4)
+    max_sessions = int(input(f"请输入每台主机最大 SSH 连接数（默认 {max_threads}）: ").strip() or max_threads)
+    sync_mode = input("请输入同步模式 all/skip/sync/checksum（默认 all，全部重新拉取）: ").strip() or "all"
+    dry_run = input("是否只输出同步计划而不实际拉取 y/N: ").strip().lower() == "y"
+    delta_threshold = int(float(input("大文件增量传输阈值 MB（默认 64，0 表示关闭）: ").strip() or 64) * 1024 * 1024)
+    bundle_threshold = int(float(input("小文件打包传输阈值 KB（默认 1024，0 表示关闭）: ").strip() or 1024) * 1024)
+    bundle_size = int(float(input("每个打包的大小上限 MB（默认 64）: ").strip() or 64) * 1024 * 1024)
+    chunk_threshold = int(float(input("大文件分块并发传输阈值 MB（默认 256，0 表示关闭）: ").strip() or 256) * 1024 * 1024)
+    chunk_streams = int(input("单个大文件的并发通道数（默认 4）: ").strip() or 4)
+    resume_threshold = int(float(input("大文件断点续传阈值 MB（默认 16，0 表示关闭）: ").strip() or 16) * 1024 * 1024)
+    schedule_policy = input("请输入调度策略 fifo/largest/interleave/locality（默认 largest，大文件优先）: ").strip() or "largest"
+    rate_limit = parse_rate(input("全局限速，例如 10M 表示 10 MB/s（默认不限速）: ").strip())
+    file_rate_limit = parse_rate(input("单个文件限速（默认不限速）: ").strip())
+    rate_schedule = input("限速时间表，例如 08:00-20:00=10M,20:00-08:00=100M（默认不使用）: ").strip()
+    progress_interval = float(input("进度显示间隔 秒（默认 5，0 表示不显示）: ").strip() or 5)
+    metrics_path = input("每个文件的传输指标输出文件（JSON lines，默认不输出）: ").strip() or None
+    prom_path = input("Prometheus 指标文件路径（默认不输出）: ").strip() or None
+    verify = input("是否在拉取后校验 SHA-256，不一致时自动重新拉取 Y/n: ").strip().lower() != "n"
+    manifest_path = input("校验清单输出文件（JSON lines，默认不输出）: ").strip() or None
+    dedup_threshold = int(float(input("重复文件去重阈值 KB（默认 1024，0 表示关闭）: ").strip() or 1024) * 1024)
+    dedup_mode = input("重复文件在本地的创建方式 copy/hardlink（默认 copy）: ").strip() or "copy"
+    state_path = input(f"传输状态库路径（默认 {STATE_PATH}，输入 none 表示不使用）: ").strip() or STATE_PATH
+    min_size = input("只拉取不小于该大小的文件 MB（默认不限制）: ").strip()
+    max_size = input("只拉取不大于该大小的文件 MB（默认不限制）: ").strip()
+    newer_than = parse_time(input("只拉取该时间之后修改的文件，例如 2024-01-01 或 2024-01-01 12:00（默认不限制）: "))
+    older_than = parse_time(input("只拉取该时间之前修改的文件（默认不限制）: "))
+    transport_profile = input(f"传输参数预设 auto/{'/'.join(TRANSPORT_PROFILES)}（默认 auto，每台主机测量一次往返延迟和带宽后自动选择，结果在状态库中缓存 24 小时）: ").strip() or "auto"
+    compress = input("压缩拉取 auto/on/off（默认 auto，只在广域网预设下压缩可压缩的文件）: ").strip() or "auto"
+
+    return dict(config, **{
+        "max_sessions": max_sessions,
+        "adaptive_threads": adaptive_threads,
+        "min_threads": min_threads,
+        "max_threads": max_threads,
+        "sync_mode": sync_mode,
+        "dry_run": dry_run,
+        "delta_threshold": delta_threshold,
+        "bundle_threshold": bundle_threshold,
+        "bundle_size": bundle_size,
+        "chunk_threshold": chunk_threshold,
+        "chunk_streams": chunk_streams,
+        "resume_threshold": resume_threshold,
+        "schedule_policy": schedule_policy,
+        "rate_limit": rate_limit,
+        "file_rate_limit": file_rate_limit,
+        "rate_schedule": rate_schedule,
+        "progress_interval": progress_interval,
+        "metrics_path": metrics_path,
+        "prom_path": prom_path,
+        "verify": verify,
+        "manifest_path": manifest_path,
+        "dedup_threshold": dedup_threshold,
+        "dedup_mode": dedup_mode,
+        "state_path": None if state_path.lower() == "none" else state_path,
+        "transport_profile": transport_profile,
+        "compress": compress,
+        "min_size": int(float(min_size) * 1024 * 1024) if min_size else None,
+        "max_size": int(float(max_size) * 1024 * 1024) if max_size else None,
+        "newer_than": newer_than,
+        "older_than": older_than,
+    })
+
+def default_options():
+    """
+    pull_files() 各个可选参数的默认值
+    """
+    return {name: parameter.default for name, parameter in inspect.signature(pull_files).parameters.items()
+            if parameter.default is not inspect.Parameter.empty}
+
+CONNECT_TIMEOUT = 60  # 建立 TCP 连接、SSH 握手和认证的超时（秒）
+SOCKET_TIMEOUT = 60  # 传输中通道超过这么久没有数据视为连接已断开（秒）
+RETRY_LIMIT = 3  # 每个文件（或打包）因可重试的错误最多重新放入调度窗口的次数
+RETRY_BASE_DELAY = 2  # 第一次重试的延迟（秒），之后每次翻倍，并在 [一半, 全部] 之间随机抖动
+RETRY_MAX_DELAY = 120  # 单次重试延迟的上限（秒）
+CIRCUIT_THRESHOLD = 3  # 连续这么多次连接失败后熔断，暂停向该主机建立连接
+CIRCUIT_COOLDOWN = 30  # 第一次熔断的暂停时间（秒），之后每次连续熔断翻倍
+CIRCUIT_MAX_TRIPS = 4  # 连续熔断这么多次仍连不上时放弃该主机，剩余文件立即失败
+
+class HostUnavailableError(IOError):
+    """
+    主机已熔断：retry_after 秒后可以再尝试；retry_after 为 None 表示已放弃该主机
+    """
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    单台主机的熔断器：连续 CIRCUIT_THRESHOLD 次连接失败后熔断，冷却期内建立连接直接抛出 HostUnavailableError，
+    工作线程不再为不可达的主机空等连接超时；冷却期结束后只放行一个探测连接，成功则恢复，失败则再次熔断（冷却时间翻倍）
+    连续熔断 CIRCUIT_MAX_TRIPS 次，或遇到认证失败等不可重试的错误时放弃该主机
+    """
+    def __init__(self, label):
+        self.label = label
+        self._lock = Lock()
+        self._failures = 0  # 连续失败次数
+        self._trips = 0  # 连续熔断次数
+        self._open_until = 0.0
+        self._probing = False
+        self._dead = None  # 放弃该主机的原因
+
+    def before_connect(self):
+        """
+        建立连接之前调用，主机已熔断时抛出 HostUnavailableError
+        """
+        with self._lock:
+            if self._dead is not None:
+                raise HostUnavailableError(f"主机 {self.label} 不可用，已放弃: {self._dead}")
+            now = time.time()
+            if now < self._open_until:
+                raise HostUnavailableError(f"主机 {self.label} 已熔断", retry_after=self._open_until - now)
+            if self._trips:
+                if self._probing:
+                    raise HostUnavailableError(f"主机 {self.label} 正在探测", retry_after=RETRY_BASE_DELAY)
+                self._probing = True
+
+    def succeeded(self):
+        with self._lock:
+            if self._trips:
+                print(f"主机 {self.label} 已恢复连接")
+            self._failures = self._trips = 0
+            self._probing = False
+
+    def failed(self, error, fatal=False):
+        """
+        建立连接失败；fatal 为 True（例如认证失败）时直接放弃该主机
+        """
+        with self._lock:
+            probing, self._probing = self._probing, False
+            if fatal:
+                self._dead = str(error)
+                print(f"主机 {self.label} 连接出现不可重试的错误，放弃该主机: {error}")
+                return
+            self._failures += 1
+            if not probing and self._failures < CIRCUIT_THRESHOLD:
+                return
+            self._failures = 0
+            self._trips += 1
+            if self._trips >= CIRCUIT_MAX_TRIPS:
+                self._dead = f"连续熔断 {self._trips} 次，最后的错误: {error}"
+                print(f"主机 {self.label} {self._dead}，放弃该主机")
+                return
+            cooldown = CIRCUIT_COOLDOWN * 2 ** (self._trips - 1)
+            self._open_until = time.time() + cooldown
+            print(f"主机 {self.label} 连接连续失败，熔断 {cooldown} 秒: {error}")
+
+FATAL_ERRNOS = {errno.EACCES, errno.EPERM, errno.ENOSPC, errno.EDQUOT, errno.EROFS, errno.EISDIR, errno.ENOTDIR}
+FATAL_MESSAGES = ("Permission denied", "No space left", "Disk quota exceeded", "Read-only file system", "Is a directory", "Not a directory")
+
+def is_retryable(error):
+    """
+    错误分类：连接断开、超时等可重试；认证失败、主机密钥不符、权限不足、磁盘已满等重试也不会成功
+    """
+    if isinstance(error, HostUnavailableError):
+        return error.retry_after is not None
+    if isinstance(error, (paramiko.AuthenticationException, paramiko.BadHostKeyException)):
+        return False
+    if isinstance(error, (socket.timeout, ConnectionError, EOFError, paramiko.SSHException)):
+        return True
+    if isinstance(error, OSError) and error.errno in FATAL_ERRNOS:
+        return False
+    return not any(message in str(error) for message in FATAL_MESSAGES)
+
+# 传输参数预设：通道窗口、最大包长、加密算法和 MAC 的优先顺序、压缩、SFTP 读请求的并发数、SCP 每次读写的字节数
+# 优先的算法排在 paramiko 支持的其它算法之前，服务器不支持时仍可协商其它算法
+TRANSPORT_PROFILES = {
+    # paramiko 默认值
+    "default": {"window_size": 2 * 1024 * 1024, "max_packet_size": 32 * 1024, "ciphers": (), "macs": (), "compress": False,
+                "sftp_requests": None, "scp_buffer": 16 * 1024},
+    # 低延迟局域网：瓶颈在 CPU，优先 AES-GCM（加密和认证一步完成，不需要单独计算 MAC），大包减少逐包开销
+    # 窗口不宜过大：paramiko 的接收缓冲每次读取都要移动剩余数据，积压越多越慢，超过带宽时延积的窗口只会拖慢读取
+    "lan": {"window_size": 4 * 1024 * 1024, "max_packet_size": 128 * 1024, "ciphers": ("aes128-gcm@openssh.com", "aes128-ctr"),
+            "macs": ("hmac-sha2-256-etm@openssh.com", "hmac-sha2-256"), "compress": False, "sftp_requests": 128, "scp_buffer": 256 * 1024},
+    # 高延迟的广域网：窗口和在途读请求要覆盖带宽时延积，否则每个往返都要停下来等待窗口调整或读请求的回复
+    "wan": {"window_size": 8 * 1024 * 1024, "max_packet_size": 128 * 1024, "ciphers": ("aes128-gcm@openssh.com", "aes128-ctr"),
+            "macs": ("hmac-sha2-256-etm@openssh.com", "hmac-sha2-256"), "compress": False, "sftp_requests": 256, "scp_buffer": 1024 * 1024},
+    # 慢速链路上的文本、日志等可压缩数据：开启 zlib 压缩，用 CPU 换带宽
+    "compressible": {"window_size": 4 * 1024 * 1024, "max_packet_size": 32 * 1024, "ciphers": ("aes128-gcm@openssh.com", "aes128-ctr"),
+                     "macs": ("hmac-sha2-256-etm@openssh.com", "hmac-sha2-256"), "compress": True, "sftp_requests": 128,
+                     "scp_buffer": 256 * 1024},
+}
+PROFILE_PROBE_BYTES = 16 * 1024 * 1024  # auto 模式测量带宽时最多传输的字节数
+PROFILE_PROBE_SECONDS = 1.0  # auto 模式测量带宽最多持续的时间（秒）
+PROFILE_LAN_RTT = 0.005  # 往返延迟低于此值（秒）视为局域网
+PROFILE_SLOW_BANDWIDTH = 2 * 1024 * 1024  # 带宽低于此值（字节/秒）时选择 compressible
+PROFILE_CACHE_SECONDS = 24 * 3600  # auto 模式选定的预设在状态库中缓存的时间（秒），期间重新运行不再测量
+
+def choose_profile(rtt, bandwidth):
+    """
+    auto 模式：根据第一个连接测得的往返延迟和带宽选择传输参数预设；没有测量带宽（bandwidth 为 None）时只按往返延迟选择
+    """
+    if rtt < PROFILE_LAN_RTT:
+        return "lan"
+    if bandwidth is not None and bandwidth < PROFILE_SLOW_BANDWIDTH:
+        return "compressible"
+    return "wan"
+
+def probe_bandwidth(ssh):
+    """
+    测量下行带宽：从远程的 head -c 读取数据，最多 PROFILE_PROBE_BYTES 字节或 PROFILE_PROBE_SECONDS 秒，
+    从收到第一个字节开始计时（不计命令启动的时间）
+    :return: 字节/秒
+    """
+    channel = ssh.get_transport().open_session()
+    try:
+        channel.exec_command(f"head -c {PROFILE_PROBE_BYTES} /dev/zero")
+        data = channel.recv(256 * 1024)
+        started, received = time.time(), 0
+        while data and time.time() - started < PROFILE_PROBE_SECONDS:
+            data = channel.recv(256 * 1024)
+            received += len(data)
+        return received / max(time.time() - started, 1e-6)
+    finally:
+        channel.close()
+
+class SSHConnectionPool:
+    """
+    SSH 连接池：复用到同一台远程服务器的长连接，避免每个文件都重新握手和认证
+    每个连接是一个独立的 SSH transport，SCP/SFTP 通道在其上按需打开
+    """
+    def __init__(self, remote_host, remote_port, remote_user, remote_password, max_sessions=4, timeout=CONNECT_TIMEOUT, keepalive=30,
+                 metrics=None, profile="default", state=None, probe=True):
+        """
+        :param max_sessions: 该主机同时存在的最大连接数，超出时 acquire() 会等待
+        :param timeout: 建立连接、握手和认证的超时时间（秒）
+        :param keepalive: 空闲连接的保活间隔（秒）
+        :param metrics: 传输指标（TransferMetrics），建立连接的耗时计入当前文件的 connect 和 auth 阶段
+        :param profile: 传输参数预设（TRANSPORT_PROFILES 中的名称），auto 表示在第一个连接上测量往返延迟和带宽后自动选择
+        :param state: 传输状态库（TransferState），auto 模式选定的预设缓存在其中，PROFILE_CACHE_SECONDS 内不再测量；None 表示不缓存
+        :param probe: auto 模式是否测量带宽；为 False（试运行）时只按往返延迟选择
+        """
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.remote_user = remote_user
+        self.remote_password = remote_password
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.metrics = metrics if metrics is not None else TransferMetrics()
+        self.host_label = f"{remote_host}:{remote_port}"  # 指标中的主机名
+        self._idle = []  # 空闲连接（后进先出，优先复用最近使用过的连接）
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(max_sessions)
+        self.breaker = CircuitBreaker(self.host_label)
+        self.profile_name = profile
+        # auto 模式下测量用的连接使用 wan 的窗口（比默认值大，不会限制测量结果），测量后切换为选定的预设
+        self.profile = TRANSPORT_PROFILES["wan" if profile == "auto" else profile]
+        self._probe_lock = Lock()
+        self.state = state
+        self.probe = probe
+        self.planned_bytes = None  # 调用方在建立第一个连接前已知的计划传输字节数，小于 PROFILE_PROBE_BYTES 时不测量带宽
+        self.connect_stats = (0, 0.0)  # 已建立的连接数、它们 TCP 连接、握手和认证的累计耗时（秒），并发控制据此判断远程是否过载
+
+    def _transport(self, sock, **kwargs):
+        # 窗口和最大包长在创建 Transport 时指定；算法的优先顺序必须在协商（start_client）之前设置
+        profile = self.profile
+        transport = paramiko.Transport(sock, default_window_size=profile["window_size"], default_max_packet_size=profile["max_packet_size"], **kwargs)
+        options = transport.get_security_options()
+        options.ciphers = tuple(name for name in profile["ciphers"] if name in options.ciphers) + \
+            tuple(name for name in options.ciphers if name not in profile["ciphers"])
+        options.digests = tuple(name for name in profile["macs"] if name in options.digests) + \
+            tuple(name for name in options.digests if name not in profile["macs"])
+        return transport
+
+    def _choose_profile(self, ssh):
+        """
+        auto 模式：在第一个连接上测量往返延迟（几次全局请求中最快的一次）和带宽，选定之后所有连接使用的传输参数预设
+        该连接的加密算法和压缩已经协商完成，只调整它之后打开的通道的窗口和包长
+        带宽测量要传输最多 PROFILE_PROBE_BYTES 字节，只在需要时进行：状态库中有该主机近期的结果时直接使用，
+        往返延迟已判定为局域网、试运行、计划传输的字节数少于测量量时不测量带宽（只按往返延迟选择，不缓存）
+        """
+        with self._probe_lock:
+            if self.profile_name != "auto":
+                return
+            transport = ssh.get_transport()
+            cached = self.state.cached_profile(self.host_label) if self.state is not None else None
+            if cached is not None and time.time() - cached[1] < PROFILE_CACHE_SECONDS:
+                self._apply_profile(transport, cached[0])
+                print(f"传输参数自动选择: {self.host_label} 使用状态库中 {(time.time() - cached[1]) / 3600:.1f} 小时前的测量结果，"
+                      f"预设 {self.profile_name}")
+                return
+            try:
+                rtts = []
+                for _ in range(3):
+                    started = time.time()
+                    transport.global_request("keepalive@openssh.com", wait=True)
+                    rtts.append(time.time() - started)
+                rtt = min(rtts)
+                small = self.planned_bytes is not None and self.planned_bytes < PROFILE_PROBE_BYTES
+                bandwidth = probe_bandwidth(ssh) if rtt >= PROFILE_LAN_RTT and self.probe and not small else None
+            except Exception as e:
+                print(f"无法测量到 {self.host_label} 的链路，使用传输参数预设 wan: {e}")
+                self.profile_name = "wan"
+                return
+            self._apply_profile(transport, choose_profile(rtt, bandwidth))
+            if self.state is not None and (bandwidth is not None or self.profile_name == "lan"):
+                self.state.record_profile(self.host_label, self.profile_name)
+            print(f"传输参数自动选择: {self.host_label} 往返延迟 {rtt * 1000:.1f} 毫秒，"
+                  + (f"带宽约 {format_size(bandwidth)}/s，" if bandwidth is not None else "未测量带宽，")
+                  + f"使用预设 {self.profile_name}")
+
+    def _apply_profile(self, transport, name):
+        self.profile_name = name
+        self.profile = TRANSPORT_PROFILES[name]
+        transport.default_window_size = self.profile["window_size"]
+        transport.default_max_packet_size = self.profile["max_packet_size"]
+
+    def _connect(self):
+        """
+        建立一个新的 SSH 连接；主机已熔断时立即抛出 HostUnavailableError，不等待连接超时
+        """
+        self.breaker.before_connect()
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        print(f"正在连接远程服务器 {self.remote_host}:{self.remote_port}...")
+        started = time.time()
+        try:
+            with self.metrics.phase("connect"):
+                sock = socket.create_connection((self.remote_host, self.remote_port), timeout=self.timeout)
+            try:
+                with self.metrics.phase("auth"):
+                    ssh.connect(self.remote_host, port=self.remote_port, username=self.remote_user, password=self.remote_password,
+                                timeout=self.timeout, banner_timeout=self.timeout, auth_timeout=self.timeout, sock=sock,
+                                compress=self.profile["compress"], transport_factory=self._transport)
+            except BaseException:
+                sock.close()
+                raise
+        except Exception as e:
+            self.breaker.failed(e, fatal=not is_retryable(e))
+            raise
+        self.breaker.succeeded()
+        with self._lock:
+            connections, seconds = self.connect_stats
+            self.connect_stats = (connections + 1, seconds + time.time() - started)
+        ssh.get_transport().set_keepalive(self.keepalive)
+        print(f"成功连接到远程服务器 {self.remote_host}:{self.remote_port}！")
+        if self.profile_name == "auto":
+            self._choose_profile(ssh)
+        return ssh
+
+    @staticmethod
+    def _is_healthy(ssh):
+        """
+        健康检查：transport 仍然活跃且已认证，并且能发出一个 ignore 包
+        """
+        transport = ssh.get_transport()
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def acquire(self):
+        """
+        取出一个可用连接，失效的空闲连接会被关闭并透明地重新建立
+        """
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    ssh = self._idle.pop() if self._idle else None
+                if ssh is None:
+                    return self._connect()
+                if self._is_healthy(ssh):
+                    return ssh
+                print(f"检测到失效连接，正在重新连接 {self.remote_host}:{self.remote_port}...")
+                ssh.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, ssh, discard=False):
+        """
+        归还连接；discard 为 True 或连接已断开时直接关闭
+        """
+        try:
+            transport = ssh.get_transport()
+            if discard or transport is None or not transport.is_active():
+                ssh.close()
+            else:
+                with self._lock:
+                    self._idle.append(ssh)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        with pool.connection() as ssh: ...
+        连接层错误（SSH/socket）时丢弃该连接，其它错误时连接照常归还
+        """
+        ssh = self.acquire()
+        try:
+            yield ssh
+        except (paramiko.SSHException, socket.error, EOFError):
+            self.release(ssh, discard=True)
+            raise
+        except BaseException:
+            self.release(ssh)
+            raise
+        else:
+            self.release(ssh)
+
+    def close_all(self):
+        """
+        关闭所有空闲连接
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ssh in idle:
+            ssh.close()
+
+def parse_time(text):
+    """
+    解析时间，例如 "2024-01-01"、"2024-01-01 12:00" 或 "2024-01-01 12:00:00"（本地时区），空字符串表示不限制
+    :return: Unix 时间戳，或 None
+    """
+    text = text.strip()
+    if not text:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(text, fmt))
+        except ValueError:
+            continue
+    raise ValueError(f"无法识别的时间: {text}")
+
+def list_remote_files(ssh, remote_path, pattern="*", min_size=None, max_size=None, newer_than=None, older_than=None):
+    """
+    用一条命令流式列出远程路径下匹配的文件：文件名模式、大小和修改时间的过滤都由远程的 find 完成，只传回需要的记录；
+    第一条记录是远程路径的类型（不必再单独检查是否存在、是文件还是文件夹），之后是以 NUL 分隔的 "大小 修改时间 路径"，边读边解析
+    :param pattern: 文件名匹配模式（find -name，通配符与 fnmatch 相同）
+    :param min_size: 只列出不小于该字节数的文件，None 表示不限制
+    :param max_size: 只列出不大于该字节数的文件，None 表示不限制
+    :param newer_than: 只列出修改时间晚于该时间戳的文件，None 表示不限制
+    :param older_than: 只列出修改时间不晚于该时间戳的文件，None 表示不限制
+    :return: 生成器：第一项为 "d"（文件夹）、"f"（文件）或 None（不存在），之后生成 (远程文件路径, 大小, 修改时间)
+    """
+    path = shlex.quote(remote_path)
+    filters = [f"-name {shlex.quote(pattern)}"]
+    if min_size:
+        filters.append(f"-size +{int(min_size) - 1}c")
+    if max_size is not None:
+        filters.append(f"-size -{int(max_size) + 1}c")
+    if newer_than is not None:
+        filters.append(f"-newermt @{newer_than:.9f}")
+    if older_than is not None:
+        filters.append(f"! -newermt @{older_than:.9f}")
+    command = (f"if [ -d {path} ]; then printf 'd\\0'; elif [ -f {path} ]; then printf 'f\\0'; else printf '\\0'; exit 0; fi; "
+               f"find {path} -type f {' '.join(filters)} -printf '%s %T@ %p\\0'")
+    stdin, stdout, stderr = ssh.exec_command(command)
+    pending, kind = b"", False
+    while True:
+        chunk = stdout.read(65536)
+        if not chunk:
+            break
+        records = (pending + chunk).split(b"\0")
+        pending = records.pop()  # 最后一段可能是不完整的记录
+        for record in records:
+            if kind is False:
+                kind = record.decode() or None
+                yield kind
+                continue
+            size, mtime, path = record.decode("utf-8", "surrogateescape").split(" ", 2)
+            yield path, int(size), float(mtime)
+    if kind is False:
+        yield None  # 没有任何输出（命令无法执行）
+    if stdout.channel.recv_exit_status() != 0:
+        print(f"Failed to list remote path {remote_path}: {stderr.read().decode().strip()}")
+
+def format_size(num_bytes):
     """
-    检查远程服务器上是否存在目标文件
+    将字节数格式化为易读的字符串
     """
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if num_bytes < 1024 or unit == "TB":
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{int(num_bytes)} B"
+        num_bytes /= 1024
+
+def file_sha256(file_path):
+    """
+    计算本地文件的 SHA-256
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def remote_sha256sums(ssh, remote_paths):
+    """
+    通过一条 xargs sha256sum 命令批量计算远程文件的 SHA-256
+    :return: {远程文件路径: 十六进制摘要}，计算失败的文件不在结果中
+    """
+    if not remote_paths:
+        return {}
+    sums = {}
     try:
-        stdin, stdout, stderr = ssh.exec_command(f"test -e {remote_file_path} && echo exists")
-        return "exists" in stdout.read().decode().strip()
+        stdin, stdout, stderr = ssh.exec_command("xargs -0 sha256sum --")
+        stdin.write(b"\0".join(p.encode("utf-8", "surrogateescape") for p in remote_paths))
+        stdin.channel.shutdown_write()
+        for line in stdout.read().decode("utf-8", "surrogateescape").splitlines():
+            digest, _, path = line.partition("  ")
+            if digest.startswith("\\"):
+                # 文件名包含反斜杠或换行时 sha256sum 会转义输出
+                digest = digest[1:]
+                path = path.replace("\\n", "\n").replace("\\\\", "\\")
+            sums[path] = digest
     except Exception as e:
-        print(f"Failed to check remote file {remote_file_path}: {e}")
+        print(f"Failed to compute remote checksums: {e}")
+    return sums
+
+def pulling_path(local_path):
+    """
+    整个文件一次写完的拉取方式使用的本地临时文件：同一目录下带进程号的隐藏文件，成功后改名为 local_path
+    不用 .part：它是断点续传和分块拉取的进度文件，也可能正是另一个远程文件（例如 foo.part）的目标路径
+    """
+    directory, name = os.path.split(local_path)
+    return os.path.join(directory, f".{name}.{os.getpid()}.pulling")
+
+def local_duplicate(source, target, hardlink=False, mtime=None):
+    """
+    在本地从已拉取的相同内容创建重复文件：hardlink 时创建硬链接，否则复制
+    复制使用 copy_file_range，在支持的文件系统（btrfs、XFS）上由内核共享数据块；先写临时文件再原子重命名
+    :param mtime: 不为 None 时设置为重复文件的修改时间（硬链接与来源共用修改时间，不设置）
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_path = pulling_path(target)
+    if hardlink:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        os.link(source, temp_path)
+    else:
+        with open(source, "rb") as fsrc, open(temp_path, "wb") as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    count = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied, copied, copied)
+                    if not count:
+                        break
+                    copied += count
+            except (AttributeError, OSError):
+                # 没有 copy_file_range 或文件系统不支持时退回普通复制
+                fsrc.seek(copied)
+                fdst.seek(copied)
+                shutil.copyfileobj(fsrc, fdst, CHUNK_IO_SIZE)
+        if mtime is not None:
+            os.utime(temp_path, (mtime, mtime))
+    os.replace(temp_path, target)
+
+def needs_transfer(local_size, local_mtime, remote_entry, sync_mode):
+    """
+    根据同步模式判断文件是否需要传输
+    :param remote_entry: 目标端的 (大小, 修改时间)，不存在时为 None
+    :param sync_mode: all（总是传输）、skip（存在即跳过）、sync（比较大小和修改时间）、checksum（大小相同时再比较校验和）
+    :return: True 需要传输，False 跳过，None 需要进一步比较校验和
+    """
+    if sync_mode == "all" or remote_entry is None:
+        return True
+    if sync_mode == "skip":
         return False
+    remote_size, remote_mtime = remote_entry
+    if local_size != remote_size:
+        return True
+    if sync_mode == "checksum":
+        return None
+    # SCP 保留的时间戳精确到秒
+    return int(local_mtime) != int(remote_mtime)
+
+# 以下增量传输函数会通过 inspect.getsource() 原样发送到远程执行，因此只依赖标准库并在函数内部导入
+DELTA_BLOCK_SIZE = 128 * 1024  # 增量传输的块大小
+DELTA_READ_SIZE = 8 * 1024 * 1024  # 增量匹配时每次读取的字节数
+
+def delta_signatures(f, block_size):
+    """
+    计算接收端文件每个完整块的弱校验和（adler32）和强校验和（MD5）
+    :return: 生成 (弱校验和, 强校验和)
+    """
+    import hashlib, zlib
+    while True:
+        block = f.read(block_size)
+        if len(block) < block_size:
+            break
+        yield zlib.adler32(block), hashlib.md5(block).digest()
+
+def delta_match(f, signatures, block_size, resync_window=65536):
+    """
+    rsync 算法：在发送端文件中查找接收端已有的块
+    先在当前位置整块比较，不匹配时逐字节滚动弱校验和寻找错位的块，
+    滚动超过 block_size + resync_window 仍未匹配则把这一段作为字面数据发送，只有变化区域才需要逐字节滚动
+    :return: 生成 ("copy", 起始块序号, 连续块数)、("literal", 数据)，最后生成 ("end", 整个文件的 SHA-256)
+    """
+    import hashlib, zlib
+    table = {}
+    for index, (weak, strong) in enumerate(signatures):
+        table.setdefault(weak, {}).setdefault(strong, index)
+    digest = hashlib.sha256()
+    buf = bytearray()
+    pos = literal_start = 0
+    eof = False
+    rolling = False
+    rolled = 0
+    a = b = 0
+    copy_start, copy_count = -1, 0
+    while True:
+        if not eof and len(buf) - pos <= block_size:
+            # 丢弃已处理的数据后补充缓冲区
+            del buf[:literal_start]
+            pos -= literal_start
+            literal_start = 0
+            chunk = f.read(DELTA_READ_SIZE)
+            if chunk:
+                digest.update(chunk)
+                buf += chunk
+            else:
+                eof = True
+            continue
+        if len(buf) - pos < block_size:
+            break
+        if not rolling:
+            weak = zlib.adler32(buf[pos:pos + block_size])
+            a, b = weak & 0xFFFF, weak >> 16
+            rolling = True
+        candidates = table.get((b << 16) | a)
+        index = None
+        if candidates:
+            index = candidates.get(hashlib.md5(buf[pos:pos + block_size]).digest())
+        if index is not None:
+            if literal_start < pos:
+                if copy_count:
+                    yield "copy", copy_start, copy_count
+                    copy_count = 0
+                yield "literal", bytes(buf[literal_start:pos])
+            if copy_count and copy_start + copy_count == index:
+                copy_count += 1
+            else:
+                if copy_count:
+                    yield "copy", copy_start, copy_count
+                copy_start, copy_count = index, 1
+            pos += block_size
+            literal_start = pos
+            rolling = False
+            rolled = 0
+            continue
+        if pos + block_size >= len(buf):
+            break
+        if rolled < block_size + resync_window:
+            # 滚动一个字节：移出 buf[pos]，移入 buf[pos + block_size]
+            out_byte, in_byte = buf[pos], buf[pos + block_size]
+            a = (a - out_byte + in_byte) % 65521
+            b = (b - block_size * out_byte + a - 1) % 65521
+            pos += 1
+            rolled += 1
+        else:
+            pos += block_size
+            rolling = False
+            rolled = 0
+        if pos - literal_start >= DELTA_READ_SIZE:
+            if copy_count:
+                yield "copy", copy_start, copy_count
+                copy_count = 0
+            yield "literal", bytes(buf[literal_start:pos])
+            literal_start = pos
+    if copy_count:
+        yield "copy", copy_start, copy_count
+    if literal_start < len(buf):
+        yield "literal", bytes(buf[literal_start:])
+    yield "end", digest.digest()
+
+def write_delta(out, ops):
+    """
+    将增量指令编码写出：C=复制块，L=字面数据，E=结束并附带 SHA-256
+    :return: (字面数据字节数, 复制数据块数)
+    """
+    import struct
+    literal_bytes = copied_blocks = 0
+    for op in ops:
+        if op[0] == "copy":
+            out.write(b"C" + struct.pack(">QI", op[1], op[2]))
+            copied_blocks += op[2]
+        elif op[0] == "literal":
+            out.write(b"L" + struct.pack(">I", len(op[1])))
+            out.write(op[1])
+            literal_bytes += len(op[1])
+        else:
+            out.write(b"E" + op[1])
+    return literal_bytes, copied_blocks
+
+def read_delta(inp):
+    """
+    解码 write_delta() 写出的增量指令
+    """
+    import struct
+    while True:
+        tag = inp.read(1)
+        if tag == b"C":
+            start, count = struct.unpack(">QI", inp.read(12))
+            yield "copy", start, count
+        elif tag == b"L":
+            (length,) = struct.unpack(">I", inp.read(4))
+            yield "literal", inp.read(length)
+        elif tag == b"E":
+            yield "end", inp.read(32)
+            return
+        else:
+            raise EOFError("增量数据流意外结束")
+
+def delta_apply(path, ops, block_size, mtime=None):
+    """
+    接收端：以现有文件为基础按增量指令重建文件，写入同目录临时文件，
+    校验 SHA-256 一致后 fsync 并原子替换原文件
+    """
+    import hashlib, os
+    temp_path = f"{path}.delta.tmp"
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as basis, open(temp_path, "wb") as out:
+            for op in ops:
+                if op[0] == "copy":
+                    basis.seek(op[1] * block_size)
+                    remaining = op[2] * block_size
+                    while remaining:
+                        data = basis.read(min(remaining, 8 * 1024 * 1024))
+                        if not data:
+                            raise EOFError("基础文件在增量传输过程中发生了变化")
+                        digest.update(data)
+                        out.write(data)
+                        remaining -= len(data)
+                elif op[0] == "literal":
+                    digest.update(op[1])
+                    out.write(op[1])
+                elif digest.digest() != op[1]:
+                    raise ValueError("增量重建后的文件校验和不一致")
+                else:
+                    out.flush()
+                    os.fsync(out.fileno())
+                    break
+            else:
+                raise EOFError("增量数据流意外结束")
+        if mtime is not None:
+            os.utime(temp_path, (mtime, mtime))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def delta_helper_main(argv):
+    """
+    远程辅助程序入口（python3 -c 执行）：
+    sig <路径> <块大小>            输出文件的块签名
+    patch <路径> <块大小> <mtime>  从 stdin 读取增量指令并重建文件
+    delta <路径> <块大小>          从 stdin 读取对端签名，输出该文件相对对端的增量指令
+    """
+    import struct, sys
+    mode, path, block_size = argv[1], argv[2], int(argv[3])
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    if mode == "sig":
+        with open(path, "rb") as f:
+            for weak, strong in delta_signatures(f, block_size):
+                stdout.write(struct.pack(">I16s", weak, strong))
+    elif mode == "patch":
+        delta_apply(path, read_delta(stdin), block_size, float(argv[4]))
+        stdout.write(b"OK\n")
+    elif mode == "delta":
+        signatures = []
+        while True:
+            record = stdin.read(20)
+            if len(record) < 20:
+                break
+            signatures.append(struct.unpack(">I16s", record))
+        with open(path, "rb") as f:
+            write_delta(stdout, delta_match(f, signatures, block_size))
+    stdout.flush()
 
-def scp_pull(remote_path, local_path, remote_host, remote_port, remote_user, remote_password, retries=3):
+def delta_helper_command(*args):
     """
-    使用 SCP 从远程服务器拉取文件，支持重试
+    构造在远程执行增量辅助程序的命令（远程需要 python3）
     """
-    for attempt in range(retries):
+    functions = (delta_signatures, delta_match, write_delta, read_delta, delta_apply, delta_helper_main)
+    source = "\n".join([f"DELTA_READ_SIZE = {DELTA_READ_SIZE}"] + [inspect.getsource(fn) for fn in functions])
+    source += "\nimport sys\ndelta_helper_main(sys.argv)\n"
+    return " ".join(["python3", "-c", shlex.quote(source)] + [shlex.quote(str(arg)) for arg in args])
+
+def delta_pull(ssh, remote_path, local_path, mtime, block_size=DELTA_BLOCK_SIZE, limiter=None, digests=None):
+    """
+    增量拉取：本地计算现有文件的块签名发给远程，远程匹配后只返回字面数据和块引用，本地原子地重建文件
+    :param digests: 不为 None 时把重建后文件的 SHA-256（重建时已与远程发来的摘要比较过）记入其中
+    :return: 成功返回 True；远程无法运行辅助程序（例如没有 python3）时返回 False，调用方应回退到完整传输
+    """
+    with open(local_path, "rb") as f:
+        signatures = b"".join(struct.pack(">I16s", weak, strong) for weak, strong in delta_signatures(f, block_size))
+    stdin, stdout, stderr = ssh.exec_command(delta_helper_command("delta", remote_path, block_size))
+    stdin.write(signatures)
+    stdin.channel.shutdown_write()
+
+    stats = {"literal": 0, "copied": 0}
+
+    def counted(ops):
+        for op in ops:
+            if op[0] == "literal":
+                stats["literal"] += len(op[1])
+            elif op[0] == "copy":
+                stats["copied"] += op[2]
+            elif op[0] == "end" and digests is not None:
+                digests[local_path] = op[1].hex()
+            yield op
+
+    try:
+        delta_apply(local_path, counted(read_delta(throttled(stdout, limiter))), block_size, mtime)
+    except Exception:
+        if stdout.channel.recv_exit_status() == 127:
+            print(f"远程无法运行增量辅助程序，回退到完整传输: {remote_path}: {stderr.read().decode().strip()}")
+            return False
+        raise
+    print(f"增量拉取完成: {remote_path} -> {local_path}，接收字面数据 {format_size(stats['literal'])}，复用 {stats['copied']} 个块")
+    return True
+
+METRICS_PREFIX = "pull_files_"  # Prometheus 指标名前缀
+METRICS_INTERVAL = 5  # 只输出 Prometheus 指标文件、不显示进度时的刷新间隔（秒）
+
+class TransferMetrics:
+    """
+    传输指标：记录每个文件各阶段的耗时、字节数、重试次数和错误，按主机汇总字节/秒、文件/秒和队列深度
+    阶段：connect（建立 TCP 连接）、auth（SSH 握手和认证）、check（检查远程文件）、mkdir（创建本地目录）、
+          transfer（传输数据）、close（关闭通道、设置时间、重命名临时文件）
+    每个工作线程在线程本地变量里记录自己正在传输的文件，阶段计时不加锁；
+    字节数由限速器按 RATE_QUANTUM 批量累加，只有批量累加和文件结束时才加锁
+    """
+    PHASES = ("connect", "auth", "check", "mkdir", "transfer", "close")
+
+    def __init__(self, metrics_path=None):
+        """
+        :param metrics_path: 每个文件结束时向该文件追加一行 JSON，None 表示不写
+        """
+        self.started = time.time()
+        self._local = local()
+        self._lock = Lock()
+        self._hosts = {}  # 主机 -> 汇总计数
+        self._queues = {}  # 主机 -> 调度窗口，用于读取队列深度
+        self._log = open(metrics_path, "a", encoding="utf-8") if metrics_path else None
+
+    def _counters(self, host):
+        # 调用方持有 self._lock
+        if host not in self._hosts:
+            self._hosts[host] = {"bytes": 0, "done_bytes": 0, "files": 0, "failed": 0, "retries": 0, "dedup_files": 0, "dedup_bytes": 0,
+                                 "phases": dict.fromkeys(self.PHASES, 0.0)}
+        return self._hosts[host]
+
+    def watch_queue(self, host, file_queue):
+        """
+        登记主机的调度窗口，进度和指标中输出它的队列深度
+        """
+        with self._lock:
+            self._counters(host)
+            self._queues[host] = file_queue
+
+    def start_file(self, host, path, size, files=1):
+        """
+        当前线程开始传输一个文件（或一个包含 files 个文件的打包）
+        """
+        self._local.record = {"host": host, "file": path, "files": files, "bytes": size, "phases": {}, "retries": 0,
+                              "error": None, "started": time.time()}
+
+    def add_phase(self, name, seconds):
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record["phases"][name] = record["phases"].get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        """
+        with metrics.phase("transfer"): ...  耗时计入当前线程正在传输的文件；当前线程没有文件时（例如分块通道）不记录
+        """
+        started = time.perf_counter()
         try:
-            # 创建 SSH 客户端
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            print(f"正在连接远程服务器 {remote_host}:{remote_port}...")
-            ssh.connect(remote_host, port=remote_port, username=remote_user, password=remote_password, timeout=60)  # 设置超时时间
-            print(f"成功连接到远程服务器 {remote_host}:{remote_port}！")
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started)
 
-            # 检查远程文件是否存在
-            if not remote_file_exists(ssh, remote_path):
-                print(f"远程文件不存在: {remote_path}")
-                ssh.close()
+    def record_error(self, error, retrying):
+        """
+        当前线程的文件传输出错；retrying 为 True 时表示还会重试，计入重试次数
+        """
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record["retries"] += 1 if retrying else 0
+            record["error"] = str(error)
+
+    def add_bytes(self, host, size):
+        with self._lock:
+            self._counters(host)["bytes"] += size
+
+    def add_dedup(self, host, files, size):
+        """
+        记录去重：files 个重复文件由目标端从相同内容创建，节省传输 size 字节
+        """
+        with self._lock:
+            counters = self._counters(host)
+            counters["dedup_files"] += files
+            counters["dedup_bytes"] += size
+
+    def finish_file(self, ok, error=None, retrying=False):
+        """
+        当前线程的文件结束：计入汇总，写一行 JSON
+        retrying 为 True 时表示文件已延迟重新放入调度窗口，记为 retry、不计入失败
+        """
+        record = getattr(self._local, "record", None)
+        if record is None:
+            return
+        self._local.record = None
+        record["status"] = "ok" if ok else "retry" if retrying else "failed"
+        if error is not None:
+            record["error"] = str(error)
+        record["seconds"] = round(time.time() - record.pop("started"), 6)
+        record["phases"] = {name: round(seconds, 6) for name, seconds in record["phases"].items()}
+        with self._lock:
+            counters = self._counters(record["host"])
+            if ok:
+                counters["files"] += record["files"]
+                counters["done_bytes"] += record["bytes"]
+            elif not retrying:
+                counters["failed"] += record["files"]
+            counters["retries"] += record["retries"]
+            for name, seconds in record["phases"].items():
+                counters["phases"][name] = counters["phases"].get(name, 0.0) + seconds
+            if self._log is not None:
+                self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._log.flush()
+
+    def snapshot(self):
+        """
+        :return: (已运行秒数, {主机: 汇总计数})，汇总计数包含 bytes_per_second、files_per_second 和 queue_depth
+        """
+        elapsed = max(time.time() - self.started, 1e-6)
+        with self._lock:
+            hosts = {host: dict(counters, phases=dict(counters["phases"])) for host, counters in self._hosts.items()}
+            queues = dict(self._queues)
+        for host, counters in hosts.items():
+            counters["queue_depth"] = queues[host].qsize() if host in queues else 0
+            counters["bytes_per_second"] = counters["bytes"] / elapsed
+            counters["files_per_second"] = counters["files"] / elapsed
+        return elapsed, hosts
+
+    def print_progress(self):
+        """
+        每台主机输出一行进度，速率按距上一次输出之间的增量计算
+        """
+        elapsed, hosts = self.snapshot()
+        previous = getattr(self, "_previous", {})
+        for host, counters in hosts.items():
+            last_elapsed, last_bytes, last_files = previous.get(host, (0.0, 0, 0))
+            interval = max(elapsed - last_elapsed, 1e-6)
+            label = f"[{host}] " if len(hosts) > 1 else ""
+            print(f"{label}进度: 已完成 {counters['files']} 个文件（失败 {counters['failed']} 个），已传输 {format_size(counters['bytes'])}，"
+                  f"当前 {format_size((counters['bytes'] - last_bytes) / interval)}/s，{(counters['files'] - last_files) / interval:.1f} 个文件/秒，"
+                  f"队列中 {counters['queue_depth']} 个任务")
+        self._previous = {host: (elapsed, counters["bytes"], counters["files"]) for host, counters in hosts.items()}
+
+    def write_prometheus(self, path):
+        """
+        以 Prometheus 文本格式写入指标（可由 node_exporter 的 textfile collector 采集），先写临时文件再原子替换
+        """
+        _, hosts = self.snapshot()
+        lines = []
+        for name, kind, key in (("transferred_bytes_total", "counter", "bytes"), ("files_total", "counter", "files"),
+                                ("failed_files_total", "counter", "failed"), ("retries_total", "counter", "retries"),
+                                ("bytes_per_second", "gauge", "bytes_per_second"), ("files_per_second", "gauge", "files_per_second"),
+                                ("queue_depth", "gauge", "queue_depth"), ("dedup_files_total", "counter", "dedup_files"),
+                                ("dedup_saved_bytes_total", "counter", "dedup_bytes")):
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+            lines.extend(f'{METRICS_PREFIX}{name}{{host="{host}"}} {counters[key]}' for host, counters in hosts.items())
+        lines.append(f"# TYPE {METRICS_PREFIX}phase_seconds_total counter")
+        for host, counters in hosts.items():
+            lines.extend(f'{METRICS_PREFIX}phase_seconds_total{{host="{host}",phase="{name}"}} {seconds:.6f}'
+                         for name, seconds in counters["phases"].items())
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+    def report_periodically(self, stop_event, interval, show_progress=True, prom_path=None):
+        """
+        在单独的线程中运行：每 interval 秒输出一行进度、刷新 Prometheus 指标文件，直到 stop_event 被设置
+        """
+        while not stop_event.wait(interval):
+            if show_progress:
+                self.print_progress()
+            if prom_path:
+                self.write_prometheus(prom_path)
+
+    def summary(self):
+        """
+        输出每台主机的汇总：文件数、字节数、失败和重试次数、去重节省的字节数，以及各阶段的累计耗时（时间花在了哪里）
+        """
+        elapsed, hosts = self.snapshot()
+        for host, counters in hosts.items():
+            label = f"[{host}] " if len(hosts) > 1 else ""
+            phases = "，".join(f"{name} {seconds:.1f} 秒" for name, seconds in counters["phases"].items() if seconds)
+            dedup = f"，去重 {counters['dedup_files']} 个文件（节省 {format_size(counters['dedup_bytes'])}）" if counters["dedup_files"] else ""
+            print(f"{label}传输指标: 完成 {counters['files']} 个文件（{format_size(counters['done_bytes'])}），失败 {counters['failed']} 个，"
+                  f"重试 {counters['retries']} 次{dedup}，{counters['files'] / elapsed:.1f} 个文件/秒；各阶段累计耗时: {phases or '无'}")
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+RATE_QUANTUM = 256 * 1024  # 每个限速器积累这么多字节后才向共享令牌桶预约一次，避免每个数据块都争用锁
+RATE_BURST_SECONDS = 0.5  # 令牌桶最多积累这么多秒的令牌
+
+def parse_rate(text):
+    """
+    解析速率，例如 "10M"、"512K"、"1.5G"（字节/秒，不带单位时为字节/秒），空字符串或 0 表示不限速
+    """
+    text = str(text).strip().upper().rstrip("B/S")
+    if not text:
+        return 0
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+def parse_rate_schedule(text):
+    """
+    解析限速时间表，例如 "08:00-20:00=10M,20:00-08:00=100M"，时间段可以跨越午夜
+    :return: [(开始分钟, 结束分钟, 字节/秒), ...]
+    """
+    schedule = []
+    for entry in (text or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        window, rate = entry.split("=")
+        start, end = (int(hour) * 60 + int(minute) for hour, minute in (part.split(":") for part in window.split("-")))
+        schedule.append((start, end, parse_rate(rate)))
+    return schedule
+
+class TokenBucket:
+    """
+    令牌桶：允许透支，透支的字节按速率换算成等待时间
+    预约的先后顺序就是放行的先后顺序，多个线程共享一个桶时按请求公平分配带宽
+    """
+    def __init__(self, rate, schedule=None):
+        """
+        :param rate: 字节/秒，0 表示不限速
+        :param schedule: parse_rate_schedule 的结果，落在某个时间段内时使用该时间段的速率
+        """
+        self.rate = rate
+        self.schedule = schedule or []
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._lock = Lock()
+
+    def current_rate(self):
+        if self.schedule:
+            now = time.localtime()
+            minute = now.tm_hour * 60 + now.tm_min
+            for start, end, rate in self.schedule:
+                if start <= minute < end or (start > end and (minute >= start or minute < end)):
+                    return rate
+        return self.rate
+
+    def reserve(self, size):
+        """
+        预约 size 字节
+        :return: 调用方需要等待的秒数
+        """
+        rate = self.current_rate()
+        if not rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            burst = max(rate * RATE_BURST_SECONDS, RATE_QUANTUM)
+            self._tokens = min(burst, self._tokens + (now - self._last) * rate) - size
+            self._last = now
+            return -self._tokens / rate if self._tokens < 0 else 0
+
+class BandwidthLimiter:
+    """
+    限速器：组合全局、主机和单个文件的令牌桶，同时受所有桶的限制
+    每个线程持有自己的限速器（fork），在本地累计字节数，满 RATE_QUANTUM 才向共享令牌桶预约一次，同时计入传输指标
+    """
+    def __init__(self, buckets, file_rate=0, metrics=None, host=""):
+        """
+        :param buckets: 共享的令牌桶（全局、主机）
+        :param file_rate: 单个文件的速率上限，0 表示不限制
+        :param metrics: 传输指标，累计的字节数同时计入该主机的已传输字节数
+        :param host: 指标中的主机名
+        """
+        self.buckets = [bucket for bucket in buckets if bucket is not None]
+        self.file_rate = file_rate
+        self.metrics = metrics
+        self.host = host
+        self._file_bucket = None
+        self._pending = 0
+
+    def fork(self):
+        """
+        返回共享同一组令牌桶（包括当前文件的令牌桶）的新限速器，供另一个线程使用
+        """
+        limiter = BandwidthLimiter(self.buckets, self.file_rate, self.metrics, self.host)
+        limiter._file_bucket = self._file_bucket
+        return limiter
+
+    def start_file(self):
+        """
+        开始传输一个新文件（或一个打包），单个文件的限速从这里重新计算
+        """
+        self._file_bucket = TokenBucket(self.file_rate) if self.file_rate else None
+        return self
+
+    @property
+    def limited(self):
+        """
+        是否配置了任何限速；没有时限速器只用于统计字节数
+        """
+        return bool(self.buckets or self.file_rate)
+
+    def consume(self, size):
+        self._pending += size
+        if self._pending >= RATE_QUANTUM:
+            size, self._pending = self._pending, 0
+            if self.metrics is not None:
+                self.metrics.add_bytes(self.host, size)
+            buckets = self.buckets + ([self._file_bucket] if self._file_bucket else [])
+            wait = max([bucket.reserve(size) for bucket in buckets], default=0)
+            if wait > 0:
+                time.sleep(wait)
+
+class ThrottledStream:
+    """
+    包装文件或通道对象，每次 read/write 都计入限速器；其它属性和方法直接转发
+    """
+    def __init__(self, stream, limiter):
+        self._stream = stream
+        self._limiter = limiter
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._limiter.consume(len(data))
+        return data
+
+    def write(self, data):
+        self._limiter.consume(len(data))
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __enter__(self):
+        self._stream.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._stream.__exit__(*exc_info)
+
+def throttled(stream, limiter):
+    """
+    有限速器时包装 stream，否则原样返回
+    """
+    return ThrottledStream(stream, limiter) if limiter is not None else stream
+
+class HashingStream:
+    """
+    包装文件或通道对象，把每次 read 读出或 write 写入的数据计入摘要；其它属性和方法直接转发
+    """
+    def __init__(self, stream, digest):
+        self._stream = stream
+        self._digest = digest
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._digest.update(data)
+        return data
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __enter__(self):
+        self._stream.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._stream.__exit__(*exc_info)
+
+def hashing(stream, digest):
+    """
+    有摘要对象时包装 stream，否则原样返回
+    """
+    return HashingStream(stream, digest) if digest is not None else stream
+
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024  # 接收的数据在内存中攒够这么多字节才交给写入线程，一次写入磁盘
+WRITE_QUEUE_BYTES = 256 * 1024 * 1024  # 等待写入磁盘的数据上限，磁盘跟不上时接收方在这里等待，内存占用有界
+WRITE_THREADS = 2  # 写入线程数：不同文件并行写入，同一文件按提交顺序写入（中断后 .part 文件中不会留下空洞）
+SYNC_BATCH_FILES = 256  # 每完成这么多个文件落盘一次
+SYNC_BATCH_SECONDS = 2  # 不足一批时最多间隔这么多秒落盘一次
+FALLOC_FL_KEEP_SIZE = 1  # fallocate 只分配空间、不改变文件长度
+
+try:
+    LIBC = ctypes.CDLL(None, use_errno=True)  # fallocate 和 syncfs 不在 os 模块中
+except (OSError, TypeError):
+    LIBC = None
+
+def preallocate(fd, offset, length):
+    """
+    用 fallocate 预分配 [offset, offset + length) 的磁盘空间：连续分配减少碎片和写入时的元数据更新，
+    磁盘空间不足时在传输开始前就失败；文件长度不变，中断后 .part 文件的长度仍是实际写入的字节数，续传据此判断
+    系统或文件系统不支持时忽略
+    """
+    fallocate = getattr(LIBC, "fallocate", None)
+    if fallocate is None or length <= 0:
+        return
+    if fallocate(fd, FALLOC_FL_KEEP_SIZE, ctypes.c_longlong(offset), ctypes.c_longlong(length)) != 0:
+        error = ctypes.get_errno()
+        if error in (errno.ENOSPC, errno.EDQUOT):
+            raise OSError(error, f"{os.strerror(error)}（预分配 {format_size(length)}）")
+
+def sync_directories(directories):
+    """
+    把这些目录所在文件系统上已写入的数据落盘：每个文件系统一次 syncfs，代替逐个文件 fsync；不支持 syncfs 时用 sync
+    """
+    syncfs = getattr(LIBC, "syncfs", None)
+    if syncfs is None:
+        os.sync()
+        return
+    devices = set()
+    for directory in directories:
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            device = os.fstat(fd).st_dev
+            if device not in devices:
+                devices.add(device)
+                syncfs(fd)
+        finally:
+            os.close(fd)
+
+class LocalWriter:
+    """
+    本地写入阶段：接收线程把数据交给写入线程后立即继续接收，本地磁盘慢时不拖住网络接收，网络和磁盘可以同时跑满
+    所有主机、所有工作线程共用；WriterFile 按已知大小预分配，数据攒够 WRITE_BUFFER_SIZE 才写入一次
+    完成的文件不逐个 fsync：after_sync() 登记的回调（记入任务日志）每 SYNC_BATCH_FILES 个或每 SYNC_BATCH_SECONDS 秒
+    随一次批量落盘（sync_directories）后执行，任务日志中不会有还没落盘的文件
+    """
+    def __init__(self, threads=WRITE_THREADS):
+        self._cond = Condition()
+        self._queue = deque()  # [(WriterFile, 偏移, 数据)]
+        self._queued_bytes = 0
+        self._callbacks = []  # 等待下一次落盘的回调
+        self._dirty = set()  # 下一次落盘需要覆盖的目录
+        self._requested = 0  # flush() 请求的落盘次数
+        self._completed = 0  # 已完成的、覆盖到第几次请求的落盘
+        self._closing = False
+        self.written_bytes = 0
+        self.syncs = 0
+        self._threads = [Thread(target=self._write_loop, daemon=True) for _ in range(threads)]
+        self._threads.append(Thread(target=self._sync_loop, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, file, offset, data):
+        with self._cond:
+            while self._queued_bytes > WRITE_QUEUE_BYTES and not self._closing:
+                self._cond.wait()
+            if not self._closing:
+                self._queue.append((file, offset, data))
+                self._queued_bytes += len(data)
+                file.pending += 1
+                self._cond.notify_all()
                 return
+        # 已关闭（例如主线程被中断）后仍在运行的线程直接写入，不再等待写入线程
+        file.write_at(offset, data)
 
-            # 确保本地目录存在
-            local_dir = os.path.dirname(local_path)
-            os.makedirs(local_dir, exist_ok=True)
+    def wait_file(self, file):
+        """
+        等待 file 已提交的数据全部写入
+        """
+        with self._cond:
+            while file.pending:
+                self._cond.wait()
 
-            # 创建 SCP 客户端
-            print(f"开始拉取文件: {remote_path} -> {local_path}")
-            with SCPClient(ssh.get_transport(), socket_timeout=60) as scp:  # 设置 socket 超时时间
-                scp.get(remote_path, local_path)
-                print(f"文件拉取完成: {remote_path} -> {local_path}")
+    def _next(self):
+        # 取队列中第一个没有其它线程正在写入的文件的数据
+        with self._cond:
+            while True:
+                for i, item in enumerate(self._queue):
+                    if not item[0].writing:
+                        del self._queue[i]
+                        item[0].writing = True
+                        return item
+                if self._closing and not self._queue:
+                    return None
+                self._cond.wait()
 
-            ssh.close()
-            return  # 拉取成功，退出函数
-        except Exception as e:
-            print(f"拉取文件失败 (尝试 {attempt + 1}/{retries}): {remote_path} -> {local_path}")
-            print(f"错误详情: {e}")
-            print("堆栈跟踪:")
-            traceback.print_exc()
-            if attempt < retries - 1:
-                print(f"等待 5 秒后重试...")
-                time.sleep(5)  # 等待 5 秒后重试
+    def _write_loop(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            file, offset, data = item
+            if file.error is None:
+                try:
+                    file.write_at(offset, data)
+                except OSError as e:
+                    file.error = e
+            with self._cond:
+                self._queued_bytes -= len(data)
+                self.written_bytes += len(data)
+                file.writing = False
+                file.pending -= 1
+                finish = file.closing and not file.pending and not file.closed
+                if finish:
+                    file.closed = True
+                self._cond.notify_all()
+            if finish:
+                file.finish()
+
+    def finish_file(self, file):
+        """
+        WriterFile.close() 调用：数据已全部写入时由调用方完成关闭，否则由写完最后一块的写入线程完成
+        :return: 调用方是否需要自己完成关闭
+        """
+        with self._cond:
+            file.closing = True
+            if file.pending or file.closed:
+                return False
+            file.closed = True
+            return True
+
+    def file_finished(self, file):
+        with self._cond:
+            file.finished = True
+            self._cond.notify_all()
+
+    def wait_finished(self, file):
+        with self._cond:
+            while not file.finished:
+                self._cond.wait()
+
+    def after_sync(self, path, callback):
+        """
+        path 所在的文件系统下一次落盘后在落盘线程中调用 callback()
+        """
+        with self._cond:
+            self._callbacks.append(callback)
+            self._dirty.add(os.path.dirname(os.path.abspath(path)))
+            if len(self._callbacks) >= SYNC_BATCH_FILES:
+                self._cond.notify_all()
+
+    def flush(self):
+        """
+        立即落盘，等待此前登记的回调全部执行完
+        """
+        with self._cond:
+            self._requested += 1
+            target = self._requested
+            self._cond.notify_all()
+            while self._completed < target:
+                self._cond.wait()
+
+    def _sync_loop(self):
+        while True:
+            with self._cond:
+                deadline = time.time() + SYNC_BATCH_SECONDS
+                while len(self._callbacks) < SYNC_BATCH_FILES and self._requested == self._completed and not self._closing:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                callbacks, self._callbacks = self._callbacks, []
+                directories, self._dirty = self._dirty, set()
+                requested = self._requested
+                if self._closing and not callbacks and requested == self._completed:
+                    return
+            if directories:
+                try:
+                    sync_directories(directories)
+                except OSError as e:
+                    print(f"本地落盘失败: {e}")
+                self.syncs += 1
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"落盘后记录完成状态失败: {e}")
+            with self._cond:
+                self._completed = max(self._completed, requested)
+                self._cond.notify_all()
+
+    def close(self):
+        """
+        落盘并执行剩余的回调，等待写入线程和落盘线程退出
+        """
+        self.flush()
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def report(self):
+        if self.written_bytes:
+            print(f"本地写入: {format_size(self.written_bytes)}，批量落盘 {self.syncs} 次")
+
+class WriterFile:
+    """
+    写入阶段中的一个本地文件：write() 顺序写入，pwrite() 按偏移写入（分块拉取的多个通道共用一个文件）
+    writer 为 None 时在调用线程中直接写入
+    写入线程中的错误（例如磁盘已满）在之后的 write()、drain() 或 close() 中抛出
+    """
+    def __init__(self, writer, path, size=None, offset=0, truncate=True, replace=None):
+        """
+        :param size: 文件的最终大小，已知时预分配 [offset, size) 的空间
+        :param offset: write() 的起始偏移（续传时为已传输的字节数）
+        :param truncate: 是否把文件截断到 offset；为 False 时保留已有内容，也不预分配（分块续传）
+        :param replace: 不为 None 时 path 是临时文件，全部写入成功后原子重命名为 replace；写入出错或放弃时删除临时文件，
+                        replace 处原有的文件保持不变
+        """
+        self.writer = writer
+        self.path = path
+        self.replace = replace
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            if truncate:
+                os.ftruncate(self.fd, offset)
+                if size is not None:
+                    preallocate(self.fd, offset, size - offset)
+        except BaseException:
+            os.close(self.fd)
+            raise
+        self.position = offset
+        self._buffer = bytearray()
+        self.pending = 0  # 已交给写入线程、还没有写完的块数
+        self.writing = False  # 是否有写入线程正在写这个文件
+        self.error = None
+        self.closing = False  # close() 已调用
+        self.closed = False  # 已由某个线程负责完成关闭
+        self.finished = False  # 关闭已完成
+        self._close_options = (None, None, False)
+
+    def write_at(self, offset, data):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, offset)
+            view, offset = view[written:], offset + written
+
+    def _submit(self, offset, data):
+        if self.writer is None:
+            self.write_at(offset, data)
+        else:
+            self.writer.submit(self, offset, data)
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, data):
+        self._check()
+        self._buffer += data
+        self.position += len(data)
+        if len(self._buffer) >= WRITE_BUFFER_SIZE:
+            self._flush_buffer()
+        return len(data)
+
+    def _flush_buffer(self):
+        if self._buffer:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            self._submit(self.position - len(data), data)
+
+    def pwrite(self, data, offset):
+        self._check()
+        self._submit(offset, bytes(data))
+
+    def truncate(self, size):
+        os.ftruncate(self.fd, size)
+
+    def drain(self):
+        """
+        等待已提交的数据全部写入（之后可以从磁盘读回，例如计算分块的校验和）
+        """
+        self._flush_buffer()
+        if self.writer is not None:
+            self.writer.wait_file(self)
+        self._check()
+
+    def sync(self):
+        """
+        写入并落盘（分块拉取记录已完成的分块之前）
+        """
+        self.drain()
+        os.fdatasync(self.fd)
+
+    def close(self, wait=True, mtime=None, mode=None, discard=False):
+        """
+        写出剩余的数据后关闭文件，并设置权限和修改时间
+        :param wait: 是否等待关闭完成；为 False 时由写入线程在数据写完后关闭，调用方之后用 wait() 检查结果
+        :param discard: 传输出错时为 True：不再重命名，删除临时文件（只对指定了 replace 的文件有效）
+        """
+        if self.closing:
+            if wait:
+                self.wait()
+            return
+        try:
+            self._flush_buffer()
+        except BaseException as e:
+            self.error = self.error or e
+        self._close_options = (mtime, mode, discard)
+        if self.writer is None or self.writer.finish_file(self):
+            self.closing = self.closed = True
+            self.finish()
+        if wait:
+            self.wait()
+
+    def finish(self):
+        mtime, mode, discard = self._close_options
+        try:
+            if self.error is None and mode is not None:
+                os.fchmod(self.fd, mode)
+        except OSError as e:
+            self.error = e
+        finally:
+            os.close(self.fd)
+        try:
+            if self.error is None and not discard:
+                if mtime is not None:
+                    os.utime(self.path, (mtime, mtime))
+                if self.replace is not None:
+                    os.replace(self.path, self.replace)
+        except OSError as e:
+            self.error = e
+        if self.replace is not None and (self.error is not None or discard):
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        if self.writer is None:
+            self.finished = True
+        else:
+            self.writer.file_finished(self)
+
+    def wait(self):
+        """
+        等待 close(wait=False) 完成，写入出错时抛出
+        """
+        if self.writer is not None:
+            self.writer.wait_finished(self)
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+COMPRESS_MODES = ("auto", "on", "off")
+COMPRESS_MIN_SIZE = 64 * 1024  # 不小于该字节数的文件才单独压缩拉取（更小的文件进入打包，由打包整体压缩）
+COMPRESS_LEVEL = 1  # 远程 gzip 的压缩级别：1 级已能得到大部分压缩收益，速度是默认级别的数倍
+COMPRESS_CHUNK_SIZE = 1024 * 1024  # 每次从压缩流读取、解压输出的字节数
+# 远程有 pigz 时用它多线程压缩，否则用 gzip
+REMOTE_GZIP = f'"$(command -v pigz || echo gzip)" -{COMPRESS_LEVEL}'
+# 已经压缩过的格式：不压缩，直接原样拉取
+INCOMPRESSIBLE_EXTENSIONS = frozenset((
+    ".gz", ".tgz", ".bz2", ".xz", ".txz", ".zst", ".lz4", ".lzma", ".zip", ".7z", ".rar", ".jar", ".war", ".apk", ".whl", ".deb", ".rpm",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp3", ".aac", ".ogg", ".opus", ".flac", ".mp4", ".mkv", ".mov", ".avi", ".webm",
+    ".pdf", ".docx", ".xlsx", ".pptx", ".parquet", ".orc",
+))
+
+def compression_enabled(mode, pool):
+    """
+    auto 只在广域网预设（wan）下压缩：局域网上压缩的 CPU 开销大于节省的传输时间，compressible 预设已经在 SSH 层压缩
+    """
+    return mode == "on" or (mode == "auto" and pool.profile_name == "wan")
+
+def gunzip_stream(source, out):
+    """
+    把 source 中连续的多个 gzip 成员（pigz、gzip 的输出或多段拼接）解压写入 out，每次输出不超过 COMPRESS_CHUNK_SIZE 字节
+    :return: 读取的压缩字节数
+    """
+    decompressor = zlib.decompressobj(31)
+    started = False  # 当前成员是否已经读到数据
+    received = 0
+    for data in iter(partial(source.read, COMPRESS_CHUNK_SIZE), b""):
+        received += len(data)
+        while data:
+            started = True
+            out.write(decompressor.decompress(data, COMPRESS_CHUNK_SIZE))
+            data = decompressor.unconsumed_tail
+            if decompressor.eof:
+                data = decompressor.unused_data  # 下一个成员
+                decompressor = zlib.decompressobj(31)
+                started = False
+    if started:
+        out.write(decompressor.flush())
+        if not decompressor.eof:
+            raise IOError("压缩流不完整")
+    return received
+
+def compressed_pull(ssh, remote_path, local_path, mtime=None, limiter=None, digests=None, size=None, writer=None):
+    """
+    压缩拉取单个文件：远程用 pigz 或 gzip 压缩后通过一个 exec 通道发回，本地边读边解压到临时文件，完成后改名
+    :param mtime: 不为 None 时设置到本地文件上
+    :param limiter: 限速器（BandwidthLimiter），按压缩后实际接收的字节数计算
+    :param digests: 不为 None 时把解压后写入本地的文件的 SHA-256 记入其中
+    :param size: 解压后的文件大小，已知时预分配本地空间
+    :param writer: 本地写入阶段（LocalWriter），None 表示在当前线程中写入
+    :return: 成功返回 True；远程无法压缩（没有 gzip、文件不存在等）时返回 False，调用方应回退到 scp
+    """
+    stdin, stdout, stderr = ssh.exec_command(f"{REMOTE_GZIP} -c {shlex.quote(remote_path)}")
+    stdin.close()
+    print(f"开始压缩拉取文件: {remote_path} -> {local_path}")
+    temp_path = pulling_path(local_path)
+    digest = hashlib.sha256() if digests is not None else None
+    try:
+        with hashing(WriterFile(writer, temp_path, size), digest) as f:
+            received = gunzip_stream(throttled(stdout, limiter), f)
+        status = stdout.channel.recv_exit_status()
+        if status != 0:
+            stderr_output = stderr.read().decode().strip()
+            if status == 127 or "No such file" in stderr_output:
+                print(f"远程无法压缩，回退到 scp: {stderr_output}")
+                os.remove(temp_path)
+                return False
+            raise IOError(f"远程压缩失败: {stderr_output}")
+        if mtime is not None:
+            os.utime(temp_path, (mtime, mtime))
+        os.replace(temp_path, local_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if digest is not None:
+        digests[local_path] = digest.hexdigest()
+    print(f"压缩拉取完成: {remote_path} -> {local_path}（接收 {format_size(received)}，解压为 {format_size(os.path.getsize(local_path))}）")
+    return True
+
+TAR_BUFFER_SIZE = 1024 * 1024  # 每次从 tar 流读取的字节数
+TAR_BUNDLE_MAX_FILES = 10000  # 每个打包最多包含的文件数
+
+def tar_pull(bundle, pool, preserve_times=False, limiter=None, digests=None, compress=False, writer=None):
+    """
+    远程将一组小文件打成 tar 流，通过一个 exec 通道发回，本地边读边解出到各自的目标路径，不落盘
+    有写入阶段时解出的文件交给写入线程后立即读下一个成员，最后等待全部写完
+    出错时抛出异常，由工作线程决定延迟重试还是回退到逐个文件拉取
+    :param bundle: [(远程文件路径, 本地文件路径, 大小, 修改时间), ...]
+    :param limiter: 限速器（BandwidthLimiter），None 表示不限速
+    :param digests: 不为 None 时把解出的每个文件的 SHA-256 记入其中（以本地文件路径为键）
+    :param compress: 是否由远程 tar 调用 pigz 或 gzip 压缩 tar 流，本地边读边解压
+    :param writer: 本地写入阶段（LocalWriter），None 表示在当前线程中写入
+    :return: 成功返回 True；远程无法运行 tar 时返回 False，调用方应回退到逐个文件拉取
+    """
+    # GNU tar 会去掉成员名开头的 /
+    targets = {os.path.normpath(remote).lstrip("/"): local for remote, local, _, _ in bundle}
+    names = b"\0".join(remote.encode("utf-8", "surrogateescape") for remote, _, _, _ in bundle)
+
+    def send_names(stdin):
+        # 单独的线程写文件列表，避免 tar 输出填满通道窗口后双方互相等待
+        stdin.write(names)
+        stdin.channel.shutdown_write()
+
+    with pool.connection() as ssh:
+        # 压缩程序由 tar 调用（-I），tar 自己的退出状态不会像管道那样被压缩程序的状态掩盖
+        stdin, stdout, stderr = ssh.exec_command("tar -c -f - --null -T -" + (f' -I "{REMOTE_GZIP}"' if compress else ""))
+        Thread(target=send_names, args=(stdin,), daemon=True).start()
+        outputs = []
+        try:
+            with pool.metrics.phase("transfer"), tarfile.open(fileobj=throttled(stdout, limiter), mode="r|gz" if compress else "r|",
+                                                              bufsize=TAR_BUFFER_SIZE) as tar:
+                for member in tar:
+                    local_file_path = targets.get(os.path.normpath(member.name))
+                    if local_file_path is None or not member.isfile():
+                        continue
+                    os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+                    digest = hashlib.sha256() if digests is not None else None
+                    out = WriterFile(writer, pulling_path(local_file_path), member.size, replace=local_file_path)
+                    outputs.append(out)
+                    shutil.copyfileobj(tar.extractfile(member), hashing(out, digest), TAR_BUFFER_SIZE)
+                    out.close(wait=False, mtime=member.mtime if preserve_times else None)
+                    if digest is not None:
+                        digests[local_file_path] = digest.hexdigest()
+        except BaseException as e:
+            # 正在解出的文件写入临时文件，不会以目标文件名留下不完整的内容，也不会破坏目标处原有的文件
+            if outputs:
+                outputs[-1].close(wait=False, discard=True)
+            if isinstance(e, tarfile.ReadError) and stdout.channel.recv_exit_status() == 127:
+                print(f"远程无法运行 tar，回退到逐个文件拉取: {stderr.read().decode().strip()}")
+                return False
+            raise
+        finally:
+            # 出错时也要关闭已打开的文件；没有出错时等待全部写完，写入错误在这里抛出
+            for out in outputs:
+                out.close(wait=False)
+            for out in outputs:
+                out.wait()
+        extracted = len(outputs)
+        with pool.metrics.phase("close"):
+            status = stdout.channel.recv_exit_status()
+        if status != 0:
+            raise IOError(f"远程 tar 打包失败: {stderr.read().decode().strip()}")
+    print(f"打包拉取完成: {extracted} 个文件")
+    return True
+
+class TransferJournal:
+    """
+    任务日志：以 JSON Lines 追加记录已完成的文件和大文件已完成的分块
+    任务中断后重新运行同一任务时只处理未完成的部分；任务全部成功后删除日志
+    记录以本地目标路径为键，并带上远程文件的大小和修改时间，远程文件变化后旧记录自动失效
+    """
+    def __init__(self, path, on_done=None):
+        """
+        :param on_done: 每个文件记为完成时调用 on_done(目标路径, 大小, 修改时间, SHA-256)，用于写入传输状态库
+        """
+        self.path = path
+        self.on_done = on_done
+        self._lock = Lock()
+        self._done = {}  # {目标路径: (大小, 修改时间)}
+        self._pieces = {}  # {目标路径: ((大小, 修改时间), {已完成分块的偏移})}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 上次中断时可能留下不完整的最后一行
+                    self._apply(record)
+            if self._done or self._pieces:
+                print(f"发现未完成的任务日志 {path}：已完成 {len(self._done)} 个文件，{len(self._pieces)} 个文件有已完成的分块")
+        self._file = None  # 第一次写入时才创建日志文件
+
+    def _apply(self, record):
+        key, signature = record["key"], (record["size"], record["mtime"])
+        if "piece" in record:
+            stored_signature, offsets = self._pieces.get(key, (signature, set()))
+            if stored_signature != signature:
+                offsets = set()
+            offsets.add(record["piece"])
+            self._pieces[key] = (signature, offsets)
+        else:
+            self._done[key] = signature
+            self._pieces.pop(key, None)
+
+    def _append(self, record):
+        with self._lock:
+            self._apply(record)
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def is_done(self, key, size, mtime):
+        return self._done.get(key) == (size, int(mtime))
+
+    def mark_done(self, key, size, mtime, digest=None):
+        self._append({"key": key, "size": size, "mtime": int(mtime)})
+        if self.on_done is not None:
+            self.on_done(key, size, mtime, digest)
+
+    def pieces(self, key, size, mtime):
+        """
+        返回该文件已完成分块的偏移集合（源文件变化后返回空集合）
+        """
+        with self._lock:
+            signature, offsets = self._pieces.get(key, (None, set()))
+            return set(offsets) if signature == (size, int(mtime)) else set()
+
+    def mark_piece(self, key, size, mtime, offset):
+        self._append({"key": key, "size": size, "mtime": int(mtime), "piece": offset})
+
+    def close(self, remove=False):
+        if self._file is not None:
+            self._file.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+STATE_PATH = ".transfer_state.db"  # 默认的传输状态库，推送和拉取共用
+STATE_BATCH_SIZE = 1000  # 状态库每积累这么多条记录提交一次（一个事务）
+STATE_FLUSH_INTERVAL = 5  # 不足一批时最多间隔这么多秒提交一次
+
+class TransferState:
+    """
+    本地传输状态库（SQLite）：跨任务、跨运行记录每台主机上已完成的文件，
+    以 (方向, 主机, 目标路径) 为主键，保存源文件的大小、修改时间和 SHA-256（校验过时）
+    重新运行时据此在本地判断跳过，不必再向远程询问；与远程的完整核对按核对间隔周期进行
+    记录先进入内存缓冲，按批在一个事务中提交，不拖慢传输；按主键查找，百万条记录时仍然很快
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._buffer = []
+        self._flushed = time.time()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS files (direction TEXT, host TEXT, path TEXT, size INTEGER, mtime INTEGER, sha256 TEXT, "
+                         "updated REAL, PRIMARY KEY (direction, host, path)) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS reconciled (direction TEXT, host TEXT, base TEXT, at REAL, "
+                         "PRIMARY KEY (direction, host, base)) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS profiles (host TEXT PRIMARY KEY, profile TEXT, at REAL) WITHOUT ROWID")
+
+    def get(self, direction, host, path):
+        """
+        :return: (大小, 修改时间, SHA-256 或 None)，没有记录时返回 None
+        """
+        with self._lock:
+            return self._db.execute("SELECT size, mtime, sha256 FROM files WHERE direction = ? AND host = ? AND path = ?",
+                                    (direction, host, path)).fetchone()
+
+    def record(self, direction, host, path, size, mtime, digest=None):
+        """
+        记录一个已完成（或已确认与源文件一致）的文件，缓冲满或距上次提交超过 STATE_FLUSH_INTERVAL 秒时提交
+        """
+        with self._lock:
+            self._buffer.append((direction, host, path, size, int(mtime), digest, time.time()))
+            if len(self._buffer) >= STATE_BATCH_SIZE or time.time() - self._flushed >= STATE_FLUSH_INTERVAL:
+                self._flush()
+
+    def _flush(self):
+        # 调用方持有 self._lock
+        if self._buffer:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", self._buffer)
+            self._buffer = []
+        self._flushed = time.time()
+
+    def _under(self, base):
+        # base 目录下所有路径的范围（"0" 是 "/" 之后的字符），走主键索引而不是 LIKE 全表扫描
+        base = os.path.normpath(base).rstrip("/")
+        return base + "/", base + "0"
+
+    def files_under(self, direction, host, base):
+        """
+        :return: {目标路径: (大小, 修改时间)}，base 目录下的所有记录
+        """
+        with self._lock:
+            self._flush()
+            rows = self._db.execute("SELECT path, size, mtime FROM files WHERE direction = ? AND host = ? AND path >= ? AND path < ?",
+                                    (direction, host, *self._under(base)))
+            return {path: (size, mtime) for path, size, mtime in rows}
+
+    def last_reconciled(self, direction, host, base):
+        """
+        :return: 上一次与远程完整核对的时间，从未核对过时返回 None
+        """
+        with self._lock:
+            row = self._db.execute("SELECT at FROM reconciled WHERE direction = ? AND host = ? AND base = ?",
+                                   (direction, host, os.path.normpath(base))).fetchone()
+            return row[0] if row else None
+
+    def reconcile(self, direction, host, base, actual):
+        """
+        与目标端的实际文件核对：删除 base 目录下目标端已不存在或大小不同的记录，并记下核对时间
+        :param actual: {目标路径: (大小, 修改时间)}
+        :return: 删除的记录数
+        """
+        with self._lock:
+            self._flush()
+            rows = self._db.execute("SELECT path, size FROM files WHERE direction = ? AND host = ? AND path >= ? AND path < ?",
+                                    (direction, host, *self._under(base))).fetchall()
+            stale = [(direction, host, path) for path, size in rows if actual.get(path, (None,))[0] != size]
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany("DELETE FROM files WHERE direction = ? AND host = ? AND path = ?", stale)
+                self._db.execute("INSERT OR REPLACE INTO reconciled VALUES (?, ?, ?, ?)", (direction, host, os.path.normpath(base), time.time()))
+            return len(stale)
+
+    def cached_profile(self, host):
+        """
+        :return: (auto 模式为该主机选定的传输参数预设, 选定的时间)，没有记录时返回 None
+        """
+        with self._lock:
+            return self._db.execute("SELECT profile, at FROM profiles WHERE host = ?", (host,)).fetchone()
+
+    def record_profile(self, host, profile):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)", (host, profile, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._db.close()
+
+VERIFY_BATCH_SIZE = 256  # 每批远程校验的文件数上限
+VERIFY_BATCH_BYTES = 1024 * 1024 * 1024  # 每批远程校验的字节数上限，远程需要把这些数据读一遍
+VERIFY_BATCH_WAIT = 2  # 不足一批时最多等待这么多秒就开始校验
+VERIFY_RETRIES = 2  # 校验不一致时最多重新传输的次数
+
+class ChecksumManifest:
+    """
+    校验清单：每个文件校验后追加一行 JSON（主机、路径、大小、本地和远程的 SHA-256、结果）
+    结果为 ok（一致）、retry（不一致，已重新传输）、mismatch（重传次数用尽仍不一致）或 unverified（远程无法计算校验和）
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = Lock()
+        self._file = open(path, "a", encoding="utf-8") if path else None
+
+    def record(self, **fields):
+        if self._file is None:
+            return
+        line = json.dumps(dict(time=round(time.time(), 3), **fields), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+class TransferVerifier:
+    """
+    传输校验：工作线程把边传输边计算的 SHA-256（写入本地的数据）交给它，后台线程攒够一批（或等待 VERIFY_BATCH_WAIT 秒）后
+    通过一条 sha256sum 命令在远程批量计算并比较，不逐个文件执行命令，也不占用工作线程
+    一致的文件才记入任务日志；不一致的重新放回调度窗口，超过 VERIFY_RETRIES 次仍不一致的记为失败
+    """
+    def __init__(self, pool, file_queue, journal=None, failures=None, manifest=None, label=""):
+        self.pool = pool
+        self.file_queue = file_queue
+        self.journal = journal
+        self.failures = failures
+        self.manifest = manifest or ChecksumManifest()
+        self.label = label
+        self.available = True  # 远程能否运行 sha256sum
+        self.stats = {"ok": 0, "retry": 0, "mismatch": 0, "unverified": 0}
+        self._pending = []  # [(远程路径, 本地路径, 大小, 本地摘要, 重传任务, 日志记录)]
+        self._pending_bytes = 0
+        self._outstanding = 0  # 已提交但还没有得出结果的文件数
+        self._requeued = 0  # 上次 drain() 之后重新放回调度窗口的文件数
+        self._attempts = {}  # {远程路径: 已重传次数}
+        self._flush = False
+        self._closed = False
+        self._cond = Condition()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, remote_path, local_path, size, digest, retry, done):
+        """
+        :param retry: 不一致时重新放入调度窗口的 (任务, 大小, 分组)
+        :param done: 一致时记入任务日志的 (键, 大小, 修改时间)
+        """
+        with self._cond:
+            self._pending.append((remote_path, local_path, size, digest, retry, done))
+            self._pending_bytes += size
+            self._outstanding += 1
+            if self._batch_full():
+                self._cond.notify_all()
+
+    def _batch_full(self):
+        return len(self._pending) >= VERIFY_BATCH_SIZE or self._pending_bytes >= VERIFY_BATCH_BYTES
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._pending and (self._flush or self._batch_full()), timeout=VERIFY_BATCH_WAIT)
+                if self._closed and not self._pending:
+                    return
+                batch, self._pending, self._pending_bytes = self._pending, [], 0
+            if not batch:
+                continue
+            try:
+                self._verify(batch)
+            except Exception as e:
+                print(f"{self.label}传输校验出错: {e}")
+            finally:
+                with self._cond:
+                    self._outstanding -= len(batch)
+                    self._cond.notify_all()
+
+    def _verify(self, batch):
+        sums = {}
+        if self.available:
+            try:
+                with self.pool.connection() as ssh:
+                    sums = remote_sha256sums(ssh, [remote_path for remote_path, *_ in batch])
+                    if not sums:
+                        stdin, stdout, stderr = ssh.exec_command("sha256sum --version")
+                        if stdout.channel.recv_exit_status() != 0:
+                            print(f"{self.label}远程无法运行 sha256sum，跳过传输校验")
+                            self.available = False
+            except Exception as e:
+                print(f"{self.label}远程校验失败，本批 {len(batch)} 个文件未校验: {e}")
+                sums = None
+        results = []
+        for remote_path, local_path, size, digest, retry, done in batch:
+            attempt = self._attempts.get(remote_path, 0)
+            remote_digest = sums.get(remote_path) if sums is not None else None
+            if not self.available or sums is None:
+                result = "unverified"
+            elif remote_digest == digest:
+                result = "ok"
+            elif attempt < VERIFY_RETRIES:
+                result = "retry"
+                print(f"{self.label}校验不一致，重新拉取: {remote_path} -> {local_path}")
+            else:
+                result = "mismatch"
+                print(f"{self.label}重传 {attempt} 次后校验仍不一致，放弃: {remote_path} -> {local_path}")
+            self.manifest.record(host=self.pool.host_label, path=remote_path, local=local_path, size=size, sha256=digest,
+                                 remote_sha256=remote_digest, result=result, attempt=attempt + 1)
+            results.append((result, remote_path, local_path, digest, retry, done))
+        with self._cond:
+            for result, remote_path, local_path, digest, retry, done in results:
+                self.stats[result] += 1
+                if result in ("ok", "unverified"):
+                    if self.journal:
+                        self.journal.mark_done(*done, digest=digest)
+                elif result == "retry":
+                    self._attempts[remote_path] = self._attempts.get(remote_path, 0) + 1
+                    self._requeued += 1
+                    item, size, group = retry
+                    self.file_queue.put(item, size, group, block=False)
+                elif self.failures is not None:
+                    self.failures.append(remote_path)
+
+    def drain(self):
+        """
+        立即校验所有已提交的文件并等待结果
+        :return: 这期间重新放回调度窗口的文件数，不为 0 时调用方应再次等待调度窗口清空
+        """
+        with self._cond:
+            self._flush = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._outstanding == 0)
+            self._flush = False
+            requeued, self._requeued = self._requeued, 0
+        return requeued
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def report(self):
+        stats = self.stats
+        if not any(stats.values()):
+            return
+        print(f"{self.label}传输校验: {stats['ok']} 个文件一致，重新拉取 {stats['retry']} 次，{stats['mismatch']} 个文件校验失败"
+              + (f"，{stats['unverified']} 个文件未能校验" if stats["unverified"] else ""))
+
+RESUME_VERIFY_SIZE = 1024 * 1024  # 断点续传时校验已传输部分末尾的字节数
+
+def local_range_sha256(file_path, offset, length):
+    """
+    计算本地文件某个字节范围的 SHA-256
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        digest.update(f.read(length))
+    return digest.hexdigest()
+
+def remote_range_sha256(ssh, remote_path, offset, length):
+    """
+    在远程计算文件某个字节范围的 SHA-256（tail -c +N 会直接定位，不读取前面的数据）
+    """
+    path = shlex.quote(remote_path)
+    stdin, stdout, stderr = ssh.exec_command(f"tail -c +{offset + 1} {path} | head -c {length} | sha256sum")
+    return stdout.read().decode().split(" ")[0]
+
+def resumable_pull(remote_path, local_path, pool, mtime=None, limiter=None, digests=None, writer=None):
+    """
+    可续传拉取：数据先写入本地 .part 临时文件，重试或重新运行时从其当前长度继续，
+    续传前比较已传输部分末尾一段数据的校验和，不一致则从头开始；完成后原子重命名
+    :param mtime: 不为 None 时设置为本地文件的修改时间
+    :param digests: 不为 None 时把整个文件的 SHA-256 记入其中（续传时已传输的部分从临时文件补算）
+    :param writer: 本地写入阶段（LocalWriter），None 表示在当前线程中写入
+    """
+    metrics = pool.metrics
+    temp_path = f"{local_path}.part"
+    with metrics.phase("mkdir"):
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    with pool.connection() as ssh, ssh.open_sftp() as sftp:
+        with metrics.phase("check"):
+            size = sftp.stat(remote_path).st_size
+            offset = os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
+            if offset > size:
+                offset = 0
+            if offset:
+                verify_start = max(0, offset - RESUME_VERIFY_SIZE)
+                if remote_range_sha256(ssh, remote_path, verify_start, offset - verify_start) == local_range_sha256(temp_path, verify_start, offset - verify_start):
+                    print(f"断点续传: {remote_path} -> {local_path}，从 {format_size(offset)} 处继续")
+                else:
+                    print(f"已传输部分校验不一致，从头开始拉取: {remote_path} -> {local_path}")
+                    offset = 0
             else:
-                print(f"重试次数已达上限，放弃拉取: {remote_path} -> {local_path}")
+                print(f"开始拉取文件: {remote_path} -> {local_path}")
+
+        digest = hashlib.sha256() if digests is not None else None
+        if digest is not None and offset:
+            digest_file_range(digest, temp_path, 0, offset)
+        with metrics.phase("transfer"), sftp.open(remote_path, "r") as remote_file, \
+                hashing(WriterFile(writer, temp_path, size, offset), digest) as local_file:
+            if limiter is None or not limiter.limited:
+                remote_file.seek(offset)
+                remote_file.prefetch(size, pool.profile["sftp_requests"])  # 从当前位置起流水线发出读请求，在途请求数由传输参数预设限制
+                for data in iter(lambda: remote_file.read(CHUNK_IO_SIZE), b""):
+                    if limiter is not None:
+                        limiter.consume(len(data))
+                    local_file.write(data)
+            else:
+                for _, data in limited_reads(remote_file, offset, size, limiter):
+                    local_file.write(data)
+
+    with metrics.phase("close"):
+        if mtime is not None:
+            os.utime(temp_path, (mtime, mtime))
+        os.replace(temp_path, local_path)
+    if digest is not None:
+        digests[local_path] = digest.hexdigest()
+    print(f"文件拉取完成: {remote_path} -> {local_path}")
+
+CHUNK_PIECE_SIZE = 64 * 1024 * 1024  # 分块传输时每个任务领取的字节范围
+CHUNK_IO_SIZE = 1024 * 1024  # 分块传输时每次读写的字节数
+CHUNK_HASH_BUFFER = 256 * 1024 * 1024  # 分块传输计算校验和时最多暂存的乱序数据字节数，超过时从文件读取
+RATE_READV_BATCH = 4  # 限速时每次流水线发出的读请求数（每个 CHUNK_IO_SIZE 字节）
+
+def limited_reads(remote_file, offset, end, limiter):
+    """
+    限速读取远程文件的 [offset, end) 范围：每次先为 RATE_READV_BATCH 个读请求预约令牌再流水线发出
+    不能先全速预读再按限速消费，读回的数据在 paramiko 的预读缓冲区里积压时读取会显著变慢，内存也随之增长
+    :return: 逐个产生 ((起始偏移, 长度), 数据)
+    """
+    batch_size = RATE_READV_BATCH * CHUNK_IO_SIZE
+    for batch_start in range(offset, end, batch_size):
+        requests = [(start, min(CHUNK_IO_SIZE, end - start)) for start in range(batch_start, min(end, batch_start + batch_size), CHUNK_IO_SIZE)]
+        limiter.consume(sum(length for _, length in requests))
+        yield from zip(requests, remote_file.readv(requests))
+
+def digest_file_range(digest, file_path, offset, length):
+    """
+    把本地文件 [offset, offset + length) 范围的数据计入摘要，每次读取 CHUNK_IO_SIZE 字节
+    """
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        while length:
+            data = f.read(min(CHUNK_IO_SIZE, length))
+            if not data:
+                raise EOFError(f"本地文件在计算校验和时被截断: {file_path}")
+            digest.update(data)
+            length -= len(data)
+
+class PieceHasher:
+    """
+    分块传输时计算整个文件的 SHA-256：摘要必须按偏移顺序计算，而各通道乱序传输分块
+    通道把读出的数据交给 feed()，后台线程按偏移顺序计入摘要；还没轮到的分块暂存在内存中，不必传输后再读一遍本地临时文件
+    暂存超过 buffer_limit 字节时新到的分块不再暂存，轮到它时从本地临时文件读取；断点续传跳过的分块同样从本地临时文件读取
+    hashlib 计算大块数据时释放 GIL，不会拖慢传输线程
+    """
+    def __init__(self, file_path, size, piece_size, done=(), buffer_limit=CHUNK_HASH_BUFFER):
+        self.file_path = file_path
+        self.size = size
+        self.piece_size = piece_size
+        self.buffer_limit = buffer_limit
+        self._digest = hashlib.sha256()
+        self._complete = set(done)
+        self._from_file = set(done)  # 完成后从文件读取的分块
+        self._chunks = {}  # {分块偏移: deque([数据, ...])}，已读出、还没计入摘要的数据
+        self._buffered = 0
+        self._head = 0  # 正在计入摘要的分块偏移
+        self._aborted = False
+        self._error = None
+        self._cond = Condition()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def feed(self, offset, data):
+        """
+        交给分块 offset 紧接着上一次读出的数据（每个分块由一个通道从头到尾顺序读出）
+        """
+        with self._cond:
+            if self._aborted or offset in self._from_file:
+                return
+            if offset != self._head and self._buffered + len(data) > self.buffer_limit:
+                self._from_file.add(offset)
+                self._buffered -= sum(len(chunk) for chunk in self._chunks.pop(offset, ()))
+                return
+            self._chunks.setdefault(offset, deque()).append(data)
+            self._buffered += len(data)
+            self._cond.notify_all()
+
+    def from_file(self, offset):
+        """
+        分块 offset 是否在完成后从文件读取；在这个分块的 feed() 全部调用之后才确定
+        """
+        with self._cond:
+            return offset in self._from_file
+
+    def complete(self, offset):
+        with self._cond:
+            self._complete.add(offset)
+            self._cond.notify_all()
+
+    def abort(self):
+        with self._cond:
+            self._aborted = True
+            self._chunks.clear()
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            for offset in range(0, self.size, self.piece_size):
+                while True:
+                    with self._cond:
+                        self._head = offset
+                        self._cond.wait_for(lambda: self._aborted or offset in self._complete or self._chunks.get(offset))
+                        if self._aborted:
+                            return
+                        # 分块完成前的 feed() 都已放入 _chunks，取走后若已完成即可计算下一个分块
+                        chunks = self._chunks.pop(offset, ())
+                        self._buffered -= sum(len(chunk) for chunk in chunks)
+                        finished = offset in self._complete
+                        from_file = offset in self._from_file
+                    if from_file:
+                        digest_file_range(self._digest, self.file_path, offset, min(self.piece_size, self.size - offset))
+                        break
+                    for chunk in chunks:
+                        self._digest.update(chunk)
+                    if finished:
+                        break
+        except Exception as e:
+            self._error = e
+
+    def hexdigest(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._digest.hexdigest()
 
-def worker(file_queue, local_base_path, remote_host, remote_port, remote_user, remote_password, stop_event):
+def chunked_pull(remote_path, local_path, pool, streams, mtime=None, journal=None, limiter=None, digests=None, writer=None):
+    """
+    分块并发拉取大文件：按字节范围切分，多个连接各自打开 SFTP 句柄按偏移读取，
+    写入预先分配好大小的本地临时文件，全部完成后原子重命名为目标文件
+    :param streams: 并发通道数，每个通道从连接池获取一个连接
+    :param mtime: 不为 None 时设置为本地文件的修改时间
+    :param journal: 任务日志，记录已完成的分块，重试或重新运行时跳过这些分块
+    :param limiter: 限速器，每个通道使用它的一个副本（fork）
+    :param digests: 不为 None 时把整个文件的 SHA-256 记入其中，由 PieceHasher 用接收的数据计算
+    :param writer: 本地写入阶段（LocalWriter），所有通道共用一个 WriterFile；None 表示在各通道线程中写入
+    """
+    with pool.connection() as ssh, ssh.open_sftp() as sftp, pool.metrics.phase("check"):
+        remote_stat = sftp.stat(remote_path)
+    size = remote_stat.st_size
+    temp_path = f"{local_path}.part"
+    with pool.metrics.phase("mkdir"):
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    done = journal.pieces(local_path, size, remote_stat.st_mtime) if journal else set()
+    if done and not (os.path.exists(temp_path) and os.path.getsize(temp_path) == size):
+        done = set()
+    if done:
+        print(f"断点续传: {remote_path} -> {local_path}，跳过已完成的 {len(done)} 个分块")
+        out = WriterFile(writer, temp_path, truncate=False)
+    else:
+        out = WriterFile(writer, temp_path, size)
+        out.truncate(size)
+
+    pending = Queue()
+    for offset in range(0, size, CHUNK_PIECE_SIZE):
+        if offset not in done:
+            pending.put((offset, min(CHUNK_PIECE_SIZE, size - offset)))
+
+    def stream():
+        stream_limiter = limiter.fork() if limiter is not None else None
+        with pool.connection() as ssh, ssh.open_sftp() as sftp, sftp.open(remote_path, "r") as remote_file:
+            while True:
+                try:
+                    offset, length = pending.get_nowait()
+                except Empty:
+                    return
+                # readv 会把多个读请求流水线化发出，而不是一问一答
+                pieces = [(start, min(CHUNK_IO_SIZE, offset + length - start)) for start in range(offset, offset + length, CHUNK_IO_SIZE)]
+                if stream_limiter is not None and stream_limiter.limited:
+                    reads = limited_reads(remote_file, offset, offset + length, stream_limiter)
+                else:
+                    reads = zip(pieces, remote_file.readv(pieces, pool.profile["sftp_requests"]))
+                for (start, piece_length), data in reads:
+                    if len(data) != piece_length:
+                        raise EOFError(f"远程文件在传输过程中被截断: {remote_path}")
+                    out.pwrite(data, start)
+                    if hasher is not None:
+                        hasher.feed(offset, data)
+                    if stream_limiter is not None and not stream_limiter.limited:
+                        stream_limiter.consume(len(data))  # 只统计字节数
+                if journal:
+                    out.sync()  # 分块落盘后才记为完成
+                    journal.mark_piece(local_path, size, remote_stat.st_mtime, offset)
+                elif hasher is not None and hasher.from_file(offset):
+                    out.drain()  # PieceHasher 从磁盘读回这个分块
+                if hasher is not None:
+                    hasher.complete(offset)
+
+    print(f"开始分块拉取文件: {remote_path} -> {local_path}（{format_size(size)}，{streams} 路并发）")
+    started = time.time()
+    hasher = PieceHasher(temp_path, size, CHUNK_PIECE_SIZE, done) if digests is not None else None
+    try:
+        with pool.metrics.phase("transfer"), ThreadPoolExecutor(max_workers=streams) as executor:
+            for future in [executor.submit(stream) for _ in range(min(streams, pending.qsize()))]:
+                future.result()
+        with pool.metrics.phase("close"):
+            out.close(mtime=mtime)
+    except Exception:
+        out.close(wait=False)
+        if hasher is not None:
+            hasher.abort()
+        raise
+    if hasher is not None:
+        digests[local_path] = hasher.hexdigest()
+
+    with pool.metrics.phase("close"):
+        os.replace(temp_path, local_path)
+    elapsed = max(time.time() - started, 1e-6)
+    print(f"分块拉取完成: {remote_path} -> {local_path}，耗时 {elapsed:.1f} 秒，总吞吐 {format_size(size / elapsed)}/s")
+
+def scp_read_line(channel):
+    """
+    读取 scp 协议的一行控制消息；发送方在收到确认前不会发送后续数据，一次可以多读
+    """
+    line = b""
+    while not line.endswith(b"\n"):
+        data = channel.recv(1024)
+        if not data:
+            break
+        line += data
+    return line
+
+def scp_receive(ssh, remote_path, local_path, preserve_times=False, buffer_size=16 * 1024, limiter=None, digest=None, writer=None):
+    """
+    用 scp 协议（远程 scp -f）接收单个文件，数据经过本地写入阶段写入 local_path，权限与远程文件一致
+    代替 SCPClient.get：后者自己打开本地文件写入，无法预分配空间，也无法把写入交给写入线程
+    :param preserve_times: 是否在本地保留远程文件的修改时间
+    :param buffer_size: 每次从通道读取的字节数
+    :param limiter: 限速器（BandwidthLimiter），None 表示不限速
+    :param digest: 不为 None 时把接收的数据计入其中
+    :param writer: 本地写入阶段（LocalWriter），None 表示在当前线程中写入
+    :return: 成功返回 True；远程文件不存在时返回 False
+    """
+    channel = ssh.get_transport().open_session()
+    channel.settimeout(SOCKET_TIMEOUT)
+    try:
+        channel.exec_command(f"scp -f {'-p ' if preserve_times else ''}{shlex.quote(remote_path)}")
+        channel.sendall(b"\0")
+        mtime = None
+        header = scp_read_line(channel)
+        if header.startswith(b"T"):
+            mtime = int(header[1:].split()[0])
+            channel.sendall(b"\0")
+            header = scp_read_line(channel)
+        if header[:1] in (b"\x01", b"\x02"):
+            message = header[1:].decode(errors="replace").strip()
+            if "No such file" in message:
+                return False
+            raise IOError(f"远程 scp 失败: {message}")
+        if not header.startswith(b"C"):
+            stderr_output = channel.recv_stderr(4096).decode(errors="replace").strip() if channel.recv_stderr_ready() else ""
+            raise IOError(f"远程 scp 没有返回文件: {stderr_output or header[:80]!r}")
+        mode, length, _ = header[1:].decode(errors="replace").split(" ", 2)
+        mode, length = int(mode, 8), int(length)
+        channel.sendall(b"\0")
+
+        out = WriterFile(writer, pulling_path(local_path), length, replace=local_path)
+        try:
+            sink = hashing(out, digest)
+            remaining = length
+            while remaining:
+                data = channel.recv(min(buffer_size, remaining))
+                if not data:
+                    raise EOFError(f"scp 传输在 {format_size(length - remaining)} 处中断: {remote_path}")
+                if limiter is not None:
+                    limiter.consume(len(data))
+                sink.write(data)
+                remaining -= len(data)
+            status = channel.recv(1)
+            if status != b"\0":
+                message = scp_read_line(channel).decode(errors="replace").strip()
+                raise IOError(f"远程 scp 读取文件失败: {message or status!r}")
+        except BaseException:
+            out.close(wait=False, discard=True)
+            raise
+        out.close(mtime=mtime if preserve_times else None, mode=mode)
+        channel.sendall(b"\0")
+    finally:
+        channel.close()
+    return True
+
+def scp_pull(remote_path, local_path, pool, preserve_times=False, method="scp", mtime=None, chunk_streams=4, journal=None,
+             limiter=None, digests=None, size=None, writer=None):
+    """
+    使用 SCP 从远程服务器拉取文件
+    连接从连接池中获取，传输结束后归还以供复用；出错时抛出异常，由工作线程按错误类型决定是否延迟重试
+    :param preserve_times: 是否在本地保留远程文件的修改时间（增量同步依赖它）
+    :param method: scp（完整传输）、delta（本地已有旧版本，尝试只传输变化的块）、chunked（大文件分块并发传输）、
+                   compressed（远程压缩、本地解压）或 resumable（写入本地 .part 临时文件，可断点续传）
+    :param mtime: 远程文件的修改时间，增量重建或分块传输后设置到本地文件上
+    :param chunk_streams: chunked 方式的并发通道数
+    :param journal: 任务日志，chunked 方式用它记录已完成的分块
+    :param limiter: 限速器（BandwidthLimiter），None 表示不限速
+    :param digests: 不为 None 时把写入本地的文件的 SHA-256 记入其中
+    :param size: 远程文件的大小，compressed 方式用它预分配本地空间
+    :param writer: 本地写入阶段（LocalWriter），None 表示在当前线程中写入
+    :return: 拉取成功时返回 True，放弃时返回 False
+    """
+    if method == "chunked":
+        chunked_pull(remote_path, local_path, pool, chunk_streams, mtime=mtime if preserve_times else None, journal=journal,
+                     limiter=limiter, digests=digests, writer=writer)
+        return True
+    if method == "resumable":
+        resumable_pull(remote_path, local_path, pool, mtime=mtime if preserve_times else None, limiter=limiter, digests=digests,
+                       writer=writer)
+        return True
+
+    metrics = pool.metrics
+    with pool.connection() as ssh:
+        # 确保本地目录存在
+        local_dir = os.path.dirname(local_path)
+        with metrics.phase("mkdir"):
+            os.makedirs(local_dir, exist_ok=True)
+
+        if method == "delta":
+            with metrics.phase("transfer"):
+                if delta_pull(ssh, remote_path, local_path, mtime, limiter=limiter, digests=digests):
+                    return True
+
+        if method == "compressed":
+            with metrics.phase("transfer"):
+                if compressed_pull(ssh, remote_path, local_path, mtime if preserve_times else None, limiter=limiter, digests=digests,
+                                   size=size, writer=writer):
+                    return True
+
+        # 在已有连接上打开新通道
+        print(f"开始拉取文件: {remote_path} -> {local_path}")
+        digest = hashlib.sha256() if digests is not None else None
+        with metrics.phase("transfer"):
+            received = scp_receive(ssh, remote_path, local_path, preserve_times=preserve_times, buffer_size=pool.profile["scp_buffer"],
+                                   limiter=limiter, digest=digest, writer=writer)
+        if not received:
+            # 文件列表已确认存在，不再逐个文件预先检查；列出之后才被删除的文件由 scp 的错误识别
+            print(f"远程文件不存在: {remote_path}")
+            return False
+        if digest is not None:
+            digests[local_path] = digest.hexdigest()
+        print(f"文件拉取完成: {remote_path} -> {local_path}")
+
+    return True
+
+def worker(file_queue, local_base_path, pool, stop_event, sync_mode="all", chunk_streams=4, journal=None, failures=None, limiter=None,
+           verifier=None, compress="off", index=0, controller=None, writer=None):
     """
     工作线程：从队列中获取文件并拉取
+    成功的文件记入任务日志，放弃的文件记入 failures，每个文件或打包的耗时和结果记入连接池的传输指标
+    可重试的错误不在线程内等待：任务通过 file_queue.retry() 延迟放回，线程直接处理下一个任务
+    limiter 不为 None 时，每个线程使用它的一个副本（fork），每个文件或打包单独计算单文件限速
+    verifier 不为 None 时，传输中计算的 SHA-256 交给它批量校验，校验一致后才记入任务日志
+    compress 是压缩方式 auto/on/off，见 compression_enabled()，决定打包是否压缩
+    controller 不为 None 时，编号 index 不小于它当前允许的并发数的线程暂停取任务
+    writer 不为 None 时，本地写入交给写入阶段，文件随下一次批量落盘后才记入任务日志或交给 verifier
     """
+    if limiter is not None:
+        limiter = limiter.fork()
+    metrics = pool.metrics
+
+    def record(remote_path, local_path, size, mtime, method, digest):
+        done = (os.path.normpath(local_path), size, mtime)
+        if verifier is not None and digest is not None:
+            # 重传时分块和可续传方式保持不变，其它方式（包括打包和增量）都完整拉取单个文件
+            retry = ((remote_path, local_path, method if method in ("chunked", "resumable") else "scp", size, mtime), size,
+                     os.path.dirname(local_path))
+            verifier.add(remote_path, local_path, size, digest, retry, done)
+        elif journal:
+            journal.mark_done(*done)
+
+    def finished(remote_path, local_path, size, mtime, method, digests):
+        digest = digests.get(local_path) if digests is not None else None
+        if writer is not None:
+            writer.after_sync(local_path, partial(record, remote_path, local_path, size, mtime, method, digest))
+        else:
+            record(remote_path, local_path, size, mtime, method, digest)
+
+    def retry_later(item, size, group, key, error):
+        # 可重试的错误延迟放回调度窗口；不可重试或次数已用完时返回 False
+        retryable = is_retryable(error)
+        unavailable = isinstance(error, HostUnavailableError)
+        delay = file_queue.retry(item, size, group, key, error.retry_after if unavailable else None, count=not unavailable) if retryable else None
+        metrics.record_error(error, retrying=delay is not None and not unavailable)
+        if delay is not None:
+            if not unavailable:  # 熔断期间的等待由熔断器统一输出
+                print(f"拉取失败，{delay:.1f} 秒后重试: {key}，错误: {error}")
+        elif retryable:
+            print(f"重试次数已达上限，放弃拉取: {key}，错误: {error}")
+        else:
+            print(f"不可重试的错误，放弃拉取: {key}，错误: {error}")
+        return delay is not None
+
     while not stop_event.is_set():
+        if controller is not None and not controller.admit(index, stop_event):
+            break
         try:
             # 从队列中获取任务，设置超时时间
-            remote_file_path, local_file_path = file_queue.get(timeout=5)  # 设置超时时间
+            # 打包任务的 remote_file_path 是 [(远程文件路径, 本地文件路径, 大小, 修改时间), ...]
+            remote_file_path, local_file_path, method, size, mtime = file_queue.get(timeout=5)  # 设置超时时间
             try:
-                scp_pull(remote_file_path, local_file_path, remote_host, remote_port, remote_user, remote_password)
+                digests = {} if verifier is not None else None
+                if method == "bundle":
+                    bundle_size = sum(file_size for _, _, file_size, _ in remote_file_path)
+                    metrics.start_file(pool.host_label, local_base_path, bundle_size, files=len(remote_file_path))
+                    try:
+                        ok = tar_pull(remote_file_path, pool, preserve_times=sync_mode != "all",
+                                      limiter=limiter.start_file() if limiter is not None else None, digests=digests,
+                                      compress=compression_enabled(compress, pool), writer=writer)
+                    except Exception as e:
+                        if retry_later((remote_file_path, None, method, None, None), bundle_size, None, remote_file_path[0][0], e):
+                            metrics.finish_file(False, e, retrying=True)
+                            continue
+                        ok = False
+                    if ok:
+                        metrics.finish_file(True)
+                        for remote_path, local_path, file_size, file_mtime in remote_file_path:
+                            finished(remote_path, local_path, file_size, file_mtime, method, digests)
+                        continue
+                    files, method = remote_file_path, "scp"  # 回退到逐个文件拉取，打包的记录被逐个文件的记录取代
+                else:
+                    files = [(remote_file_path, local_file_path, size, mtime)]
+                for remote_path, local_path, file_size, file_mtime in files:
+                    metrics.start_file(pool.host_label, remote_path, file_size)
+                    try:
+                        ok = scp_pull(remote_path, local_path, pool, preserve_times=sync_mode != "all", method=method, mtime=file_mtime,
+                                      chunk_streams=chunk_streams, journal=journal,
+                                      limiter=limiter.start_file() if limiter is not None else None, digests=digests, size=file_size,
+                                      writer=writer)
+                    except Exception as e:
+                        if retry_later((remote_path, local_path, method, file_size, file_mtime), file_size, os.path.dirname(local_path),
+                                       remote_path, e):
+                            metrics.finish_file(False, e, retrying=True)
+                            continue
+                        metrics.finish_file(False, e)
+                        ok = None
+                    else:
+                        metrics.finish_file(ok)
+                    if ok:
+                        finished(remote_path, local_path, file_size, file_mtime, method, digests)
+                    elif failures is not None:
+                        failures.append(remote_path)
             except Exception as e:
+                metrics.finish_file(False, e)
                 print(f"拉取文件失败: {remote_file_path} -> {local_file_path}, 错误: {e}")
+                if failures is not None:
+                    if isinstance(remote_file_path, list):  # 打包任务
+                        failures.extend(path for path, _, _, _ in remote_file_path)
+                    else:
+                        failures.append(remote_file_path)
             finally:
                 file_queue.task_done()  # 确保任务完成
+        except Empty:
+            continue  # 枚举线程可能还在产生任务，直到收到退出通知
         except Exception as e:
             print(f"工作线程错误: {e}")
             break  # 退出线程
 
-def pull_files(remote_path, pattern, remote_host, remote_port, remote_user, remote_password, local_base_path, threads):
+SCHEDULE_POLICIES = ("fifo", "largest", "interleave", "locality")
+SCHEDULE_DEFAULT_RATE = 10 * 1024 * 1024  # 还没有完成的任务可供估算时，假定每个工作线程的吞吐（字节/秒）
+SCHEDULE_DEFAULT_OVERHEAD = 0.05  # 同上，假定每个任务的固定开销（秒）
+SCHEDULE_MIN_SAMPLE_BYTES = 16 * 1024 * 1024  # 已完成的字节数少于此值时不根据样本估算吞吐
+
+class TransferScheduler:
+    """
+    传输调度器：位于枚举线程和工作线程之间，代替普通队列
+    枚举线程放入的任务先进入一个有界的前瞻窗口，工作线程取任务时按调度策略从窗口中挑选：
+      fifo        按枚举顺序
+      largest     最大的任务优先，避免几个大文件最后才开始、拖长整体耗时
+      interleave  大小任务交替，大文件占满带宽的同时小文件的固定开销被摊薄
+      locality    同一目录的任务连续发出，目录之间按最大任务优先
+    失败的任务通过 retry() 延迟放回，延迟到期前不会被取出，工作线程不必原地等待
+    同时记录每个任务的大小和耗时，用于预测剩余耗时并在结束时与实际耗时对比
     """
-    从远程服务器拉取文件或文件夹
+    def __init__(self, policy="largest", maxsize=1024, workers=4):
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError(f"未知的调度策略: {policy}")
+        self.policy = policy
+        self.maxsize = maxsize
+        self.workers = workers
+        self._pending = []  # [(任务, 大小, 分组)]
+        self._overflow = deque()  # 不等待放入时窗口已满的任务，窗口有空位时按顺序补入
+        self._delayed = []  # 等待重试的任务（堆）：[(到期时间, 序号, 任务, 大小, 分组)]
+        self._attempts = {}  # {任务标识: 已重试次数}
+        self._sequence = 0
+        self._unfinished = 0
+        self._cond = Condition()
+        self._local = local()  # 每个工作线程当前任务的大小和开始时间
+        self._take_large = True  # interleave：这一次取大任务还是小任务
+        self._group = None  # locality：上一次发出的任务所在分组
+        self._samples = []  # 已完成任务的 (大小, 耗时)
+        self._started = time.time()
+        self._finished = None  # 最近一次所有任务都完成的时间，作为实际结束时间（不含工作线程退出的等待）
+        self._closed = False
+        self._predict_requested = False  # 枚举已结束、等待足够的已完成任务后再预测
+        self._predicted = None
+
+    def put(self, item, size, group=None, block=True):
+        """
+        放入任务；窗口已满时等待工作线程取走
+        :param block: 为 False 时不等待，窗口已满的任务暂存在溢出列表中（多主机推送时慢主机不拖住枚举线程）
+        """
+        with self._cond:
+            if not block and len(self._pending) >= self.maxsize:
+                self._overflow.append((item, size, group))
+                self._unfinished += 1
+                return
+            while len(self._pending) >= self.maxsize:
+                self._cond.wait()
+            self._pending.append((item, size, group))
+            self._unfinished += 1
+            self._cond.notify_all()
+
+    def retry(self, item, size, group, key, retry_after=None, count=True):
+        """
+        任务失败后延迟放回：第 n 次重试延迟 RETRY_BASE_DELAY * 2^(n-1) 秒（随机抖动，不超过 RETRY_MAX_DELAY），
+        且不短于 retry_after（例如主机熔断的剩余冷却时间）
+        :param key: 任务标识（文件路径），同一个文件的重试次数累计
+        :param count: 为 False 时不计入重试次数（主机熔断期间的等待由熔断器限制总时长）
+        :return: 延迟的秒数；重试次数已用完时返回 None，任务不再放回
+        """
+        with self._cond:
+            attempt = self._attempts.get(key, 0)
+            if count:
+                if attempt >= RETRY_LIMIT:
+                    return None
+                self._attempts[key] = attempt + 1
+            self._local.current = None  # 失败的尝试不计入耗时样本
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+            delay = max(random.uniform(delay / 2, delay), retry_after or 0)
+            self._sequence += 1
+            heapq.heappush(self._delayed, (time.time() + delay, self._sequence, item, size, group))
+            self._unfinished += 1
+            self._cond.notify_all()
+        return delay
+
+    def _promote(self):
+        """
+        把已到期的重试任务移入窗口（调用方持有 self._cond），返回下一个重试任务的到期时间
+        """
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, item, size, group = heapq.heappop(self._delayed)
+            (self._pending if len(self._pending) < self.maxsize else self._overflow).append((item, size, group))
+        return self._delayed[0][0] if self._delayed else None
+
+    def qsize(self):
+        """
+        窗口、溢出列表和重试等待中尚未取走的任务数
+        """
+        with self._cond:
+            return len(self._pending) + len(self._overflow) + len(self._delayed)
+
+    def _pick(self, pending):
+        """
+        按调度策略返回下一个要发出的任务在 pending 中的下标
+        """
+        if self.policy == "fifo":
+            return 0
+        if self.policy == "interleave":
+            choose = max if self._take_large else min
+            self._take_large = not self._take_large
+            return choose(range(len(pending)), key=lambda i: pending[i][1])
+        largest = max(range(len(pending)), key=lambda i: pending[i][1])
+        if self.policy == "locality":
+            same_group = [i for i in range(len(pending)) if pending[i][2] == self._group]
+            if same_group:
+                return max(same_group, key=lambda i: pending[i][1])
+            self._group = pending[largest][2]
+        return largest
+
+    def get(self, timeout=None):
+        """
+        按调度策略取出一个任务，超时未取到时抛出 queue.Empty
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while True:
+                next_due = self._promote()
+                if self._pending:
+                    break
+                wake = min(t for t in (next_due, deadline) if t is not None) if next_due or deadline else None
+                if self._closed or deadline is not None and time.time() >= deadline:
+                    raise Empty
+                self._cond.wait(wake - time.time() if wake is not None else None)
+            item, size, _ = self._pending.pop(self._pick(self._pending))
+            if self._overflow:
+                self._pending.append(self._overflow.popleft())
+            self._cond.notify_all()
+        self._local.current = (size, time.time())
+        return item
+
+    def task_done(self):
+        current = getattr(self._local, "current", None)
+        self._local.current = None
+        with self._cond:
+            if current is not None:
+                size, started = current
+                self._samples.append((size, time.time() - started))
+            self._unfinished -= 1
+            if not self._unfinished:
+                self._finished = time.time()
+            self._cond.notify_all()
+            ready = self._predict_requested and len(self._samples) >= self.workers
+            if ready:
+                self._predict_requested = False
+        if ready:
+            self._predict()
+
+    def join(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._unfinished == 0)
+
+    def close(self):
+        """
+        任务全部结束后调用：正在 get() 中等待的工作线程立即抛出 queue.Empty，不必等到超时才看到退出通知
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _estimate(self):
+        """
+        用已完成任务估算：最短的任务耗时近似为每个任务的固定开销，扣除固定开销后的总字节数 / 总耗时为单线程吞吐
+        已完成的字节数太少时吞吐使用默认值
+        """
+        samples = self._samples[-1000:]
+        if not samples:
+            return SCHEDULE_DEFAULT_RATE, SCHEDULE_DEFAULT_OVERHEAD
+        overhead = min(elapsed for _, elapsed in samples)
+        total_size = sum(size for size, _ in samples)
+        transfer_time = sum(elapsed for _, elapsed in samples) - overhead * len(samples)
+        if total_size < SCHEDULE_MIN_SAMPLE_BYTES or transfer_time <= 0:
+            return SCHEDULE_DEFAULT_RATE, overhead
+        return total_size / transfer_time, overhead
+
+    def predict(self):
+        """
+        枚举结束后调用：已完成的任务足够估算吞吐（每个工作线程一个）时立即预测，否则等到足够时再预测
+        """
+        with self._cond:
+            ready = len(self._samples) >= self.workers
+            self._predict_requested = not ready
+        if ready:
+            self._predict()
+
+    def _predict(self):
+        """
+        按调度策略的发放顺序把窗口中剩余的任务模拟分配给各工作线程，
+        预测整个任务的完成时间（从调度器创建时算起的秒数）
+        """
+        with self._cond:
+            rate, overhead = self._estimate()
+            in_flight = self._unfinished - len(self._pending) - len(self._overflow) - len(self._delayed)
+            # 在副本上重放调度策略，得到剩余任务的发放顺序，之后恢复策略状态
+            state = (self._take_large, self._group)
+            pending, ordered = list(self._pending), []
+            while pending:
+                ordered.append(pending.pop(self._pick(pending)))
+            self._take_large, self._group = state
+            ordered.extend(self._overflow)
+            ordered.extend(task[2:] for task in sorted(self._delayed))
+            remaining = len(ordered)
+        # 正在传输的任务按平均耗时的一半估算剩余时间
+        average = sum(elapsed for _, elapsed in self._samples) / len(self._samples) if self._samples else overhead
+        finish = [average / 2 if i < in_flight else 0.0 for i in range(self.workers)]
+        for _, size, _ in ordered:
+            index = finish.index(min(finish))
+            finish[index] += overhead + size / rate
+        elapsed = time.time() - self._started
+        self._predicted = elapsed + max(finish)
+        print(f"调度预测（{self.policy}）: 剩余 {remaining} 个任务，单线程吞吐约 {format_size(rate)}/s，"
+              f"每个任务固定开销约 {overhead:.2f} 秒，预计 {self._predicted - elapsed:.1f} 秒后全部完成")
+
+    def report(self):
+        """
+        任务结束后输出预测耗时与实际耗时的对比
+        """
+        actual = max((self._finished or time.time()) - self._started, 1e-6)
+        total_size = sum(size for size, _ in self._samples)
+        summary = f"共 {len(self._samples)} 个任务（{format_size(total_size)}），总吞吐 {format_size(total_size / actual)}/s"
+        if self._predicted is None:
+            print(f"调度统计（{self.policy}）: {summary}，实际耗时 {actual:.1f} 秒")
+        else:
+            print(f"调度统计（{self.policy}）: {summary}，预计耗时 {self._predicted:.1f} 秒，"
+                  f"实际耗时 {actual:.1f} 秒（偏差 {actual - self._predicted:+.1f} 秒）")
+
+CONCURRENCY_INTERVAL = 5  # 并发控制每隔这么多秒采样一次吞吐、错误数和建立连接的耗时，做一次调整
+CONCURRENCY_MIN_GAIN = 0.05  # 增加一个线程后吞吐至少提高这个比例才继续增加，否则撤回
+CONCURRENCY_HOLD = 6  # 撤回或因出错减少线程后，保持这么多个采样周期再尝试增加
+CONCURRENCY_RELAX = 24  # 出错降低上限后，连续这么多个有进展且没有出错的周期才把上限放宽一个
+CONCURRENCY_SHIFT = 0.3  # 撤回后的保持期内吞吐变化超过这个比例时视为负载变了（例如从大文件转到小文件），提前结束保持
+CONCURRENCY_SLOW_CONNECT = 3.0  # 新连接的握手耗时超过此前平均值的这么多倍（且至少慢 0.5 秒）时视为远程已过载，减少一个线程
+
+class ConcurrencyController:
+    """
+    自适应并发（AIMD）：启动 max_workers 个工作线程，只有编号小于当前并发数的线程取任务，其余线程等待
+    每 CONCURRENCY_INTERVAL 秒根据该主机传输的字节数、可重试的错误数和新连接的握手耗时调整并发数：
+    - 出现可重试的错误（连接被拒绝、超时、断开，通常是超出了 sshd 的 MaxStartups/MaxSessions）时减半，
+      并把上限降到出错时的并发数以下，之后每 CONCURRENCY_RELAX 个周期没有出错才放宽一个
+    - 新连接的握手明显变慢（远程 sshd 或 CPU 已过载）时减一
+    - 否则每个周期加一，只要吞吐随之提高；加一后吞吐没有提高 CONCURRENCY_MIN_GAIN 则撤回，保持一段时间再试，
+      保持期内吞吐明显变化（文件大小分布变了，最佳并发数也随之改变）时立即再试
+    调度窗口中等待的任务少于并发数时（枚举还没跟上或即将结束），或周期内没有传输任何数据时（例如主机熔断中），吞吐不反映并发数，不做调整
+    """
+    def __init__(self, pool, file_queue, initial, min_workers, max_workers, label=""):
+        """
+        :param pool: 该主机的连接池，传输指标和建立连接的耗时从它读取
+        :param file_queue: 该主机的调度窗口，用于判断是否有足够的等待任务
+        :param initial: 初始并发数
+        :param min_workers: 并发数下限
+        :param max_workers: 并发数上限，也是启动的工作线程数
+        """
+        self.pool = pool
+        self.file_queue = file_queue
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.limit = min(max(initial, self.min_workers), self.max_workers)
+        self.label = label
+        self.peak = self.limit
+        self.adjustments = 0
+        self._cond = Condition()
+        self._ceiling = self.max_workers  # 出错后降低的上限
+        self._clean = 0  # 上次出错之后有进展且没有出错的周期数
+        self._hold = 0  # 剩余的保持周期数
+        self._hold_rate = None  # 撤回时的吞吐，保持期内据此判断负载是否变化；出错后的保持期为 None
+        self._grew_from = None  # 上个周期加一之前的吞吐；None 表示上个周期没有加一
+
+    def admit(self, index, stop_event):
+        """
+        编号为 index 的工作线程取任务前调用：编号不小于当前并发数时等待
+        :return: stop_event 已设置时返回 False，线程应退出
+        """
+        with self._cond:
+            while index >= self.limit and not stop_event.is_set():
+                self._cond.wait(1)
+        return not stop_event.is_set()
+
+    def run(self, stop_event):
+        """
+        控制线程：周期性采样并调整，stop_event 设置后退出
+        """
+        last = self._sample()
+        while not stop_event.wait(CONCURRENCY_INTERVAL):
+            current = self._sample()
+            self._adjust(last, current)
+            last = current
+
+    def _sample(self):
+        counters = self.pool.metrics.snapshot()[1].get(self.pool.host_label, {})
+        connections, connect_seconds = self.pool.connect_stats
+        return time.time(), counters.get("bytes", 0), counters.get("retries", 0), connections, connect_seconds
+
+    def _set(self, limit, reason):
+        with self._cond:
+            previous, self.limit = self.limit, limit
+            self._cond.notify_all()
+        self.adjustments += 1
+        self.peak = max(self.peak, limit)
+        print(f"{self.label}并发调整: {previous} -> {limit} 个线程（{reason}）")
+
+    def _adjust(self, last, current):
+        rate = (current[1] - last[1]) / max(current[0] - last[0], 1e-6)
+        errors = current[2] - last[2]
+        limit = self.limit
+        grew_from, self._grew_from = self._grew_from, None
+        if errors:
+            self._ceiling = max(self.min_workers, limit - 1)
+            self._hold, self._hold_rate = CONCURRENCY_HOLD, None
+            self._clean = 0
+            if limit > self.min_workers:
+                self._set(max(self.min_workers, limit // 2), f"{CONCURRENCY_INTERVAL} 秒内 {errors} 次可重试的错误")
+            return
+        connections = current[3] - last[3]
+        if connections and last[3]:
+            connect_time, baseline = (current[4] - last[4]) / connections, last[4] / last[3]
+            if connect_time > baseline * CONCURRENCY_SLOW_CONNECT and connect_time > baseline + 0.5 and limit > self.min_workers:
+                self._hold, self._hold_rate = CONCURRENCY_HOLD, None
+                self._set(limit - 1, f"新连接握手耗时 {connect_time:.2f} 秒，此前平均 {baseline:.2f} 秒")
+                return
+        if self.file_queue.qsize() < limit or not rate:
+            return
+        self._clean += 1
+        if self._ceiling < self.max_workers and self._clean % CONCURRENCY_RELAX == 0:
+            self._ceiling += 1
+        if grew_from is not None and rate < grew_from * (1 + CONCURRENCY_MIN_GAIN):
+            self._hold, self._hold_rate = CONCURRENCY_HOLD, rate
+            self._set(limit - 1, f"吞吐 {format_size(rate)}/s，没有高于 {limit - 1} 个线程时的 {format_size(grew_from)}/s")
+            return
+        if self._hold and self._hold_rate is not None and abs(rate - self._hold_rate) > self._hold_rate * CONCURRENCY_SHIFT:
+            self._hold = 0
+        if self._hold:
+            self._hold -= 1
+            return
+        if limit < self._ceiling:
+            self._grew_from = rate
+            self._set(limit + 1, f"吞吐 {format_size(rate)}/s")
+
+    def report(self):
+        print(f"{self.label}并发控制: 最终 {self.limit} 个线程，最多 {self.peak} 个，调整 {self.adjustments} 次"
+              f"（范围 {self.min_workers}-{self.max_workers}）")
+
+FILE_QUEUE_SIZE = 1024  # 调度窗口的容量，窗口满时枚举线程等待工作线程消费
+ENUM_BATCH_SIZE = 1000  # 枚举时每积累这么多文件批量比较一次校验和
+
+def parse_hosts(remote_host, remote_port):
+    """
+    解析远程主机列表：remote_host 可以是列表，或用逗号分隔的字符串；
+    每一项可以写成 host、host:port 或 [IPv6]:port，未写端口时使用 remote_port
+    :return: [(主机, 端口), ...]
+    """
+    specs = remote_host if isinstance(remote_host, (list, tuple)) else remote_host.split(",")
+    hosts = []
+    for spec in specs:
+        spec = spec.strip()
+        if not spec:
+            continue
+        host, port = spec, remote_port
+        if spec.startswith("[") and "]" in spec:
+            host, _, rest = spec[1:].partition("]")
+            if rest.startswith(":"):
+                port = int(rest[1:])
+        elif spec.count(":") == 1:
+            host, port = spec.split(":")
+            port = int(port)
+        hosts.append((host, port))
+    return hosts
+
+def pull_files(remote_path, pattern, remote_host, remote_port, remote_user, remote_password, local_base_path, threads, max_sessions=None,
+               adaptive_threads=True, min_threads=1, max_threads=None, sync_mode="all", dry_run=False, delta_threshold=64 * 1024 * 1024, bundle_threshold=1024 * 1024, bundle_size=64 * 1024 * 1024,
+               chunk_threshold=256 * 1024 * 1024, chunk_streams=4, resume_threshold=16 * 1024 * 1024, journal_path=None,
+               schedule_policy="largest", rate_limit=0, file_rate_limit=0, rate_schedule=None,
+               metrics_path=None, prom_path=None, progress_interval=5, verify=True, manifest_path=None, dedup_threshold=1024 * 1024,
+               dedup_mode="copy", state_path=STATE_PATH, transport_profile="auto", compress="auto", min_size=None, max_size=None,
+               newer_than=None, older_than=None):
+    """
+    从远程服务器拉取文件或文件夹；指定多台主机时同时从各主机拉取，每台主机拉取到本地目标路径下以主机命名的子目录
+    远程文件列表由枚举线程边读边放入有界队列，工作线程同时开始拉取，内存占用与文件总数无关
+    接收的数据交给共享的本地写入阶段（LocalWriter），预分配空间、大块写入、批量落盘，本地磁盘与网络接收同时进行
     :param remote_path: 远程路径（文件或文件夹）
     :param pattern: 文件名匹配模式（例如 "*.txt"）
-    :param remote_host: 远程服务器地址
-    :param remote_port: 远程服务器端口
+    :param remote_host: 远程服务器地址，多台主机时为列表或用逗号分隔的字符串（每项可写成 host:port），见 parse_hosts
+    :param remote_port: 远程服务器端口（未单独指定端口的主机使用）
     :param remote_user: 远程服务器用户名
     :param remote_password: 远程服务器密码
-    :param local_base_path: 本地目标路径
-    :param threads: 并发线程数
+    :param local_base_path: 本地目标路径；多台主机时各主机拉取到其下的 主机 子目录（同一主机的多个端口为 主机_端口）
+    :param threads: 每台主机的并发线程数；自动调整并发时为初始值
+    :param max_sessions: 每台主机最大 SSH 连接数（默认与线程数相同，自动调整并发时与 max_threads 相同）
+    :param adaptive_threads: 是否根据吞吐、可重试的错误和建立连接的耗时自动调整并发线程数，见 ConcurrencyController
+    :param min_threads: 自动调整并发时的最小线程数
+    :param max_threads: 自动调整并发时的最大线程数，默认为 threads 的 4 倍
+    :param sync_mode: all（全部重新拉取）、skip（本地已存在即跳过）、sync（大小或修改时间不同才拉取）、checksum（大小相同时再比较 SHA-256）
+    :param dry_run: 只输出同步计划（文件数和字节数），不实际拉取
+    :param delta_threshold: 本地已有旧版本且不小于该字节数的文件使用块级增量传输，0 表示关闭
+    :param bundle_threshold: 小于该字节数的文件由远程打包成 tar 流批量拉取，0 表示关闭
+    :param bundle_size: 每个打包的字节数上限
+    :param chunk_threshold: 不小于该字节数的文件切分为字节范围，通过多个通道并发传输，0 表示关闭
+    :param chunk_streams: 单个大文件的并发通道数
+    :param resume_threshold: 不小于该字节数的文件写入本地 .part 临时文件，失败后可断点续传，0 表示关闭
+    :param journal_path: 任务日志路径，默认根据主机和路径在当前目录生成；重新运行同一任务时跳过日志中已完成的文件
+                         多台主机时每台主机一份，路径加上 .主机_端口 后缀
+    :param schedule_policy: 工作线程取任务的调度策略 fifo/largest/interleave/locality，见 TransferScheduler
+    :param rate_limit: 全局限速（字节/秒），所有主机、所有线程共享，0 表示不限速
+    :param file_rate_limit: 单个文件的限速（字节/秒），0 表示不限速
+    :param rate_schedule: 全局限速时间表，例如 "08:00-20:00=10M,20:00-08:00=100M"，不在任何时间段内时使用 rate_limit
+    :param metrics_path: 每个文件拉取结束时向该文件追加一行 JSON（各阶段耗时、字节数、重试次数、错误），None 表示不写
+    :param prom_path: 定期以 Prometheus 文本格式写入汇总指标的文件路径，None 表示不写
+    :param progress_interval: 进度显示间隔（秒），0 表示不显示
+    :param verify: 是否校验拉取结果：写入本地时计算 SHA-256，远程批量计算后比较，不一致的文件自动重新拉取
+    :param manifest_path: 向该文件追加每个文件的校验结果（JSON lines，见 ChecksumManifest），None 表示不写
+    :param dedup_threshold: 不小于该字节数的文件参与去重：大小相同的文件在远程比较 SHA-256，相同内容只拉取一次，0 表示关闭
+    :param dedup_mode: 重复文件在本地的创建方式：copy（复制，文件系统支持时共享数据块）或 hardlink（硬链接）
+    :param state_path: 传输状态库（SQLite）路径，记录已拉取的文件及其远程大小、修改时间和 SHA-256；重新运行时远程和本地都未变化的文件
+                       直接跳过，不必再比较校验和；None 表示不使用
+    :param transport_profile: 传输参数预设（窗口、包长、算法顺序、压缩、SFTP 在途请求数），见 TRANSPORT_PROFILES；
+                              auto 表示每台主机在第一个连接上测量往返延迟和带宽后自动选择：每台主机一次测量，广域网上带宽测量会接收
+                              最多 PROFILE_PROBE_BYTES 字节；结果缓存在状态库中，试运行不测量带宽，见 SSHConnectionPool._choose_profile
+    :param compress: 压缩拉取：on 表示可压缩的文件（按扩展名判断）和打包由远程 pigz 或 gzip 压缩、本地解压，已压缩的格式原样拉取；
+                     off 表示不压缩；auto 表示只在选择了 wan 预设时压缩
+    :param min_size: 只拉取不小于该字节数的文件，None 表示不限制（与 pattern 一样在远程过滤，不传回不需要的记录）
+    :param max_size: 只拉取不大于该字节数的文件，None 表示不限制
+    :param newer_than: 只拉取修改时间晚于该 Unix 时间戳的文件，None 表示不限制
+    :param older_than: 只拉取修改时间不晚于该 Unix 时间戳的文件，None 表示不限制
     """
-    # 创建 SSH 客户端以获取远程文件列表
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(remote_host, port=remote_port, username=remote_user, password=remote_password)
+    if dedup_mode not in ("copy", "hardlink"):
+        print(f"未知的去重方式: {dedup_mode}")
+        return
+    if transport_profile != "auto" and transport_profile not in TRANSPORT_PROFILES:
+        print(f"未知的传输参数预设: {transport_profile}")
+        return
+    if compress not in COMPRESS_MODES:
+        print(f"未知的压缩方式: {compress}")
+        return
 
-    if not remote_file_exists(ssh, remote_path):
-        print(f"远程路径不存在: {remote_path}")
-        ssh.close()
+    hosts = parse_hosts(remote_host, remote_port)
+    if not hosts:
+        print("没有指定远程服务器")
         return
+    multi_host = len(hosts) > 1
+    # 自动调整并发时连接数随并发数增长，默认上限与最大并发数相同
+    max_threads = max(max_threads or threads * 4, threads) if adaptive_threads else threads
+    # 所有主机共享传输指标（按主机分别汇总）、全局令牌桶、校验清单、状态库和本地写入阶段
+    metrics = TransferMetrics(metrics_path)
+    schedule_windows = parse_rate_schedule(rate_schedule)
+    rate_bucket = TokenBucket(rate_limit, schedule_windows) if rate_limit or schedule_windows else None
+    manifest = ChecksumManifest(manifest_path if verify and not dry_run else None)
+    # 记为完成的文件同时写入状态库（以本地路径为键，记录远程文件的大小、修改时间），下次运行时在本地判断跳过
+    state = TransferState(state_path) if state_path else None
+    writer = LocalWriter() if not dry_run else None
+    results = {}  # 输出前缀 -> (失败的文件数, 任务日志路径)，远程路径不存在的主机没有记录
 
-    # 如果是文件，直接加入队列
-    stdin, stdout, stderr = ssh.exec_command(f"test -f {remote_path} && echo file")
-    if "file" in stdout.read().decode().strip():
-        if fnmatch.fnmatch(os.path.basename(remote_path), pattern):
-            local_file_path = os.path.join(local_base_path, os.path.basename(remote_path))
-            file_queue.put((remote_path, local_file_path))
-    else:
-        # 如果是文件夹，遍历文件夹并匹配文件
-        stdin, stdout, stderr = ssh.exec_command(f"find {remote_path} -type f")
-        for line in stdout:
-            remote_file_path = line.strip()
-            if fnmatch.fnmatch(os.path.basename(remote_file_path), pattern):
-                relative_path = os.path.relpath(remote_file_path, remote_path)
-                local_file_path = os.path.join(local_base_path, relative_path)
-                file_queue.put((remote_file_path, local_file_path))
+    def pull_host(host, port, host_base_path, label):
+        """
+        从一台主机拉取到 host_base_path：连接池、任务日志、调度窗口、工作线程和失败列表每台主机一份，
+        各主机同时拉取，一台主机慢或失败不影响其它主机
+        :param label: 输出前缀，多主机拉取时为 "[主机:端口] "
+        """
+        # 该主机的所有工作线程共享同一个连接池，获取文件列表的连接也来自连接池
+        pool = SSHConnectionPool(host, port, remote_user, remote_password, max_sessions=max_sessions or max_threads, metrics=metrics,
+                                 profile=transport_profile, state=state, probe=not dry_run)
 
-    ssh.close()
+        # 任务日志：同一任务中断后重新运行时跳过已完成的文件
+        if journal_path is None:
+            job_id = hashlib.sha1(f"{host}:{port}:{remote_path}:{os.path.abspath(host_base_path)}".encode()).hexdigest()[:12]
+            host_journal_path = f".pull_files-{job_id}.journal"
+        else:
+            host_journal_path = f"{journal_path}.{host}_{port}" if multi_host else journal_path
+        journal = TransferJournal(host_journal_path, on_done=partial(state.record, "pull", pool.host_label) if state is not None else None)
 
-    # 创建并启动线程
-    stop_event = Event()  # 用于通知线程退出
-    thread_list = []
-    for _ in range(threads):
-        thread = Thread(target=worker, args=(file_queue, local_base_path, remote_host, remote_port, remote_user, remote_password, stop_event), daemon=True)
-        thread.start()
-        thread_list.append(thread)
+        file_queue = TransferScheduler(schedule_policy, maxsize=FILE_QUEUE_SIZE, workers=threads)  # 有界窗口：工作线程跟不上时枚举线程等待
+        metrics.watch_queue(pool.host_label, file_queue)
+        plan = {"transfer": [0, 0], "skip": [0, 0], "dedup": [0, 0]}  # [文件数, 字节数]
 
-    # 等待所有任务完成
-    file_queue.join()
+        # 限速器：同时受全局（所有主机共享）和单个文件的速率限制，都不限速时只用于统计已传输的字节数
+        limiter = BandwidthLimiter([rate_bucket], file_rate_limit, metrics, pool.host_label)
 
-    # 通知线程退出
-    stop_event.set()
+        checksum_candidates = []  # 当前批次中大小相同、需要比较校验和的文件
+        dedup_candidates = []  # 当前批次中与已计划的文件大小相同、需要判断是否重复的文件
+        # 去重索引：按大小分组的已计划文件（还没有计算校验和的）、已知内容的已计划文件、等待在本地创建的重复文件
+        dedup = {"sizes": {}, "digests": {}, "duplicates": []}
+        bundle = {"files": [], "bytes": 0}  # 正在累积的小文件打包
 
-    # 等待所有线程退出
-    for thread in thread_list:
-        thread.join()
+        def flush_bundle():
+            if bundle["files"]:
+                file_queue.put((bundle["files"], None, "bundle", None, None), bundle["bytes"], None)
+                bundle["files"], bundle["bytes"] = [], 0
 
-    print("所有文件拉取完成！")
+        def transfer_method(local_file_path, size):
+            if delta_threshold and size >= delta_threshold and os.path.isfile(local_file_path):
+                return "delta"
+            if bundle_threshold and size < bundle_threshold:
+                return "bundle"
+            if chunk_threshold and size >= chunk_threshold:
+                return "chunked"
+            if size >= COMPRESS_MIN_SIZE and compression_enabled(compress, pool) and \
+                    os.path.splitext(local_file_path)[1].lower() not in INCOMPRESSIBLE_EXTENSIONS:
+                return "compressed"
+            if resume_threshold and size >= resume_threshold:
+                return "resumable"
+            return "scp"
 
-if __name__ == "__main__":
-    # 文件队列
-    file_queue = Queue()
+        def schedule(remote_file_path, local_file_path, size, mtime, deduplicate=True):
+            # 与已计划的文件大小相同时先放入本批次，由 resolve_duplicates() 比较内容后再决定
+            if deduplicate and dedup_threshold and size >= dedup_threshold:
+                if size in dedup["sizes"]:
+                    dedup_candidates.append((remote_file_path, local_file_path, size, mtime))
+                    return
+                dedup["sizes"][size] = [(remote_file_path, local_file_path)]
+            plan["transfer"][0] += 1
+            plan["transfer"][1] += size
+            method = transfer_method(local_file_path, size)
+            if dry_run:
+                label = {"delta": "（增量）", "bundle": "（打包）", "chunked": "（分块）", "compressed": "（压缩）", "resumable": "（可续传）"}.get(method, "")
+                print(f"[试运行] 将拉取{label}: {remote_file_path} -> {local_file_path} ({format_size(size)})")
+            elif method == "bundle":
+                bundle["files"].append((remote_file_path, local_file_path, size, mtime))
+                bundle["bytes"] += size
+                if bundle["bytes"] >= bundle_size or len(bundle["files"]) >= TAR_BUNDLE_MAX_FILES:
+                    flush_bundle()
+            else:
+                file_queue.put((remote_file_path, local_file_path, method, size, mtime), size, os.path.dirname(local_file_path))
+
+        def skip(remote_file_path, local_file_path, size, reason):
+            plan["skip"][0] += 1
+            plan["skip"][1] += size
+            print(f"{reason}，跳过拉取: {remote_file_path} -> {local_file_path}")
+
+        def state_record(local_file_path, size, mtime):
+            # 状态库中该文件的记录与这次列出的远程文件（大小、修改时间）一致时返回记录，否则返回 None
+            if state is None:
+                return None
+            record = state.get("pull", pool.host_label, os.path.normpath(local_file_path))
+            return record if record is not None and tuple(record[:2]) == (size, int(mtime)) else None
 
+        def remember(local_file_path, size, mtime, digest=None):
+            # 本地已与远程一致的文件（无需拉取）也记入状态库；本地修改时间与远程不同时无法据此判断本地是否被改动，不记录
+            if state is not None and int(os.stat(local_file_path).st_mtime) == int(mtime):
+                state.record("pull", pool.host_label, os.path.normpath(local_file_path), size, mtime, digest)
+
+        def enqueue(remote_file_path, local_file_path, size, mtime):
+            try:
+                local_stat = os.stat(local_file_path)
+                local_entry = (local_stat.st_size, local_stat.st_mtime)
+            except OSError:
+                local_entry = None
+            # 日志只在本地文件仍然存在时可信（本地可能在两次运行之间被清理）
+            if local_entry is not None and journal.is_done(os.path.normpath(local_file_path), size, mtime):
+                skip(remote_file_path, local_file_path, size, "任务日志记录已完成")
+                return
+            # 状态库记录的远程文件与这次列出的一致，本地文件也没有变化：之前拉取过，不必再比较
+            if local_entry is not None and sync_mode != "all" and (local_entry[0], int(local_entry[1])) == (size, int(mtime)) and \
+                    state_record(local_file_path, size, mtime) is not None:
+                skip(remote_file_path, local_file_path, size, "状态库记录已拉取")
+                return
+            decision = needs_transfer(size, mtime, local_entry, sync_mode)
+            if decision is None:
+                checksum_candidates.append((remote_file_path, local_file_path, size, mtime))
+            elif decision:
+                schedule(remote_file_path, local_file_path, size, mtime)
+            else:
+                skip(remote_file_path, local_file_path, size, "文件已存在" if sync_mode == "skip" else "文件未变化")
+                if sync_mode != "skip":  # 只比较是否存在时不知道本地内容，不记入状态库
+                    remember(local_file_path, size, mtime)
+
+        def compare_checksums(ssh, executor):
+            # 大小相同的文件：远程一次批量计算校验和，本地并发计算，只拉取内容不同的文件
+            candidates = checksum_candidates[:]
+            del checksum_candidates[:]
+            if not candidates:
+                return
+            # 远程文件与状态库的记录一致时，记录中的 SHA-256 就是远程文件的内容，不必再到远程计算
+            remote_sums = {}
+            for remote_file_path, local_file_path, size, mtime in candidates:
+                record = state_record(local_file_path, size, mtime)
+                if record is not None and record[2] is not None:
+                    remote_sums[remote_file_path] = record[2]
+            unknown = [remote for remote, _, _, _ in candidates if remote not in remote_sums]
+            if unknown:
+                remote_sums.update(remote_sha256sums(ssh, unknown))
+            local_sums = executor.map(lambda candidate: file_sha256(candidate[1]), candidates)
+            for (remote_file_path, local_file_path, size, mtime), local_sum in zip(candidates, local_sums):
+                if remote_sums.get(remote_file_path) == local_sum:
+                    skip(remote_file_path, local_file_path, size, "校验和一致")
+                    remember(local_file_path, size, mtime, local_sum)
+                else:
+                    schedule(remote_file_path, local_file_path, size, mtime)
+
+        def resolve_duplicates(ssh):
+            # 与已计划的文件大小相同的文件：远程一次批量计算校验和（同样大小的已计划文件也补算），
+            # 内容与某个已计划文件相同的只拉取一次，其余在所有任务完成后从本地已拉取的文件复制
+            candidates = dedup_candidates[:]
+            del dedup_candidates[:]
+            if not candidates:
+                return
+            sizes, digests = dedup["sizes"], dedup["digests"]
+            members = [member for size in dict.fromkeys(size for _, _, size, _ in candidates) for member in sizes[size]]
+            remote_sums = remote_sha256sums(ssh, list(dict.fromkeys([remote for remote, _ in members] + [remote for remote, _, _, _ in candidates])))
+            for remote_file_path, local_file_path in members:
+                if remote_file_path in remote_sums:
+                    digests.setdefault(remote_sums[remote_file_path], (remote_file_path, local_file_path))
+            for _, _, size, _ in candidates:
+                sizes[size] = []
+            for remote_file_path, local_file_path, size, mtime in candidates:
+                digest = remote_sums.get(remote_file_path)
+                primary = digests.get(digest) if digest is not None else None
+                if primary is None:
+                    if digest is not None:
+                        digests[digest] = (remote_file_path, local_file_path)
+                    schedule(remote_file_path, local_file_path, size, mtime, deduplicate=False)
+                    continue
+                plan["dedup"][0] += 1
+                plan["dedup"][1] += size
+                if dry_run:
+                    print(f"[试运行] 内容与 {primary[0]} 相同，将在本地复制: {primary[1]} -> {local_file_path} ({format_size(size)})")
+                else:
+                    dedup["duplicates"].append((primary, remote_file_path, local_file_path, size, mtime))
+
+        def copy_duplicates():
+            """
+            所有任务完成（并校验）后，在本地从已拉取的相同内容创建重复文件；
+            来源拉取失败或本地创建失败的重复文件重新放回调度窗口，按普通文件拉取
+            :return: 重新放回调度窗口的文件数
+            """
+            duplicates, dedup["duplicates"] = dedup["duplicates"], []
+            if not duplicates:
+                return 0
+            failed = set(failures)
+            created = saved = requeued = 0
+            for (primary_remote, primary_local), remote_file_path, local_file_path, size, mtime in duplicates:
+                try:
+                    if primary_remote in failed:
+                        raise IOError(f"来源文件拉取失败: {primary_remote}")
+                    local_duplicate(primary_local, local_file_path, hardlink=dedup_mode == "hardlink",
+                                    mtime=mtime if sync_mode != "all" and dedup_mode == "copy" else None)
+                    writer.after_sync(local_file_path, partial(journal.mark_done, os.path.normpath(local_file_path), size, mtime))
+                    created += 1
+                    saved += size
+                except Exception as e:
+                    print(f"无法在本地创建重复文件，改为逐个拉取: {local_file_path}，错误: {e}")
+                    method = transfer_method(local_file_path, size)
+                    file_queue.put((remote_file_path, local_file_path, "scp" if method == "bundle" else method, size, mtime), size,
+                                   os.path.dirname(local_file_path), block=False)
+                    requeued += 1
+            metrics.add_dedup(pool.host_label, created, saved)
+            print(f"{label}去重: 在本地创建 {created} 个重复文件，节省传输 {format_size(saved)}")
+            return requeued
+
+        listing = {"kind": None}  # 远程路径的类型，枚举线程读到文件列表的第一条记录后设置
+        listed = Event()
+
+        def produce():
+            """
+            枚举线程：边读取远程 find 的输出边比较，逐个放入有界队列
+            """
+            try:
+                with pool.connection() as ssh, ThreadPoolExecutor(max_workers=threads) as executor:
+                    records = list_remote_files(ssh, remote_path, pattern, min_size, max_size, newer_than, older_than)
+                    listing["kind"] = next(records)
+                    listed.set()
+                    if listing["kind"] is None:
+                        return
+                    enumerate_files(ssh, executor, records)
+            finally:
+                listed.set()
+            flush_bundle()
+            print(f"{label}同步计划: 需要拉取 {plan['transfer'][0]} 个文件（{format_size(plan['transfer'][1])}），"
+                  f"跳过 {plan['skip'][0]} 个文件（{format_size(plan['skip'][1])}）"
+                  + (f"，{plan['dedup'][0]} 个重复文件（{format_size(plan['dedup'][1])}）在本地复制" if plan["dedup"][0] else ""))
+            if not dry_run:
+                file_queue.predict()
+
+        def enumerate_files(ssh, executor, records):
+            for remote_file_path, size, mtime in records:
+                if listing["kind"] == "f":
+                    # 如果是文件，直接加入队列
+                    local_file_path = os.path.join(host_base_path, os.path.basename(remote_path))
+                else:
+                    # 如果是文件夹，保持目录结构；模式已由远程过滤，这里再检查一次（find -name 与 fnmatch 在个别写法上可能不同）
+                    if not fnmatch.fnmatch(os.path.basename(remote_file_path), pattern):
+                        continue
+                    relative_path = os.path.relpath(remote_file_path, remote_path)
+                    local_file_path = os.path.join(host_base_path, relative_path)
+                enqueue(remote_file_path, local_file_path, size, mtime)
+                if len(checksum_candidates) >= ENUM_BATCH_SIZE or len(dedup_candidates) >= ENUM_BATCH_SIZE:
+                    compare_checksums(ssh, executor)
+                    resolve_duplicates(ssh)
+            compare_checksums(ssh, executor)
+            resolve_duplicates(ssh)
+
+        def missing():
+            # 远程路径不存在（或无法列出）时不启动工作线程，清理后返回
+            print(f"{label}远程路径不存在: {remote_path}")
+            pool.close_all()
+            journal.close()
+
+        if dry_run:
+            produce()
+            if listing["kind"] is None:
+                missing()
+                return
+            pool.close_all()
+            journal.close()
+            return
+
+        # 先启动枚举线程，读到远程路径的类型（确认存在）后再启动工作线程，第一批文件入队后立即开始拉取
+        producer = Thread(target=produce, daemon=True)
+        producer.start()
+        listed.wait()
+        if listing["kind"] is None:
+            producer.join()
+            missing()
+            return
+        stop_event = Event()  # 用于通知线程退出
+        failures = []
+        thread_list = []
+        verifier = TransferVerifier(pool, file_queue, journal, failures, manifest, label) if verify else None
+        controller = ConcurrencyController(pool, file_queue, threads, min_threads, max_threads, label) if adaptive_threads else None
+        for index in range(max_threads):
+            thread = Thread(target=worker, args=(file_queue, host_base_path, pool, stop_event, sync_mode, chunk_streams, journal, failures,
+                                                 limiter, verifier, compress, index, controller, writer), daemon=True)
+            thread.start()
+            thread_list.append(thread)
+        if controller is not None:
+            Thread(target=controller.run, args=(stop_event,), daemon=True).start()
+
+        # 等待枚举结束、所有任务完成；校验不一致的文件、无法在本地复制的重复文件会重新放回调度窗口，等它们也拉取并校验完
+        # 完成的文件随批量落盘才交给 verifier（或记入任务日志），每轮先落盘再等待校验
+        producer.join()
+        while True:
+            file_queue.join()
+            writer.flush()
+            if verifier is not None and verifier.drain():
+                continue
+            if not copy_duplicates():
+                break
+        writer.flush()
+        if verifier is not None:
+            verifier.close()
+
+        # 通知线程退出
+        stop_event.set()
+        file_queue.close()
+
+        # 等待所有线程退出
+        for thread in thread_list:
+            thread.join()
+
+        pool.close_all()
+        file_queue.report()
+        if controller is not None:
+            controller.report()
+        if verifier is not None:
+            verifier.report()
+        journal.close(remove=not failures)
+        results[label] = (len(failures), host_journal_path)
+
+    # 多主机拉取时每台主机拉取到本地目标路径下以主机命名的子目录（同一主机的多个端口用 主机_端口 区分）
+    names = [host for host, _ in hosts]
+    targets = [(host, port, os.path.join(local_base_path, host if names.count(host) == 1 else f"{host}_{port}") if multi_host else local_base_path,
+                f"[{host}:{port}] " if multi_host else "") for host, port in hosts]
+
+    if dry_run:
+        for target in targets:
+            pull_host(*target)
+        metrics.close()
+        manifest.close()
+        if state is not None:
+            state.close()
+        return
+
+    reporter_stop = Event()
+    if progress_interval or prom_path:
+        Thread(target=metrics.report_periodically, args=(reporter_stop, progress_interval or METRICS_INTERVAL, progress_interval > 0, prom_path),
+               daemon=True).start()
+    if multi_host:
+        def pull_target(target):
+            try:
+                pull_host(*target)
+            except Exception as e:
+                print(f"{target[3]}拉取出错，已停止该主机: {e}")
+                results[target[3]] = (None, None)
+
+        host_threads = [Thread(target=pull_target, args=(target,), daemon=True) for target in targets]
+        for thread in host_threads:
+            thread.start()
+        for thread in host_threads:
+            thread.join()
+    else:
+        try:
+            pull_host(*targets[0])
+        except BaseException:
+            reporter_stop.set()
+            writer.close()
+            raise
+
+    reporter_stop.set()
+    writer.close()
+    manifest.close()
+    if results:
+        writer.report()
+        if prom_path:
+            metrics.write_prometheus(prom_path)
+        metrics.summary()
+    metrics.close()
+    if state is not None:
+        state.close()
+    for label, (failed, host_journal_path) in results.items():
+        if failed is None:
+            continue
+        if failed:
+            print(f"{label}{failed} 个文件拉取失败，重新运行同一任务将跳过已完成的文件并从断点继续（任务日志: {host_journal_path}）")
+        else:
+            print(f"{label}所有文件拉取完成！")
+
+if __name__ == "__main__":
     # 获取用户输入
     config = get_user_input()
 
@@ -179,4 +3446,34 @@ if __name__ == "__main__":
         remote_password=config["remote_password"],
         local_base_path=config["local_path"],
         threads=config["threads"],
+        max_sessions=config["max_sessions"],
+        adaptive_threads=config["adaptive_threads"],
+        min_threads=config["min_threads"],
+        max_threads=config["max_threads"],
+        sync_mode=config["sync_mode"],
+        dry_run=config["dry_run"],
+        delta_threshold=config["delta_threshold"],
+        bundle_threshold=config["bundle_threshold"],
+        bundle_size=config["bundle_size"],
+        chunk_threshold=config["chunk_threshold"],
+        chunk_streams=config["chunk_streams"],
+        resume_threshold=config["resume_threshold"],
+        schedule_policy=config["schedule_policy"],
+        rate_limit=config["rate_limit"],
+        file_rate_limit=config["file_rate_limit"],
+        rate_schedule=config["rate_schedule"],
+        metrics_path=config["metrics_path"],
+        prom_path=config["prom_path"],
+        progress_interval=config["progress_interval"],
+        verify=config["verify"],
+        manifest_path=config["manifest_path"],
+        dedup_threshold=config["dedup_threshold"],
+        dedup_mode=config["dedup_mode"],
+        state_path=config["state_path"],
+        transport_profile=config["transport_profile"],
+        compress=config["compress"],
+        min_size=config["min_size"],
+        max_size=config["max_size"],
+        newer_than=config["newer_than"],
+        older_than=config["older_than"],
     )
@@ -1,26 +1,43 @@
 import os
+import ctypes
+import errno
 import fnmatch
+import hashlib
+import heapq
+import inspect
+import json
+import shlex
+import socket
+import sqlite3
+import random
+import select
+import struct
+import tarfile
+import zlib
+import gzip
 import paramiko
 from scp import SCPClient
-from threading import Thread, Event
-from queue import Queue
-import traceback
+from threading import Thread, Event, Lock, BoundedSemaphore, Condition, local
+from queue import Queue, Empty
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import time
 
 def get_user_input():
     """
-    通过交互方式获取用户输入
+    通过交互方式获取用户输入；默认只询问连接和路径，其余选项在选择设置高级选项后才询问，否则使用 push_files() 的默认值
     """
     local_path = input("请输入本地文件或文件夹路径: ").strip()
     pattern = input("请输入文件名匹配模式（例如 *.txt，默认全部文件）: ").strip() or "*"
-    remote_host = input("请输入远程服务器地址: ").strip()
+    remote_host = input("请输入远程服务器地址（多台用逗号分隔，可写成 host:port）: ").strip()
     remote_port = int(input("请输入远程服务器端口（默认 22）: ").strip() or 22)
     remote_user = input("请输入远程服务器用户名: ").strip()
     remote_password = input("请输入远程服务器密码: ").strip()
     remote_path = input("请输入远程服务器目标路径: ").strip()
-    threads = int(input("请输入并发线程数（默认 4）: ").strip() or 4)
-
-    return {
+    threads = int(input("请输入并发线程数（默认 4，自动调整时为初始值）: ").strip() or 4)
+    config = {
         "local_path": local_path,
         "pattern": pattern,
         "remote_host": remote_host,
@@ -31,6 +48,427 @@ def get_user_input():
         "threads": threads,
     }
 
+    if input("是否设置高级选项（同步模式、自动调整并发、限速、校验、状态库、传输参数、压缩和监视等）y/N: ").strip().lower() != "y":
+        return dict(config, **default_options())
+    adaptive_threads = input("是否根据吞吐、错误率和连接耗时自动调整并发线程数 Y/n: ").strip().lower() != "n"
+    min_threads, max_threads = 1, threads
+    if adaptive_threads:
+        min_threads = int(input("自动调整时的最小线程数（默认 1）: ").strip() or 1)
+        max_threads = int(input(f"自动调整时的最大线程数（默认 {threads * 4}）: ").strip() or threads * 4)
+    max_sessions = int(input(f"请输入每台主机最大 SSH 连接数（默认 {max_threads}）: ").strip() or max_threads)
+    sync_mode = input("请输入同步模式 skip/sync/checksum（默认 skip，已存在即跳过）: ").strip() or "skip"
+    dry_run = input("是否只输出同步计划而不实际推送 y/N: ").strip().lower() == "y"
+    delta_threshold = int(float(input("大文件增量传输阈值 MB（默认 64，0 表示关闭）: ").strip() or 64) * 1024 * 1024)
+    bundle_threshold = int(float(input("小文件打包传输阈值 KB（默认 1024，0 表示关闭）: ").strip() or 1024) * 1024)
+    bundle_size = int(float(input("每个打包的大小上限 MB（默认 64）: ").strip() or 64) * 1024 * 1024)
+    chunk_threshold = int(float(input("大文件分块并发传输阈值 MB（默认 256，0 表示关闭）: ").strip() or 256) * 1024 * 1024)
+    chunk_streams = int(input("单个大文件的并发通道数（默认 4）: ").strip() or 4)
+    resume_threshold = int(float(input("大文件断点续传阈值 MB（默认 16，0 表示关闭）: ").strip() or 16) * 1024 * 1024)
+    schedule_policy = input("请输入调度策略 fifo/largest/interleave/locality（默认 largest，大文件优先）: ").strip() or "largest"
+    rate_limit = parse_rate(input("全局限速，例如 10M 表示 10 MB/s（默认不限速）: ").strip())
+    host_rate_limit = parse_rate(input("每台主机限速（默认不限速）: ").strip())
+    file_rate_limit = parse_rate(input("单个文件限速（默认不限速）: ").strip())
+    rate_schedule = input("限速时间表，例如 08:00-20:00=10M,20:00-08:00=100M（默认不使用）: ").strip()
+    progress_interval = float(input("进度显示间隔 秒（默认 5，0 表示不显示）: ").strip() or 5)
+    metrics_path = input("每个文件的传输指标输出文件（JSON lines，默认不输出）: ").strip() or None
+    prom_path = input("Prometheus 指标文件路径（默认不输出）: ").strip() or None
+    verify = input("是否在推送后校验 SHA-256，不一致时自动重新推送 Y/n: ").strip().lower() != "n"
+    manifest_path = input("校验清单输出文件（JSON lines，默认不输出）: ").strip() or None
+    dedup_threshold = int(float(input("重复文件去重阈值 KB（默认 1024，0 表示关闭）: ").strip() or 1024) * 1024)
+    dedup_mode = input("重复文件在远程的创建方式 copy/hardlink（默认 copy）: ").strip() or "copy"
+    state_path = input(f"传输状态库路径（默认 {STATE_PATH}，输入 none 表示不使用）: ").strip() or STATE_PATH
+    reconcile_interval = float(input("状态库与远程完整核对的间隔 小时（默认 24，0 表示每次都核对）: ").strip() or 24) * 3600
+    transport_profile = input(f"传输参数预设 auto/{'/'.join(TRANSPORT_PROFILES)}（默认 auto，每台主机测量一次往返延迟和带宽后自动选择，结果在状态库中缓存 24 小时）: ").strip() or "auto"
+    compress = input("压缩推送 auto/on/off（默认 auto，只在广域网预设下压缩可压缩的文件）: ").strip() or "auto"
+    watch = input("推送完成后是否持续监视本地文件夹，文件变化后自动推送 y/N: ").strip().lower() == "y"
+    watch_debounce = float(input(f"监视模式下合并事件的等待时间 秒（默认 {WATCH_DEBOUNCE:g}）: ").strip() or WATCH_DEBOUNCE) if watch else WATCH_DEBOUNCE
+
+    return dict(config, **{
+        "max_sessions": max_sessions,
+        "adaptive_threads": adaptive_threads,
+        "min_threads": min_threads,
+        "max_threads": max_threads,
+        "sync_mode": sync_mode,
+        "dry_run": dry_run,
+        "delta_threshold": delta_threshold,
+        "bundle_threshold": bundle_threshold,
+        "bundle_size": bundle_size,
+        "chunk_threshold": chunk_threshold,
+        "chunk_streams": chunk_streams,
+        "resume_threshold": resume_threshold,
+        "schedule_policy": schedule_policy,
+        "rate_limit": rate_limit,
+        "host_rate_limit": host_rate_limit,
+        "file_rate_limit": file_rate_limit,
+        "rate_schedule": rate_schedule,
+        "progress_interval": progress_interval,
+        "metrics_path": metrics_path,
+        "prom_path": prom_path,
+        "verify": verify,
+        "manifest_path": manifest_path,
+        "dedup_threshold": dedup_threshold,
+        "dedup_mode": dedup_mode,
+        "state_path": None if state_path.lower() == "none" else state_path,
+        "reconcile_interval": reconcile_interval,
+        "transport_profile": transport_profile,
+        "compress": compress,
+        "watch": watch,
+        "watch_debounce": watch_debounce,
+    })
+
+def default_options():
+    """
+    push_files() 各个可选参数的默认值
+    """
+    return {name: parameter.default for name, parameter in inspect.signature(push_files).parameters.items()
+            if parameter.default is not inspect.Parameter.empty}
+
+CONNECT_TIMEOUT = 60  # 建立 TCP 连接、SSH 握手和认证的超时（秒）
+SOCKET_TIMEOUT = 60  # 传输中通道超过这么久没有数据视为连接已断开（秒）
+RETRY_LIMIT = 3  # 每个文件（或打包）因可重试的错误最多重新放入调度窗口的次数
+RETRY_BASE_DELAY = 2  # 第一次重试的延迟（秒），之后每次翻倍，并在 [一半, 全部] 之间随机抖动
+RETRY_MAX_DELAY = 120  # 单次重试延迟的上限（秒）
+CIRCUIT_THRESHOLD = 3  # 连续这么多次连接失败后熔断，暂停向该主机建立连接
+CIRCUIT_COOLDOWN = 30  # 第一次熔断的暂停时间（秒），之后每次连续熔断翻倍
+CIRCUIT_MAX_TRIPS = 4  # 连续熔断这么多次仍连不上时放弃该主机，剩余文件立即失败
+
+class HostUnavailableError(IOError):
+    """
+    主机已熔断：retry_after 秒后可以再尝试；retry_after 为 None 表示已放弃该主机
+    """
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    单台主机的熔断器：连续 CIRCUIT_THRESHOLD 次连接失败后熔断，冷却期内建立连接直接抛出 HostUnavailableError，
+    工作线程不再为不可达的主机空等连接超时；冷却期结束后只放行一个探测连接，成功则恢复，失败则再次熔断（冷却时间翻倍）
+    连续熔断 CIRCUIT_MAX_TRIPS 次，或遇到认证失败等不可重试的错误时放弃该主机
+    """
+    def __init__(self, label):
+        self.label = label
+        self._lock = Lock()
+        self._failures = 0  # 连续失败次数
+        self._trips = 0  # 连续熔断次数
+        self._open_until = 0.0
+        self._probing = False
+        self._dead = None  # 放弃该主机的原因
+
+    def before_connect(self):
+        """
+        建立连接之前调用，主机已熔断时抛出 HostUnavailableError
+        """
+        with self._lock:
+            if self._dead is not None:
+                raise HostUnavailableError(f"主机 {self.label} 不可用，已放弃: {self._dead}")
+            now = time.time()
+            if now < self._open_until:
+                raise HostUnavailableError(f"主机 {self.label} 已熔断", retry_after=self._open_until - now)
+            if self._trips:
+                if self._probing:
+                    raise HostUnavailableError(f"主机 {self.label} 正在探测", retry_after=RETRY_BASE_DELAY)
+                self._probing = True
+
+    def succeeded(self):
+        with self._lock:
+            if self._trips:
+                print(f"主机 {self.label} 已恢复连接")
+            self._failures = self._trips = 0
+            self._probing = False
+
+    def failed(self, error, fatal=False):
+        """
+        建立连接失败；fatal 为 True（例如认证失败）时直接放弃该主机
+        """
+        with self._lock:
+            probing, self._probing = self._probing, False
+            if fatal:
+                self._dead = str(error)
+                print(f"主机 {self.label} 连接出现不可重试的错误，放弃该主机: {error}")
+                return
+            self._failures += 1
+            if not probing and self._failures < CIRCUIT_THRESHOLD:
+                return
+            self._failures = 0
+            self._trips += 1
+            if self._trips >= CIRCUIT_MAX_TRIPS:
+                self._dead = f"连续熔断 {self._trips} 次，最后的错误: {error}"
+                print(f"主机 {self.label} {self._dead}，放弃该主机")
+                return
+            cooldown = CIRCUIT_COOLDOWN * 2 ** (self._trips - 1)
+            self._open_until = time.time() + cooldown
+            print(f"主机 {self.label} 连接连续失败，熔断 {cooldown} 秒: {error}")
+
+FATAL_ERRNOS = {errno.EACCES, errno.EPERM, errno.ENOSPC, errno.EDQUOT, errno.EROFS, errno.EISDIR, errno.ENOTDIR}
+FATAL_MESSAGES = ("Permission denied", "No space left", "Disk quota exceeded", "Read-only file system", "Is a directory", "Not a directory")
+
+def is_retryable(error):
+    """
+    错误分类：连接断开、超时等可重试；认证失败、主机密钥不符、权限不足、磁盘已满等重试也不会成功
+    """
+    if isinstance(error, HostUnavailableError):
+        return error.retry_after is not None
+    if isinstance(error, (paramiko.AuthenticationException, paramiko.BadHostKeyException)):
+        return False
+    if isinstance(error, (socket.timeout, ConnectionError, EOFError, paramiko.SSHException)):
+        return True
+    if isinstance(error, OSError) and error.errno in FATAL_ERRNOS:
+        return False
+    return not any(message in str(error) for message in FATAL_MESSAGES)
+
+# 传输参数预设：通道窗口、最大包长、加密算法和 MAC 的优先顺序、压缩、SFTP 写入是否流水线发出、SCP 每次读写的字节数
+# 优先的算法排在 paramiko 支持的其它算法之前，服务器不支持时仍可协商其它算法
+TRANSPORT_PROFILES = {
+    # paramiko 默认值
+    "default": {"window_size": 2 * 1024 * 1024, "max_packet_size": 32 * 1024, "ciphers": (), "macs": (), "compress": False,
+                "sftp_pipelined": False, "scp_buffer": 16 * 1024},
+    # 低延迟局域网：瓶颈在 CPU，优先 AES-GCM（加密和认证一步完成，不需要单独计算 MAC），大包减少逐包开销
+    # 窗口不宜过大：paramiko 的接收缓冲每次读取都要移动剩余数据，积压越多越慢，超过带宽时延积的窗口只会拖慢读取
+    "lan": {"window_size": 4 * 1024 * 1024, "max_packet_size": 128 * 1024, "ciphers": ("aes128-gcm@openssh.com", "aes128-ctr"),
+            "macs": ("hmac-sha2-256-etm@openssh.com", "hmac-sha2-256"), "compress": False, "sftp_pipelined": True, "scp_buffer": 256 * 1024},
+    # 高延迟的广域网：窗口要覆盖带宽时延积，SFTP 写入流水线发出，否则每个往返都要停下来等待窗口调整或写入确认
+    "wan": {"window_size": 8 * 1024 * 1024, "max_packet_size": 128 * 1024, "ciphers": ("aes128-gcm@openssh.com", "aes128-ctr"),
+            "macs": ("hmac-sha2-256-etm@openssh.com", "hmac-sha2-256"), "compress": False, "sftp_pipelined": True, "scp_buffer": 1024 * 1024},
+    # 慢速链路上的文本、日志等可压缩数据：开启 zlib 压缩，用 CPU 换带宽
+    "compressible": {"window_size": 4 * 1024 * 1024, "max_packet_size": 32 * 1024, "ciphers": ("aes128-gcm@openssh.com", "aes128-ctr"),
+                     "macs": ("hmac-sha2-256-etm@openssh.com", "hmac-sha2-256"), "compress": True, "sftp_pipelined": True,
+                     "scp_buffer": 256 * 1024},
+}
+PROFILE_PROBE_BYTES = 16 * 1024 * 1024  # auto 模式测量带宽时最多传输的字节数
+PROFILE_PROBE_SECONDS = 1.0  # auto 模式测量带宽最多持续的时间（秒）
+PROFILE_LAN_RTT = 0.005  # 往返延迟低于此值（秒）视为局域网
+PROFILE_SLOW_BANDWIDTH = 2 * 1024 * 1024  # 带宽低于此值（字节/秒）时选择 compressible
+PROFILE_CACHE_SECONDS = 24 * 3600  # auto 模式选定的预设在状态库中缓存的时间（秒），期间重新运行不再测量
+
+def choose_profile(rtt, bandwidth):
+    """
+    auto 模式：根据第一个连接测得的往返延迟和带宽选择传输参数预设；没有测量带宽（bandwidth 为 None）时只按往返延迟选择
+    """
+    if rtt < PROFILE_LAN_RTT:
+        return "lan"
+    if bandwidth is not None and bandwidth < PROFILE_SLOW_BANDWIDTH:
+        return "compressible"
+    return "wan"
+
+def probe_bandwidth(ssh):
+    """
+    测量上行带宽：向远程的 cat > /dev/null 发送数据，最多 PROFILE_PROBE_BYTES 字节或 PROFILE_PROBE_SECONDS 秒，
+    等远程读完（命令退出）才停止计时
+    :return: 字节/秒
+    """
+    block = bytes(256 * 1024)
+    channel = ssh.get_transport().open_session()
+    try:
+        channel.exec_command("cat > /dev/null")
+        started, sent = time.time(), 0
+        while sent < PROFILE_PROBE_BYTES and time.time() - started < PROFILE_PROBE_SECONDS:
+            channel.sendall(block)
+            sent += len(block)
+        channel.shutdown_write()
+        channel.recv_exit_status()
+        return sent / max(time.time() - started, 1e-6)
+    finally:
+        channel.close()
+
+class SSHConnectionPool:
+    """
+    SSH 连接池：复用到同一台远程服务器的长连接，避免每个文件都重新握手和认证
+    每个连接是一个独立的 SSH transport，SCP/SFTP 通道在其上按需打开
+    """
+    def __init__(self, remote_host, remote_port, remote_user, remote_password, max_sessions=4, timeout=CONNECT_TIMEOUT, keepalive=30,
+                 metrics=None, profile="default", state=None, probe=True):
+        """
+        :param max_sessions: 该主机同时存在的最大连接数，超出时 acquire() 会等待
+        :param timeout: 建立连接、握手和认证的超时时间（秒）
+        :param keepalive: 空闲连接的保活间隔（秒）
+        :param metrics: 传输指标（TransferMetrics），建立连接的耗时计入当前文件的 connect 和 auth 阶段
+        :param profile: 传输参数预设（TRANSPORT_PROFILES 中的名称），auto 表示在第一个连接上测量往返延迟和带宽后自动选择
+        :param state: 传输状态库（TransferState），auto 模式选定的预设缓存在其中，PROFILE_CACHE_SECONDS 内不再测量；None 表示不缓存
+        :param probe: auto 模式是否测量带宽；为 False（试运行）时只按往返延迟选择
+        """
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.remote_user = remote_user
+        self.remote_password = remote_password
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.metrics = metrics if metrics is not None else TransferMetrics()
+        self.host_label = f"{remote_host}:{remote_port}"  # 指标中的主机名
+        self._idle = []  # 空闲连接（后进先出，优先复用最近使用过的连接）
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(max_sessions)
+        self.breaker = CircuitBreaker(self.host_label)
+        self.profile_name = profile
+        # auto 模式下测量用的连接使用 wan 的窗口（比默认值大，不会限制测量结果），测量后切换为选定的预设
+        self.profile = TRANSPORT_PROFILES["wan" if profile == "auto" else profile]
+        self._probe_lock = Lock()
+        self.state = state
+        self.probe = probe
+        self.planned_bytes = None  # 调用方在建立第一个连接前已知的计划传输字节数，小于 PROFILE_PROBE_BYTES 时不测量带宽
+        self.connect_stats = (0, 0.0)  # 已建立的连接数、它们 TCP 连接、握手和认证的累计耗时（秒），并发控制据此判断远程是否过载
+
+    def _transport(self, sock, **kwargs):
+        # 窗口和最大包长在创建 Transport 时指定；算法的优先顺序必须在协商（start_client）之前设置
+        profile = self.profile
+        transport = paramiko.Transport(sock, default_window_size=profile["window_size"], default_max_packet_size=profile["max_packet_size"], **kwargs)
+        options = transport.get_security_options()
+        options.ciphers = tuple(name for name in profile["ciphers"] if name in options.ciphers) + \
+            tuple(name for name in options.ciphers if name not in profile["ciphers"])
+        options.digests = tuple(name for name in profile["macs"] if name in options.digests) + \
+            tuple(name for name in options.digests if name not in profile["macs"])
+        return transport
+
+    def _choose_profile(self, ssh):
+        """
+        auto 模式：在第一个连接上测量往返延迟（几次全局请求中最快的一次）和带宽，选定之后所有连接使用的传输参数预设
+        该连接的加密算法和压缩已经协商完成，只调整它之后打开的通道的窗口和包长
+        带宽测量要传输最多 PROFILE_PROBE_BYTES 字节，只在需要时进行：状态库中有该主机近期的结果时直接使用，
+        往返延迟已判定为局域网、试运行、计划传输的字节数少于测量量时不测量带宽（只按往返延迟选择，不缓存）
+        """
+        with self._probe_lock:
+            if self.profile_name != "auto":
+                return
+            transport = ssh.get_transport()
+            cached = self.state.cached_profile(self.host_label) if self.state is not None else None
+            if cached is not None and time.time() - cached[1] < PROFILE_CACHE_SECONDS:
+                self._apply_profile(transport, cached[0])
+                print(f"传输参数自动选择: {self.host_label} 使用状态库中 {(time.time() - cached[1]) / 3600:.1f} 小时前的测量结果，"
+                      f"预设 {self.profile_name}")
+                return
+            try:
+                rtts = []
+                for _ in range(3):
+                    started = time.time()
+                    transport.global_request("keepalive@openssh.com", wait=True)
+                    rtts.append(time.time() - started)
+                rtt = min(rtts)
+                small = self.planned_bytes is not None and self.planned_bytes < PROFILE_PROBE_BYTES
+                bandwidth = probe_bandwidth(ssh) if rtt >= PROFILE_LAN_RTT and self.probe and not small else None
+            except Exception as e:
+                print(f"无法测量到 {self.host_label} 的链路，使用传输参数预设 wan: {e}")
+                self.profile_name = "wan"
+                return
+            self._apply_profile(transport, choose_profile(rtt, bandwidth))
+            if self.state is not None and (bandwidth is not None or self.profile_name == "lan"):
+                self.state.record_profile(self.host_label, self.profile_name)
+            print(f"传输参数自动选择: {self.host_label} 往返延迟 {rtt * 1000:.1f} 毫秒，"
+                  + (f"带宽约 {format_size(bandwidth)}/s，" if bandwidth is not None else "未测量带宽，")
+                  + f"使用预设 {self.profile_name}")
+
+    def _apply_profile(self, transport, name):
+        self.profile_name = name
+        self.profile = TRANSPORT_PROFILES[name]
+        transport.default_window_size = self.profile["window_size"]
+        transport.default_max_packet_size = self.profile["max_packet_size"]
+
+    def _connect(self):
+        """
+        建立一个新的 SSH 连接；主机已熔断时立即抛出 HostUnavailableError，不等待连接超时
+        """
+        self.breaker.before_connect()
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        print(f"正在连接远程服务器 {self.remote_host}:{self.remote_port}...")
+        started = time.time()
+        try:
+            with self.metrics.phase("connect"):
+                sock = socket.create_connection((self.remote_host, self.remote_port), timeout=self.timeout)
+            try:
+                with self.metrics.phase("auth"):
+                    ssh.connect(self.remote_host, port=self.remote_port, username=self.remote_user, password=self.remote_password,
+                                timeout=self.timeout, banner_timeout=self.timeout, auth_timeout=self.timeout, sock=sock,
+                                compress=self.profile["compress"], transport_factory=self._transport)
+            except BaseException:
+                sock.close()
+                raise
+        except Exception as e:
+            self.breaker.failed(e, fatal=not is_retryable(e))
+            raise
+        self.breaker.succeeded()
+        with self._lock:
+            connections, seconds = self.connect_stats
+            self.connect_stats = (connections + 1, seconds + time.time() - started)
+        ssh.get_transport().set_keepalive(self.keepalive)
+        print(f"成功连接到远程服务器 {self.remote_host}:{self.remote_port}！")
+        if self.profile_name == "auto":
+            self._choose_profile(ssh)
+        return ssh
+
+    @staticmethod
+    def _is_healthy(ssh):
+        """
+        健康检查：transport 仍然活跃且已认证，并且能发出一个 ignore 包
+        """
+        transport = ssh.get_transport()
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def acquire(self):
+        """
+        取出一个可用连接，失效的空闲连接会被关闭并透明地重新建立
+        """
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    ssh = self._idle.pop() if self._idle else None
+                if ssh is None:
+                    return self._connect()
+                if self._is_healthy(ssh):
+                    return ssh
+                print(f"检测到失效连接，正在重新连接 {self.remote_host}:{self.remote_port}...")
+                ssh.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, ssh, discard=False):
+        """
+        归还连接；discard 为 True 或连接已断开时直接关闭
+        """
+        try:
+            transport = ssh.get_transport()
+            if discard or transport is None or not transport.is_active():
+                ssh.close()
+            else:
+                with self._lock:
+                    self._idle.append(ssh)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        with pool.connection() as ssh: ...
+        连接层错误（SSH/socket）时丢弃该连接，其它错误时连接照常归还
+        """
+        ssh = self.acquire()
+        try:
+            yield ssh
+        except (paramiko.SSHException, socket.error, EOFError):
+            self.release(ssh, discard=True)
+            raise
+        except BaseException:
+            self.release(ssh)
+            raise
+        else:
+            self.release(ssh)
+
+    def close_all(self):
+        """
+        关闭所有空闲连接
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ssh in idle:
+            ssh.close()
+
 def remote_file_exists(ssh, remote_file_path):
     """
     检查远程服务器上是否存在目标文件
@@ -38,6 +476,8 @@ def remote_file_exists(ssh, remote_file_path):
     try:
         stdin, stdout, stderr = ssh.exec_command(f"test -e {remote_file_path} && echo exists")
         return "exists" in stdout.read().decode().strip()
+    except (paramiko.SSHException, socket.error, EOFError):
+        raise  # 连接断开不能当作文件不存在，交给调用方按可重试的错误处理
     except Exception as e:
         print(f"Failed to check remote file {remote_file_path}: {e}")
         return False
@@ -57,133 +497,3242 @@ def remote_mkdir(ssh, remote_dir):
         print(f"Failed to create remote directory {remote_dir}: {e}")
         return False
 
-def scp_transfer(file_path, remote_path, remote_host, remote_port, remote_user, remote_password, retries=3):
+def build_remote_index(ssh, remote_base_path):
+    """
+    一次性列出远程目标路径下的所有条目（路径、大小、修改时间），边读边解析为内存索引
+    :return: (files, dirs)，files 为 {远程文件路径: (大小, 修改时间)}，dirs 为已存在的远程目录集合；
+             远程列出失败（例如 find 不支持 -printf）时返回 None，调用方应回退到逐个文件检查
+    """
+    base = shlex.quote(remote_base_path)
+    command = f"if [ -e {base} ]; then find {base} -printf '%y %s %T@ %P\\0'; fi"
+    files, dirs = {}, set()
+    try:
+        stdin, stdout, stderr = ssh.exec_command(command)
+        pending = b""
+        while True:
+            chunk = stdout.read(65536)
+            if not chunk:
+                break
+            records = (pending + chunk).split(b"\0")
+            pending = records.pop()  # 最后一段可能是不完整的记录
+            for record in records:
+                kind, size, mtime, relative_path = record.decode("utf-8", "surrogateescape").split(" ", 3)
+                path = os.path.normpath(os.path.join(remote_base_path, relative_path))
+                if kind == "f":
+                    files[path] = (int(size), float(mtime))
+                elif kind == "d":
+                    dirs.add(path)
+        if stdout.channel.recv_exit_status() != 0:
+            print(f"Failed to list remote path {remote_base_path}: {stderr.read().decode().strip()}")
+            return None
+    except Exception as e:
+        print(f"Failed to list remote path {remote_base_path}: {e}")
+        return None
+    return files, dirs
+
+def remote_tree_summary(ssh, remote_base_path):
+    """
+    统计远程目标路径下的文件数和总字节数：远程逐个统计，只传回一行结果，不传回文件列表
+    :return: (文件数, 总字节数)，目标路径不存在时为 (0, 0)
+    """
+    base = shlex.quote(remote_base_path)
+    command = f"if [ -e {base} ]; then find {base} -type f -printf '%s\\n'; fi | awk '{{n++; s+=$1}} END {{printf \"%.0f %.0f\\n\", n, s}}'"
+    stdin, stdout, stderr = ssh.exec_command(command)
+    output = stdout.read().decode().split()
+    if stdout.channel.recv_exit_status() != 0 or len(output) != 2:
+        raise IOError(f"无法统计远程路径 {remote_base_path}: {stderr.read().decode().strip()}")
+    return int(output[0]), int(output[1])
+
+def remote_set_mtime(ssh, remote_path, mtime):
+    """
+    设置远程文件的修改时间（SCP 从文件对象推送时无法携带时间）
+    """
+    stdin, stdout, stderr = ssh.exec_command(f"touch -c -m -d @{int(mtime)} {shlex.quote(remote_path)}")
+    if stdout.channel.recv_exit_status() != 0:
+        raise IOError(f"无法设置远程文件修改时间: {stderr.read().decode().strip()}")
+
+def remote_mkdirs(ssh, remote_dirs):
+    """
+    通过一条 xargs 命令批量创建所有缺失的远程目录
+    """
+    if not remote_dirs:
+        return True
+    try:
+        stdin, stdout, stderr = ssh.exec_command("xargs -0 mkdir -p --")
+        stdin.write(b"\0".join(d.encode("utf-8", "surrogateescape") for d in sorted(remote_dirs)))
+        stdin.channel.shutdown_write()
+        stderr_output = stderr.read().decode().strip()
+        if stdout.channel.recv_exit_status() != 0:
+            print(f"Failed to create remote directories: {stderr_output}")
+            return False
+        return True
+    except Exception as e:
+        print(f"Failed to create remote directories: {e}")
+        return False
+
+# 在远程创建重复文件的命令：$0 为源文件，$1 为目标文件；不支持 --reflink 的 cp（BusyBox、BSD）退回普通复制
+DEDUP_COMMANDS = {
+    "copy": 'cp --reflink=auto -- "$0" "$1" 2>/dev/null || cp -- "$0" "$1"',
+    "hardlink": 'ln -f -- "$0" "$1"',
+}
+
+def remote_copy_files(ssh, copies, mode="copy"):
+    """
+    通过一条 xargs 命令在远程批量创建重复文件：copy 复制（文件系统支持时共享数据块），hardlink 创建硬链接
+    :param copies: [(远程源文件, 远程目标文件, 修改时间或 None), ...]
+    :return: 创建成功的远程目标文件集合
+    """
+    if not copies:
+        return set()
+    script = f'{DEDUP_COMMANDS[mode]} && {{ [ "$2" = - ] || touch -m -d "@$2" -- "$1"; }} && printf "%s\\0" "$1"'
+    stdin, stdout, stderr = ssh.exec_command(f"xargs -0 -n 3 sh -c {shlex.quote(script)}")
+    stdin.write(b"".join(b"%s\0%s\0%s\0" % (source.encode("utf-8", "surrogateescape"), target.encode("utf-8", "surrogateescape"),
+                                             b"-" if mtime is None else str(int(mtime)).encode()) for source, target, mtime in copies))
+    stdin.channel.shutdown_write()
+    created = {path.decode("utf-8", "surrogateescape") for path in stdout.read().split(b"\0") if path}
+    if stdout.channel.recv_exit_status() != 0:
+        print(f"部分重复文件无法在远程创建: {stderr.read().decode().strip()}")
+    return created
+
+def format_size(num_bytes):
+    """
+    将字节数格式化为易读的字符串
+    """
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if num_bytes < 1024 or unit == "TB":
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{int(num_bytes)} B"
+        num_bytes /= 1024
+
+def file_sha256(file_path):
+    """
+    计算本地文件的 SHA-256
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def remote_sha256sums(ssh, remote_paths):
+    """
+    通过一条 xargs sha256sum 命令批量计算远程文件的 SHA-256
+    :return: {远程文件路径: 十六进制摘要}，计算失败的文件不在结果中
+    """
+    if not remote_paths:
+        return {}
+    sums = {}
+    try:
+        stdin, stdout, stderr = ssh.exec_command("xargs -0 sha256sum --")
+        stdin.write(b"\0".join(p.encode("utf-8", "surrogateescape") for p in remote_paths))
+        stdin.channel.shutdown_write()
+        for line in stdout.read().decode("utf-8", "surrogateescape").splitlines():
+            digest, _, path = line.partition("  ")
+            if digest.startswith("\\"):
+                # 文件名包含反斜杠或换行时 sha256sum 会转义输出
+                digest = digest[1:]
+                path = path.replace("\\n", "\n").replace("\\\\", "\\")
+            sums[path] = digest
+    except Exception as e:
+        print(f"Failed to compute remote checksums: {e}")
+    return sums
+
+def needs_transfer(local_size, local_mtime, remote_entry, sync_mode):
+    """
+    根据同步模式判断文件是否需要传输
+    :param remote_entry: 目标端的 (大小, 修改时间)，不存在时为 None
+    :param sync_mode: skip（存在即跳过）、sync（比较大小和修改时间）、checksum（大小相同时再比较校验和）
+    :return: True 需要传输，False 跳过，None 需要进一步比较校验和
+    """
+    if remote_entry is None:
+        return True
+    if sync_mode == "skip":
+        return False
+    remote_size, remote_mtime = remote_entry
+    if local_size != remote_size:
+        return True
+    if sync_mode == "checksum":
+        return None
+    # SCP 保留的时间戳精确到秒
+    return int(local_mtime) != int(remote_mtime)
+
+# 以下增量传输函数会通过 inspect.getsource() 原样发送到远程执行，因此只依赖标准库并在函数内部导入
+DELTA_BLOCK_SIZE = 128 * 1024  # 增量传输的块大小
+DELTA_READ_SIZE = 8 * 1024 * 1024  # 增量匹配时每次读取的字节数
+
+def delta_signatures(f, block_size):
+    """
+    计算接收端文件每个完整块的弱校验和（adler32）和强校验和（MD5）
+    :return: 生成 (弱校验和, 强校验和)
+    """
+    import hashlib, zlib
+    while True:
+        block = f.read(block_size)
+        if len(block) < block_size:
+            break
+        yield zlib.adler32(block), hashlib.md5(block).digest()
+
+def delta_match(f, signatures, block_size, resync_window=65536):
+    """
+    rsync 算法：在发送端文件中查找接收端已有的块
+    先在当前位置整块比较，不匹配时逐字节滚动弱校验和寻找错位的块，
+    滚动超过 block_size + resync_window 仍未匹配则把这一段作为字面数据发送，只有变化区域才需要逐字节滚动
+    :return: 生成 ("copy", 起始块序号, 连续块数)、("literal", 数据)，最后生成 ("end", 整个文件的 SHA-256)
+    """
+    import hashlib, zlib
+    table = {}
+    for index, (weak, strong) in enumerate(signatures):
+        table.setdefault(weak, {}).setdefault(strong, index)
+    digest = hashlib.sha256()
+    buf = bytearray()
+    pos = literal_start = 0
+    eof = False
+    rolling = False
+    rolled = 0
+    a = b = 0
+    copy_start, copy_count = -1, 0
+    while True:
+        if not eof and len(buf) - pos <= block_size:
+            # 丢弃已处理的数据后补充缓冲区
+            del buf[:literal_start]
+            pos -= literal_start
+            literal_start = 0
+            chunk = f.read(DELTA_READ_SIZE)
+            if chunk:
+                digest.update(chunk)
+                buf += chunk
+            else:
+                eof = True
+            continue
+        if len(buf) - pos < block_size:
+            break
+        if not rolling:
+            weak = zlib.adler32(buf[pos:pos + block_size])
+            a, b = weak & 0xFFFF, weak >> 16
+            rolling = True
+        candidates = table.get((b << 16) | a)
+        index = None
+        if candidates:
+            index = candidates.get(hashlib.md5(buf[pos:pos + block_size]).digest())
+        if index is not None:
+            if literal_start < pos:
+                if copy_count:
+                    yield "copy", copy_start, copy_count
+                    copy_count = 0
+                yield "literal", bytes(buf[literal_start:pos])
+            if copy_count and copy_start + copy_count == index:
+                copy_count += 1
+            else:
+                if copy_count:
+                    yield "copy", copy_start, copy_count
+                copy_start, copy_count = index, 1
+            pos += block_size
+            literal_start = pos
+            rolling = False
+            rolled = 0
+            continue
+        if pos + block_size >= len(buf):
+            break
+        if rolled < block_size + resync_window:
+            # 滚动一个字节：移出 buf[pos]，移入 buf[pos + block_size]
+            out_byte, in_byte = buf[pos], buf[pos + block_size]
+            a = (a - out_byte + in_byte) % 65521
+            b = (b - block_size * out_byte + a - 1) % 65521
+            pos += 1
+            rolled += 1
+        else:
+            pos += block_size
+            rolling = False
+            rolled = 0
+        if pos - literal_start >= DELTA_READ_SIZE:
+            if copy_count:
+                yield "copy", copy_start, copy_count
+                copy_count = 0
+            yield "literal", bytes(buf[literal_start:pos])
+            literal_start = pos
+    if copy_count:
+        yield "copy", copy_start, copy_count
+    if literal_start < len(buf):
+        yield "literal", bytes(buf[literal_start:])
+    yield "end", digest.digest()
+
+def write_delta(out, ops):
+    """
+    将增量指令编码写出：C=复制块，L=字面数据，E=结束并附带 SHA-256
+    :return: (字面数据字节数, 复制数据块数)
+    """
+    import struct
+    literal_bytes = copied_blocks = 0
+    for op in ops:
+        if op[0] == "copy":
+            out.write(b"C" + struct.pack(">QI", op[1], op[2]))
+            copied_blocks += op[2]
+        elif op[0] == "literal":
+            out.write(b"L" + struct.pack(">I", len(op[1])))
+            out.write(op[1])
+            literal_bytes += len(op[1])
+        else:
+            out.write(b"E" + op[1])
+    return literal_bytes, copied_blocks
+
+def read_delta(inp):
+    """
+    解码 write_delta() 写出的增量指令
+    """
+    import struct
+    while True:
+        tag = inp.read(1)
+        if tag == b"C":
+            start, count = struct.unpack(">QI", inp.read(12))
+            yield "copy", start, count
+        elif tag == b"L":
+            (length,) = struct.unpack(">I", inp.read(4))
+            yield "literal", inp.read(length)
+        elif tag == b"E":
+            yield "end", inp.read(32)
+            return
+        else:
+            raise EOFError("增量数据流意外结束")
+
+def delta_apply(path, ops, block_size, mtime=None):
+    """
+    接收端：以现有文件为基础按增量指令重建文件，写入同目录临时文件，
+    校验 SHA-256 一致后 fsync 并原子替换原文件
+    """
+    import hashlib, os
+    temp_path = f"{path}.delta.tmp"
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as basis, open(temp_path, "wb") as out:
+            for op in ops:
+                if op[0] == "copy":
+                    basis.seek(op[1] * block_size)
+                    remaining = op[2] * block_size
+                    while remaining:
+                        data = basis.read(min(remaining, 8 * 1024 * 1024))
+                        if not data:
+                            raise EOFError("基础文件在增量传输过程中发生了变化")
+                        digest.update(data)
+                        out.write(data)
+                        remaining -= len(data)
+                elif op[0] == "literal":
+                    digest.update(op[1])
+                    out.write(op[1])
+                elif digest.digest() != op[1]:
+                    raise ValueError("增量重建后的文件校验和不一致")
+                else:
+                    out.flush()
+                    os.fsync(out.fileno())
+                    break
+            else:
+                raise EOFError("增量数据流意外结束")
+        if mtime is not None:
+            os.utime(temp_path, (mtime, mtime))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def delta_helper_main(argv):
+    """
+    远程辅助程序入口（python3 -c 执行）：
+    sig <路径> <块大小>            输出文件的块签名
+    patch <路径> <块大小> <mtime>  从 stdin 读取增量指令并重建文件
+    delta <路径> <块大小>          从 stdin 读取对端签名，输出该文件相对对端的增量指令
+    """
+    import struct, sys
+    mode, path, block_size = argv[1], argv[2], int(argv[3])
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    if mode == "sig":
+        with open(path, "rb") as f:
+            for weak, strong in delta_signatures(f, block_size):
+                stdout.write(struct.pack(">I16s", weak, strong))
+    elif mode == "patch":
+        delta_apply(path, read_delta(stdin), block_size, float(argv[4]))
+        stdout.write(b"OK\n")
+    elif mode == "delta":
+        signatures = []
+        while True:
+            record = stdin.read(20)
+            if len(record) < 20:
+                break
+            signatures.append(struct.unpack(">I16s", record))
+        with open(path, "rb") as f:
+            write_delta(stdout, delta_match(f, signatures, block_size))
+    stdout.flush()
+
+def delta_helper_command(*args):
+    """
+    构造在远程执行增量辅助程序的命令（远程需要 python3）
+    """
+    functions = (delta_signatures, delta_match, write_delta, read_delta, delta_apply, delta_helper_main)
+    source = "\n".join([f"DELTA_READ_SIZE = {DELTA_READ_SIZE}"] + [inspect.getsource(fn) for fn in functions])
+    source += "\nimport sys\ndelta_helper_main(sys.argv)\n"
+    return " ".join(["python3", "-c", shlex.quote(source)] + [shlex.quote(str(arg)) for arg in args])
+
+def delta_push(ssh, file_path, remote_path, block_size=DELTA_BLOCK_SIZE, limiter=None, digests=None):
+    """
+    增量推送：远程计算现有文件的块签名，本地匹配后只发送字面数据和块引用，由远程原子地重建文件
+    :param digests: 不为 None 时把匹配过程中计算的本地文件 SHA-256 记入其中
+    :return: 成功返回 True；远程无法运行辅助程序（例如没有 python3）时返回 False，调用方应回退到完整传输
+    """
+    stdin, stdout, stderr = ssh.exec_command(delta_helper_command("sig", remote_path, block_size))
+    data = stdout.read()
+    if stdout.channel.recv_exit_status() != 0:
+        print(f"远程无法计算块签名，回退到完整传输: {remote_path}: {stderr.read().decode().strip()}")
+        return False
+    signatures = [struct.unpack_from(">I16s", data, offset) for offset in range(0, len(data) - 19, 20)]
+
+    def recorded(ops):
+        for op in ops:
+            if op[0] == "end" and digests is not None:
+                digests[file_path] = op[1].hex()
+            yield op
+
+    mtime = os.stat(file_path).st_mtime
+    stdin, stdout, stderr = ssh.exec_command(delta_helper_command("patch", remote_path, block_size, mtime))
+    with open(file_path, "rb") as f:
+        literal_bytes, copied_blocks = write_delta(throttled(stdin, limiter), recorded(delta_match(f, signatures, block_size)))
+    stdin.channel.shutdown_write()
+    result = stdout.read().strip()
+    if stdout.channel.recv_exit_status() != 0 or result != b"OK":
+        raise IOError(f"远程增量重建失败: {stderr.read().decode().strip()}")
+    print(f"增量推送完成: {file_path} -> {remote_path}，发送字面数据 {format_size(literal_bytes)}，复用 {copied_blocks} 个块")
+    return True
+
+METRICS_PREFIX = "push_files_"  # Prometheus 指标名前缀
+METRICS_INTERVAL = 5  # 只输出 Prometheus 指标文件、不显示进度时的刷新间隔（秒）
+
+class TransferMetrics:
+    """
+    传输指标：记录每个文件各阶段的耗时、字节数、重试次数和错误，按主机汇总字节/秒、文件/秒和队列深度
+    阶段：connect（建立 TCP 连接）、auth（SSH 握手和认证）、check（检查远程文件）、mkdir（创建远程目录）、
+          transfer（传输数据）、close（关闭通道、设置时间、重命名临时文件）
+    每个工作线程在线程本地变量里记录自己正在传输的文件，阶段计时不加锁；
+    字节数由限速器按 RATE_QUANTUM 批量累加，只有批量累加和文件结束时才加锁
+    """
+    PHASES = ("connect", "auth", "check", "mkdir", "transfer", "close")
+
+    def __init__(self, metrics_path=None):
+        """
+        :param metrics_path: 每个文件结束时向该文件追加一行 JSON，None 表示不写
+        """
+        self.started = time.time()
+        self._local = local()
+        self._lock = Lock()
+        self._hosts = {}  # 主机 -> 汇总计数
+        self._queues = {}  # 主机 -> 调度窗口，用于读取队列深度
+        self._log = open(metrics_path, "a", encoding="utf-8") if metrics_path else None
+
+    def _counters(self, host):
+        # 调用方持有 self._lock
+        if host not in self._hosts:
+            self._hosts[host] = {"bytes": 0, "done_bytes": 0, "files": 0, "failed": 0, "retries": 0, "dedup_files": 0, "dedup_bytes": 0,
+                                 "phases": dict.fromkeys(self.PHASES, 0.0)}
+        return self._hosts[host]
+
+    def watch_queue(self, host, file_queue):
+        """
+        登记主机的调度窗口，进度和指标中输出它的队列深度
+        """
+        with self._lock:
+            self._counters(host)
+            self._queues[host] = file_queue
+
+    def start_file(self, host, path, size, files=1):
+        """
+        当前线程开始传输一个文件（或一个包含 files 个文件的打包）
+        """
+        self._local.record = {"host": host, "file": path, "files": files, "bytes": size, "phases": {}, "retries": 0,
+                              "error": None, "started": time.time()}
+
+    def add_phase(self, name, seconds):
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record["phases"][name] = record["phases"].get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        """
+        with metrics.phase("transfer"): ...  耗时计入当前线程正在传输的文件；当前线程没有文件时（例如分块通道）不记录
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started)
+
+    def record_error(self, error, retrying):
+        """
+        当前线程的文件传输出错；retrying 为 True 时表示还会重试，计入重试次数
+        """
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record["retries"] += 1 if retrying else 0
+            record["error"] = str(error)
+
+    def add_bytes(self, host, size):
+        with self._lock:
+            self._counters(host)["bytes"] += size
+
+    def add_dedup(self, host, files, size):
+        """
+        记录去重：files 个重复文件由目标端从相同内容创建，节省传输 size 字节
+        """
+        with self._lock:
+            counters = self._counters(host)
+            counters["dedup_files"] += files
+            counters["dedup_bytes"] += size
+
+    def finish_file(self, ok, error=None, retrying=False, failed=0):
+        """
+        当前线程的文件结束：计入汇总，写一行 JSON
+        retrying 为 True 时表示文件已延迟重新放入调度窗口，记为 retry、不计入失败
+        failed 为成功的打包中没有传输的文件数，计入失败、不计入完成
+        """
+        record = getattr(self._local, "record", None)
+        if record is None:
+            return
+        self._local.record = None
+        record["status"] = "ok" if ok else "retry" if retrying else "failed"
+        if error is not None:
+            record["error"] = str(error)
+        record["seconds"] = round(time.time() - record.pop("started"), 6)
+        record["phases"] = {name: round(seconds, 6) for name, seconds in record["phases"].items()}
+        if failed:
+            record["failed_files"] = failed
+        with self._lock:
+            counters = self._counters(record["host"])
+            if ok:
+                counters["files"] += record["files"] - failed
+                counters["failed"] += failed
+                counters["done_bytes"] += record["bytes"]
+            elif not retrying:
+                counters["failed"] += record["files"]
+            counters["retries"] += record["retries"]
+            for name, seconds in record["phases"].items():
+                counters["phases"][name] = counters["phases"].get(name, 0.0) + seconds
+            if self._log is not None:
+                self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._log.flush()
+
+    def snapshot(self):
+        """
+        :return: (已运行秒数, {主机: 汇总计数})，汇总计数包含 bytes_per_second、files_per_second 和 queue_depth
+        """
+        elapsed = max(time.time() - self.started, 1e-6)
+        with self._lock:
+            hosts = {host: dict(counters, phases=dict(counters["phases"])) for host, counters in self._hosts.items()}
+            queues = dict(self._queues)
+        for host, counters in hosts.items():
+            counters["queue_depth"] = queues[host].qsize() if host in queues else 0
+            counters["bytes_per_second"] = counters["bytes"] / elapsed
+            counters["files_per_second"] = counters["files"] / elapsed
+        return elapsed, hosts
+
+    def print_progress(self):
+        """
+        每台主机输出一行进度，速率按距上一次输出之间的增量计算
+        """
+        elapsed, hosts = self.snapshot()
+        previous = getattr(self, "_previous", {})
+        for host, counters in hosts.items():
+            last_elapsed, last_bytes, last_files = previous.get(host, (0.0, 0, 0))
+            interval = max(elapsed - last_elapsed, 1e-6)
+            label = f"[{host}] " if len(hosts) > 1 else ""
+            print(f"{label}进度: 已完成 {counters['files']} 个文件（失败 {counters['failed']} 个），已传输 {format_size(counters['bytes'])}，"
+                  f"当前 {format_size((counters['bytes'] - last_bytes) / interval)}/s，{(counters['files'] - last_files) / interval:.1f} 个文件/秒，"
+                  f"队列中 {counters['queue_depth']} 个任务")
+        self._previous = {host: (elapsed, counters["bytes"], counters["files"]) for host, counters in hosts.items()}
+
+    def write_prometheus(self, path):
+        """
+        以 Prometheus 文本格式写入指标（可由 node_exporter 的 textfile collector 采集），先写临时文件再原子替换
+        """
+        _, hosts = self.snapshot()
+        lines = []
+        for name, kind, key in (("transferred_bytes_total", "counter", "bytes"), ("files_total", "counter", "files"),
+                                ("failed_files_total", "counter", "failed"), ("retries_total", "counter", "retries"),
+                                ("bytes_per_second", "gauge", "bytes_per_second"), ("files_per_second", "gauge", "files_per_second"),
+                                ("queue_depth", "gauge", "queue_depth"), ("dedup_files_total", "counter", "dedup_files"),
+                                ("dedup_saved_bytes_total", "counter", "dedup_bytes")):
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+            lines.extend(f'{METRICS_PREFIX}{name}{{host="{host}"}} {counters[key]}' for host, counters in hosts.items())
+        lines.append(f"# TYPE {METRICS_PREFIX}phase_seconds_total counter")
+        for host, counters in hosts.items():
+            lines.extend(f'{METRICS_PREFIX}phase_seconds_total{{host="{host}",phase="{name}"}} {seconds:.6f}'
+                         for name, seconds in counters["phases"].items())
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+    def report_periodically(self, stop_event, interval, show_progress=True, prom_path=None):
+        """
+        在单独的线程中运行：每 interval 秒输出一行进度、刷新 Prometheus 指标文件，直到 stop_event 被设置
+        """
+        while not stop_event.wait(interval):
+            if show_progress:
+                self.print_progress()
+            if prom_path:
+                self.write_prometheus(prom_path)
+
+    def summary(self):
+        """
+        输出每台主机的汇总：文件数、字节数、失败和重试次数、去重节省的字节数，以及各阶段的累计耗时（时间花在了哪里）
+        """
+        elapsed, hosts = self.snapshot()
+        for host, counters in hosts.items():
+            label = f"[{host}] " if len(hosts) > 1 else ""
+            phases = "，".join(f"{name} {seconds:.1f} 秒" for name, seconds in counters["phases"].items() if seconds)
+            dedup = f"，去重 {counters['dedup_files']} 个文件（节省 {format_size(counters['dedup_bytes'])}）" if counters["dedup_files"] else ""
+            print(f"{label}传输指标: 完成 {counters['files']} 个文件（{format_size(counters['done_bytes'])}），失败 {counters['failed']} 个，"
+                  f"重试 {counters['retries']} 次{dedup}，{counters['files'] / elapsed:.1f} 个文件/秒；各阶段累计耗时: {phases or '无'}")
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+RATE_QUANTUM = 256 * 1024  # 每个限速器积累这么多字节后才向共享令牌桶预约一次，避免每个数据块都争用锁
+RATE_BURST_SECONDS = 0.5  # 令牌桶最多积累这么多秒的令牌
+
+def parse_rate(text):
+    """
+    解析速率，例如 "10M"、"512K"、"1.5G"（字节/秒，不带单位时为字节/秒），空字符串或 0 表示不限速
+    """
+    text = str(text).strip().upper().rstrip("B/S")
+    if not text:
+        return 0
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+def parse_rate_schedule(text):
+    """
+    解析限速时间表，例如 "08:00-20:00=10M,20:00-08:00=100M"，时间段可以跨越午夜
+    :return: [(开始分钟, 结束分钟, 字节/秒), ...]
+    """
+    schedule = []
+    for entry in (text or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        window, rate = entry.split("=")
+        start, end = (int(hour) * 60 + int(minute) for hour, minute in (part.split(":") for part in window.split("-")))
+        schedule.append((start, end, parse_rate(rate)))
+    return schedule
+
+class TokenBucket:
+    """
+    令牌桶：允许透支，透支的字节按速率换算成等待时间
+    预约的先后顺序就是放行的先后顺序，多个线程共享一个桶时按请求公平分配带宽
+    """
+    def __init__(self, rate, schedule=None):
+        """
+        :param rate: 字节/秒，0 表示不限速
+        :param schedule: parse_rate_schedule 的结果，落在某个时间段内时使用该时间段的速率
+        """
+        self.rate = rate
+        self.schedule = schedule or []
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._lock = Lock()
+
+    def current_rate(self):
+        if self.schedule:
+            now = time.localtime()
+            minute = now.tm_hour * 60 + now.tm_min
+            for start, end, rate in self.schedule:
+                if start <= minute < end or (start > end and (minute >= start or minute < end)):
+                    return rate
+        return self.rate
+
+    def reserve(self, size):
+        """
+        预约 size 字节
+        :return: 调用方需要等待的秒数
+        """
+        rate = self.current_rate()
+        if not rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            burst = max(rate * RATE_BURST_SECONDS, RATE_QUANTUM)
+            self._tokens = min(burst, self._tokens + (now - self._last) * rate) - size
+            self._last = now
+            return -self._tokens / rate if self._tokens < 0 else 0
+
+class BandwidthLimiter:
+    """
+    限速器：组合全局、主机和单个文件的令牌桶，同时受所有桶的限制
+    每个线程持有自己的限速器（fork），在本地累计字节数，满 RATE_QUANTUM 才向共享令牌桶预约一次，同时计入传输指标
+    """
+    def __init__(self, buckets, file_rate=0, metrics=None, host=""):
+        """
+        :param buckets: 共享的令牌桶（全局、主机）
+        :param file_rate: 单个文件的速率上限，0 表示不限制
+        :param metrics: 传输指标，累计的字节数同时计入该主机的已传输字节数
+        :param host: 指标中的主机名
+        """
+        self.buckets = [bucket for bucket in buckets if bucket is not None]
+        self.file_rate = file_rate
+        self.metrics = metrics
+        self.host = host
+        self._file_bucket = None
+        self._pending = 0
+
+    def fork(self):
+        """
+        返回共享同一组令牌桶（包括当前文件的令牌桶）的新限速器，供另一个线程使用
+        """
+        limiter = BandwidthLimiter(self.buckets, self.file_rate, self.metrics, self.host)
+        limiter._file_bucket = self._file_bucket
+        return limiter
+
+    def start_file(self):
+        """
+        开始传输一个新文件（或一个打包），单个文件的限速从这里重新计算
+        """
+        self._file_bucket = TokenBucket(self.file_rate) if self.file_rate else None
+        return self
+
+    @property
+    def limited(self):
+        """
+        是否配置了任何限速；没有时限速器只用于统计字节数
+        """
+        return bool(self.buckets or self.file_rate)
+
+    def consume(self, size):
+        self._pending += size
+        if self._pending >= RATE_QUANTUM:
+            size, self._pending = self._pending, 0
+            if self.metrics is not None:
+                self.metrics.add_bytes(self.host, size)
+            buckets = self.buckets + ([self._file_bucket] if self._file_bucket else [])
+            wait = max([bucket.reserve(size) for bucket in buckets], default=0)
+            if wait > 0:
+                time.sleep(wait)
+
+    def scp_progress(self):
+        """
+        返回 SCPClient 的进度回调，按每次回调之间新传输的字节数限速
+        """
+        sent_before = {}
+
+        def progress(filename, size, sent):
+            self.consume(sent - sent_before.get(filename, 0))
+            sent_before[filename] = sent
+        return progress
+
+class ThrottledStream:
+    """
+    包装文件或通道对象，每次 read/write 都计入限速器；其它属性和方法直接转发
+    """
+    def __init__(self, stream, limiter):
+        self._stream = stream
+        self._limiter = limiter
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._limiter.consume(len(data))
+        return data
+
+    def write(self, data):
+        self._limiter.consume(len(data))
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __enter__(self):
+        self._stream.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._stream.__exit__(*exc_info)
+
+def throttled(stream, limiter):
+    """
+    有限速器时包装 stream，否则原样返回
+    """
+    return ThrottledStream(stream, limiter) if limiter is not None else stream
+
+class HashingStream:
+    """
+    包装文件或通道对象，把每次 read 读出或 write 写入的数据计入摘要；其它属性和方法直接转发
+    """
+    def __init__(self, stream, digest):
+        self._stream = stream
+        self._digest = digest
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._digest.update(data)
+        return data
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __enter__(self):
+        self._stream.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._stream.__exit__(*exc_info)
+
+def hashing(stream, digest):
+    """
+    有摘要对象时包装 stream，否则原样返回
+    """
+    return HashingStream(stream, digest) if digest is not None else stream
+
+SHARED_BLOCK_SIZE = 1024 * 1024  # 共享读取缓存的块大小
+SHARED_CACHE_SIZE = 256 * 1024 * 1024  # 共享读取缓存的容量
+
+class SharedFileCache:
+    """
+    多主机推送时共享的本地文件读取缓存：按块缓存文件内容（LRU），同一块只从磁盘读取一次，
+    其它主机的传输在缓存中命中；正在读取的块由其它线程等待而不是重复读取
+    落后太多的主机所需的块可能已被淘汰，这时重新从磁盘读取，不会拖住其它主机
+    """
+    def __init__(self, capacity=SHARED_CACHE_SIZE, block_size=SHARED_BLOCK_SIZE):
+        self.capacity = capacity
+        self.block_size = block_size
+        self._blocks = OrderedDict()  # {(路径, 大小, 修改时间, 块序号): 数据}
+        self._loading = {}  # {块的键: Event}，正在从磁盘读取的块
+        self._cached_bytes = 0
+        self._lock = Lock()
+        self.disk_bytes = 0  # 从磁盘读取的字节数
+        self.served_bytes = 0  # 交给传输的字节数
+
+    def read_block(self, key):
+        path, _, _, index = key
+        while True:
+            with self._lock:
+                data = self._blocks.get(key)
+                if data is not None:
+                    self._blocks.move_to_end(key)
+                    return data
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = Event()
+                    break
+            # 另一个线程正在读取这一块，读完后再查缓存
+            loading.wait()
+        data = None
+        try:
+            with open(path, "rb") as f:
+                f.seek(index * self.block_size)
+                data = f.read(self.block_size)
+            return data
+        finally:
+            with self._lock:
+                del self._loading[key]
+                if data is not None:
+                    self.disk_bytes += len(data)
+                    self._blocks[key] = data
+                    self._cached_bytes += len(data)
+                    while self._cached_bytes > self.capacity:
+                        _, evicted = self._blocks.popitem(last=False)
+                        self._cached_bytes -= len(evicted)
+            loading.set()
+
+    def add_served(self, size):
+        with self._lock:
+            self.served_bytes += size
+
+    def open(self, file_path):
+        return SharedFile(self, file_path)
+
+class SharedFile:
+    """
+    从 SharedFileCache 读取的只读文件对象，支持 read/seek/tell，可用于 tarfile、SCP putfo 和分块传输
+    """
+    def __init__(self, cache, file_path):
+        local_stat = os.stat(file_path)
+        self._cache = cache
+        self._key = (file_path, local_stat.st_size, local_stat.st_mtime_ns)
+        self.size = local_stat.st_size
+        self._pos = 0
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.size, self._pos + size)
+        parts = []
+        block_size = self._cache.block_size
+        while self._pos < end:
+            index, offset = divmod(self._pos, block_size)
+            block = self._cache.read_block(self._key + (index,))
+            if len(block) <= offset:
+                break  # 文件在传输过程中被截断
+            part = block[offset:offset + end - self._pos]
+            parts.append(part)
+            self._pos += len(part)
+        data = b"".join(parts)
+        self._cache.add_served(len(data))
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_local_file(file_path, cache=None):
+    """
+    打开要推送的本地文件；多主机推送时从共享缓存读取
+    """
+    return cache.open(file_path) if cache is not None else open(file_path, "rb")
+
+COMPRESS_MODES = ("auto", "on", "off")
+COMPRESS_MIN_SIZE = 64 * 1024  # 不小于该字节数的文件才单独压缩推送（更小的文件进入打包，由打包整体压缩）
+COMPRESS_SAMPLE_SIZE = 64 * 1024  # 判断文件是否可压缩时试压缩的开头字节数
+COMPRESS_MIN_RATIO = 0.9  # 压缩后不小于原始大小的这个比例时视为不可压缩
+COMPRESS_LEVEL = 1  # zlib 压缩级别：1 级已能得到大部分压缩收益，速度是默认级别的数倍
+COMPRESS_CHUNK_SIZE = 1024 * 1024  # 每个压缩块（一个独立的 gzip 成员）的原始字节数
+COMPRESS_INFLIGHT = 8  # 每个压缩流最多同时在压缩的块数，内存占用不超过这么多块
+COMPRESS_PROBE_INTERVAL = 16  # 某块压缩效果不好时，之后这么多块不压缩直接发送，然后再试
+# 已经压缩过的格式：不试压缩，直接原样推送
+INCOMPRESSIBLE_EXTENSIONS = frozenset((
+    ".gz", ".tgz", ".bz2", ".xz", ".txz", ".zst", ".lz4", ".lzma", ".zip", ".7z", ".rar", ".jar", ".war", ".apk", ".whl", ".deb", ".rpm",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp3", ".aac", ".ogg", ".opus", ".flac", ".mp4", ".mkv", ".mov", ".avi", ".webm",
+    ".pdf", ".docx", ".xlsx", ".pptx", ".parquet", ".orc",
+))
+
+def compression_enabled(mode, pool):
+    """
+    auto 只在广域网预设（wan）下压缩：局域网上压缩的 CPU 开销大于节省的传输时间，compressible 预设已经在 SSH 层压缩
+    """
+    return mode == "on" or (mode == "auto" and pool.profile_name == "wan")
+
+def compressible(file_path):
+    """
+    判断文件是否值得压缩：已压缩的格式按扩展名直接排除，其余文件试压缩开头的 COMPRESS_SAMPLE_SIZE 字节
+    """
+    if os.path.splitext(file_path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    try:
+        with open(file_path, "rb") as f:
+            sample = f.read(COMPRESS_SAMPLE_SIZE)
+    except OSError:
+        return False
+    return len(sample) > 0 and len(zlib.compress(sample, COMPRESS_LEVEL)) < len(sample) * COMPRESS_MIN_RATIO
+
+class Compressor:
+    """
+    压缩线程池，所有主机、所有工作线程共用：数据按 COMPRESS_CHUNK_SIZE 切块，每块压缩成一个独立的 gzip 成员，
+    多块并发压缩（zlib 压缩时释放 GIL，线程即可用满多个核，不必像进程池那样在进程间复制数据），按顺序写出；
+    远程 gzip -d 和 tar -z 把连续的多个 gzip 成员解压为一个完整的流
+    """
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self._lock = Lock()
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def writer(self, stream):
+        """
+        返回一个可写的文件对象，写入的数据压缩后写入 stream；写完后必须调用它的 close()
+        """
+        return CompressingWriter(self, stream)
+
+    def add(self, raw_bytes, sent_bytes):
+        with self._lock:
+            self.raw_bytes += raw_bytes
+            self.sent_bytes += sent_bytes
+
+    def close(self):
+        self.executor.shutdown()
+
+    def report(self):
+        if self.raw_bytes:
+            print(f"压缩传输: 原始 {format_size(self.raw_bytes)}，实际发送 {format_size(self.sent_bytes)}"
+                  f"（{self.sent_bytes / self.raw_bytes:.0%}）")
+
+class CompressingWriter:
+    """
+    Compressor 的一个压缩流：写入的数据攒够一块就提交到线程池，最早提交的块压缩完后按顺序写入下层流
+    某块压缩后不小于原始大小的 COMPRESS_MIN_RATIO 时，之后 COMPRESS_PROBE_INTERVAL 块以级别 0（不压缩的 gzip 成员）发送，
+    不为不可压缩的数据浪费 CPU；打包中可压缩和不可压缩的文件交替出现时，每隔一段重新尝试压缩
+    """
+    def __init__(self, compressor, stream):
+        self.compressor = compressor
+        self.stream = stream
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self._buffer = bytearray()
+        self._pending = deque()  # [(原始字节数, 压缩级别, Future)]，按提交顺序
+        self._skip = 0  # 接下来不压缩的块数
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= COMPRESS_CHUNK_SIZE:
+            self._submit(bytes(self._buffer[:COMPRESS_CHUNK_SIZE]))
+            del self._buffer[:COMPRESS_CHUNK_SIZE]
+        return len(data)
+
+    def _submit(self, chunk):
+        level = COMPRESS_LEVEL
+        if self._skip:
+            self._skip -= 1
+            level = 0
+        self._pending.append((len(chunk), level, self.compressor.executor.submit(gzip.compress, chunk, level, mtime=0)))
+        while len(self._pending) > COMPRESS_INFLIGHT:
+            self._write_oldest()
+
+    def _write_oldest(self):
+        size, level, future = self._pending.popleft()
+        data = future.result()
+        if level and len(data) >= size * COMPRESS_MIN_RATIO:
+            self._skip = COMPRESS_PROBE_INTERVAL
+        self.stream.write(data)
+        self.raw_bytes += size
+        self.sent_bytes += len(data)
+
+    def close(self):
+        """
+        写出剩余的数据（不关闭下层流）；空文件也写出一个空的 gzip 成员，远程 gzip -d 不接受空输入
+        """
+        if self._buffer or not self.raw_bytes and not self._pending:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._write_oldest()
+        self.compressor.add(self.raw_bytes, self.sent_bytes)
+
+def compressed_push(ssh, file_path, remote_path, compressor, preserve_times=False, cache=None, limiter=None, digests=None):
+    """
+    压缩推送单个文件：本地在压缩线程池中压缩，通过一个 exec 通道发送，远程 gzip -d 解压到临时文件，完成后改名
+    :param compressor: 压缩线程池（Compressor）
+    :param limiter: 限速器（BandwidthLimiter），按压缩后实际发送的字节数计算
+    :param digests: 不为 None 时把读取的本地文件（压缩前）的 SHA-256 记入其中
+    :return: 成功返回 True；远程无法运行 gzip 时返回 False，调用方应回退到 scp
+    """
+    local_stat = os.stat(file_path)
+    target, temp = shlex.quote(remote_path), shlex.quote(f"{remote_path}.compressing")
+    command = f"gzip -dc > {temp} && chmod {oct(local_stat.st_mode)[-4:]} {temp}"
+    if preserve_times:
+        command += f" && touch -c -m -d @{int(local_stat.st_mtime)} {temp}"
+    stdin, stdout, stderr = ssh.exec_command(f"{{ {command} && mv -f {temp} {target}; }} || {{ status=$?; rm -f {temp}; exit $status; }}")
+    print(f"开始压缩推送文件: {file_path} -> {remote_path}")
+    writer = compressor.writer(throttled(stdin, limiter))
+    digest = hashlib.sha256() if digests is not None else None
+    try:
+        with hashing(open_local_file(file_path, cache), digest) as f:
+            for data in iter(partial(f.read, COMPRESS_CHUNK_SIZE), b""):
+                writer.write(data)
+        writer.close()
+        stdin.channel.shutdown_write()
+    except (OSError, EOFError, paramiko.SSHException):
+        # 远程命令已经退出（例如没有 gzip）时通道已关闭，写入失败；按退出状态判断是否回退，其它情况照常抛出
+        if not (stdout.channel.exit_status_ready() and stdout.channel.recv_exit_status() == 127):
+            raise
+    stderr_output = stderr.read().decode().strip()
+    status = stdout.channel.recv_exit_status()
+    if status == 127:
+        print(f"远程无法运行 gzip，回退到 scp: {stderr_output}")
+        return False
+    if status != 0:
+        raise IOError(f"远程解压失败: {stderr_output}")
+    if digest is not None:
+        digests[file_path] = digest.hexdigest()
+    print(f"压缩推送完成: {file_path} -> {remote_path}（{format_size(writer.raw_bytes)} 压缩为 {format_size(writer.sent_bytes)}）")
+    return True
+
+TAR_BUFFER_SIZE = 1024 * 1024  # tar 流每次写入通道的字节数
+TAR_BUNDLE_MAX_FILES = 10000  # 每个打包最多包含的文件数
+
+def tar_push(bundle, remote_base_path, pool, cache=None, limiter=None, digests=None, compressor=None, skipped=None):
+    """
+    将一组小文件边读边生成 tar 流，通过一个 exec 通道推送并在远程解包，本地不落盘
+    出错时抛出异常，由工作线程决定延迟重试还是回退到逐个文件推送
+    :param bundle: [(本地文件路径, 相对 remote_base_path 的路径), ...]
+    :param cache: 多主机推送时的共享读取缓存
+    :param limiter: 限速器（BandwidthLimiter），None 表示不限速
+    :param digests: 不为 None 时把写入 tar 流的每个文件的 SHA-256 记入其中（以本地文件路径为键）
+    :param compressor: 不为 None 时 tar 流经压缩线程池压缩后发送，远程 tar -z 解压
+    :param skipped: 不为 None 时把本地不可读、没有写入 tar 流的文件路径加入其中，调用方应把它们记为失败
+    :return: 成功返回 True；远程无法运行 tar 时返回 False，调用方应回退到逐个文件推送
+    """
+    base = shlex.quote(remote_base_path)
+    with pool.connection() as ssh:
+        with pool.metrics.phase("transfer"):
+            # 与逐个文件的 scp 一致：文件属于远程用户、权限受远程 umask 限制（远程用户为 root 时 tar 默认保留打包中的属主和权限）
+            stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {base} && tar -x --no-same-owner --no-same-permissions "
+                                                     f"{'-z ' if compressor is not None else ''}-C {base} -f -")
+            sink = throttled(stdin, limiter)
+            if compressor is not None:
+                sink = compressor.writer(sink)
+            # dereference=True 与 scp 一致：推送符号链接指向的文件内容
+            sent = 0
+            with tarfile.open(fileobj=sink, mode="w|", bufsize=TAR_BUFFER_SIZE, dereference=True) as tar:
+                for local_file_path, arcname in bundle:
+                    if not os.access(local_file_path, os.R_OK):
+                        print(f"本地文件不可读: {local_file_path}")
+                        if skipped is not None:
+                            skipped.append(local_file_path)
+                        continue
+                    tarinfo = tar.gettarinfo(local_file_path, arcname=arcname)
+                    digest = hashlib.sha256() if digests is not None else None
+                    with hashing(open_local_file(local_file_path, cache), digest) as f:
+                        tar.addfile(tarinfo, f)
+                    sent += 1
+                    if digest is not None:
+                        digests[local_file_path] = digest.hexdigest()
+            if compressor is not None:
+                sink.close()
+            stdin.channel.shutdown_write()
+        with pool.metrics.phase("close"):
+            stderr_output = stderr.read().decode().strip()
+            status = stdout.channel.recv_exit_status()
+        if status == 127:
+            print(f"远程无法运行 tar，回退到逐个文件推送: {stderr_output}")
+            return False
+        if status != 0:
+            raise IOError(f"远程 tar 解包失败: {stderr_output}")
+    print(f"打包推送完成: {sent} 个文件 -> {remote_base_path}")
+    return True
+
+class TransferJournal:
+    """
+    任务日志：以 JSON Lines 追加记录已完成的文件和大文件已完成的分块
+    任务中断后重新运行同一任务时只处理未完成的部分；任务全部成功后删除日志
+    记录以目标路径为键，并带上源文件的大小和修改时间，源文件变化后旧记录自动失效
+    """
+    def __init__(self, path, on_done=None):
+        """
+        :param on_done: 每个文件记为完成时调用 on_done(目标路径, 大小, 修改时间, SHA-256)，用于写入传输状态库
+        """
+        self.path = path
+        self.on_done = on_done
+        self._lock = Lock()
+        self._done = {}  # {目标路径: (大小, 修改时间)}
+        self._pieces = {}  # {目标路径: ((大小, 修改时间), {已完成分块的偏移})}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 上次中断时可能留下不完整的最后一行
+                    self._apply(record)
+            if self._done or self._pieces:
+                print(f"发现未完成的任务日志 {path}：已完成 {len(self._done)} 个文件，{len(self._pieces)} 个文件有已完成的分块")
+        self._file = None  # 第一次写入时才创建日志文件
+
+    def _apply(self, record):
+        key, signature = record["key"], (record["size"], record["mtime"])
+        if "piece" in record:
+            stored_signature, offsets = self._pieces.get(key, (signature, set()))
+            if stored_signature != signature:
+                offsets = set()
+            offsets.add(record["piece"])
+            self._pieces[key] = (signature, offsets)
+        else:
+            self._done[key] = signature
+            self._pieces.pop(key, None)
+
+    def _append(self, record):
+        with self._lock:
+            self._apply(record)
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def is_done(self, key, size, mtime):
+        return self._done.get(key) == (size, int(mtime))
+
+    def mark_done(self, key, size, mtime, digest=None):
+        self._append({"key": key, "size": size, "mtime": int(mtime)})
+        if self.on_done is not None:
+            self.on_done(key, size, mtime, digest)
+
+    def pieces(self, key, size, mtime):
+        """
+        返回该文件已完成分块的偏移集合（源文件变化后返回空集合）
+        """
+        with self._lock:
+            signature, offsets = self._pieces.get(key, (None, set()))
+            return set(offsets) if signature == (size, int(mtime)) else set()
+
+    def mark_piece(self, key, size, mtime, offset):
+        self._append({"key": key, "size": size, "mtime": int(mtime), "piece": offset})
+
+    def close(self, remove=False):
+        if self._file is not None:
+            self._file.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+STATE_PATH = ".transfer_state.db"  # 默认的传输状态库，推送和拉取共用
+STATE_BATCH_SIZE = 1000  # 状态库每积累这么多条记录提交一次（一个事务）
+STATE_FLUSH_INTERVAL = 5  # 不足一批时最多间隔这么多秒提交一次
+
+class TransferState:
+    """
+    本地传输状态库（SQLite）：跨任务、跨运行记录每台主机上已完成的文件，
+    以 (方向, 主机, 目标路径) 为主键，保存源文件的大小、修改时间和 SHA-256（校验过时）
+    重新运行时据此在本地判断跳过，不必再向远程询问；与远程的完整核对按核对间隔周期进行
+    记录先进入内存缓冲，按批在一个事务中提交，不拖慢传输；按主键查找，百万条记录时仍然很快
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._buffer = []
+        self._flushed = time.time()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS files (direction TEXT, host TEXT, path TEXT, size INTEGER, mtime INTEGER, sha256 TEXT, "
+                         "updated REAL, PRIMARY KEY (direction, host, path)) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS reconciled (direction TEXT, host TEXT, base TEXT, at REAL, "
+                         "PRIMARY KEY (direction, host, base)) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS profiles (host TEXT PRIMARY KEY, profile TEXT, at REAL) WITHOUT ROWID")
+
+    def get(self, direction, host, path):
+        """
+        :return: (大小, 修改时间, SHA-256 或 None)，没有记录时返回 None
+        """
+        with self._lock:
+            return self._db.execute("SELECT size, mtime, sha256 FROM files WHERE direction = ? AND host = ? AND path = ?",
+                                    (direction, host, path)).fetchone()
+
+    def record(self, direction, host, path, size, mtime, digest=None):
+        """
+        记录一个已完成（或已确认与源文件一致）的文件，缓冲满或距上次提交超过 STATE_FLUSH_INTERVAL 秒时提交
+        """
+        with self._lock:
+            self._buffer.append((direction, host, path, size, int(mtime), digest, time.time()))
+            if len(self._buffer) >= STATE_BATCH_SIZE or time.time() - self._flushed >= STATE_FLUSH_INTERVAL:
+                self._flush()
+
+    def _flush(self):
+        # 调用方持有 self._lock
+        if self._buffer:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", self._buffer)
+            self._buffer = []
+        self._flushed = time.time()
+
+    def _under(self, base):
+        # base 目录下所有路径的范围（"0" 是 "/" 之后的字符），走主键索引而不是 LIKE 全表扫描
+        base = os.path.normpath(base).rstrip("/")
+        return base + "/", base + "0"
+
+    def files_under(self, direction, host, base):
+        """
+        :return: {目标路径: (大小, 修改时间)}，base 目录下的所有记录
+        """
+        with self._lock:
+            self._flush()
+            rows = self._db.execute("SELECT path, size, mtime FROM files WHERE direction = ? AND host = ? AND path >= ? AND path < ?",
+                                    (direction, host, *self._under(base)))
+            return {path: (size, mtime) for path, size, mtime in rows}
+
+    def last_reconciled(self, direction, host, base):
+        """
+        :return: 上一次与远程完整核对的时间，从未核对过时返回 None
+        """
+        with self._lock:
+            row = self._db.execute("SELECT at FROM reconciled WHERE direction = ? AND host = ? AND base = ?",
+                                   (direction, host, os.path.normpath(base))).fetchone()
+            return row[0] if row else None
+
+    def reconcile(self, direction, host, base, actual):
+        """
+        与目标端的实际文件核对：删除 base 目录下目标端已不存在或大小不同的记录，并记下核对时间
+        :param actual: {目标路径: (大小, 修改时间)}
+        :return: 删除的记录数
+        """
+        with self._lock:
+            self._flush()
+            rows = self._db.execute("SELECT path, size FROM files WHERE direction = ? AND host = ? AND path >= ? AND path < ?",
+                                    (direction, host, *self._under(base))).fetchall()
+            stale = [(direction, host, path) for path, size in rows if actual.get(path, (None,))[0] != size]
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany("DELETE FROM files WHERE direction = ? AND host = ? AND path = ?", stale)
+                self._db.execute("INSERT OR REPLACE INTO reconciled VALUES (?, ?, ?, ?)", (direction, host, os.path.normpath(base), time.time()))
+            return len(stale)
+
+    def cached_profile(self, host):
+        """
+        :return: (auto 模式为该主机选定的传输参数预设, 选定的时间)，没有记录时返回 None
+        """
+        with self._lock:
+            return self._db.execute("SELECT profile, at FROM profiles WHERE host = ?", (host,)).fetchone()
+
+    def record_profile(self, host, profile):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)", (host, profile, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._db.close()
+
+VERIFY_BATCH_SIZE = 256  # 每批远程校验的文件数上限
+VERIFY_BATCH_BYTES = 1024 * 1024 * 1024  # 每批远程校验的字节数上限，远程需要把这些数据读一遍
+VERIFY_BATCH_WAIT = 2  # 不足一批时最多等待这么多秒就开始校验
+VERIFY_RETRIES = 2  # 校验不一致时最多重新传输的次数
+
+class ChecksumManifest:
+    """
+    校验清单：每个文件校验后追加一行 JSON（主机、路径、大小、本地和远程的 SHA-256、结果），多台主机共用
+    结果为 ok（一致）、retry（不一致，已重新传输）、mismatch（重传次数用尽仍不一致）或 unverified（远程无法计算校验和）
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = Lock()
+        self._file = open(path, "a", encoding="utf-8") if path else None
+
+    def record(self, **fields):
+        if self._file is None:
+            return
+        line = json.dumps(dict(time=round(time.time(), 3), **fields), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+class TransferVerifier:
+    """
+    传输校验：工作线程把边传输边计算的本地 SHA-256 交给它，后台线程攒够一批（或等待 VERIFY_BATCH_WAIT 秒）后
+    通过一条 sha256sum 命令在远程批量计算并比较，不逐个文件执行命令，也不占用工作线程
+    一致的文件才记入任务日志；不一致的重新放回调度窗口，超过 VERIFY_RETRIES 次仍不一致的记为失败
     """
-    使用 SCP 传输文件到远程服务器，支持重试
+    def __init__(self, pool, file_queue, journal=None, failures=None, manifest=None, label=""):
+        self.pool = pool
+        self.file_queue = file_queue
+        self.journal = journal
+        self.failures = failures
+        self.manifest = manifest or ChecksumManifest()
+        self.label = label
+        self.available = True  # 远程能否运行 sha256sum
+        self.stats = {"ok": 0, "retry": 0, "mismatch": 0, "unverified": 0}
+        self._pending = []  # [(远程路径, 本地路径, 大小, 本地摘要, 重传任务, 日志记录)]
+        self._pending_bytes = 0
+        self._outstanding = 0  # 已提交但还没有得出结果的文件数
+        self._requeued = 0  # 上次 drain() 之后重新放回调度窗口的文件数
+        self._attempts = {}  # {远程路径: 已重传次数}
+        self._retrying = set()
+        self._flush = False
+        self._closed = False
+        self._cond = Condition()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, remote_path, local_path, size, digest, retry, done):
+        """
+        :param retry: 不一致时重新放入调度窗口的 (任务, 大小, 分组)
+        :param done: 一致时记入任务日志的 (键, 大小, 修改时间)
+        """
+        with self._cond:
+            self._pending.append((remote_path, local_path, size, digest, retry, done))
+            self._pending_bytes += size
+            self._outstanding += 1
+            if self._batch_full():
+                self._cond.notify_all()
+
+    def retrying(self, remote_path):
+        """
+        该文件是否因校验不一致正在重新传输（重传时不能因为远程文件已存在而跳过）
+        """
+        with self._cond:
+            return remote_path in self._retrying
+
+    def _batch_full(self):
+        return len(self._pending) >= VERIFY_BATCH_SIZE or self._pending_bytes >= VERIFY_BATCH_BYTES
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._pending and (self._flush or self._batch_full()), timeout=VERIFY_BATCH_WAIT)
+                if self._closed and not self._pending:
+                    return
+                batch, self._pending, self._pending_bytes = self._pending, [], 0
+            if not batch:
+                continue
+            try:
+                self._verify(batch)
+            except Exception as e:
+                print(f"{self.label}传输校验出错: {e}")
+            finally:
+                with self._cond:
+                    self._outstanding -= len(batch)
+                    self._cond.notify_all()
+
+    def _verify(self, batch):
+        sums = {}
+        if self.available:
+            try:
+                with self.pool.connection() as ssh:
+                    sums = remote_sha256sums(ssh, [remote_path for remote_path, *_ in batch])
+                    if not sums:
+                        stdin, stdout, stderr = ssh.exec_command("sha256sum --version")
+                        if stdout.channel.recv_exit_status() != 0:
+                            print(f"{self.label}远程无法运行 sha256sum，跳过传输校验")
+                            self.available = False
+            except Exception as e:
+                print(f"{self.label}远程校验失败，本批 {len(batch)} 个文件未校验: {e}")
+                sums = None
+        results = []
+        for remote_path, local_path, size, digest, retry, done in batch:
+            attempt = self._attempts.get(remote_path, 0)
+            remote_digest = sums.get(remote_path) if sums is not None else None
+            if not self.available or sums is None:
+                result = "unverified"
+            elif remote_digest == digest:
+                result = "ok"
+            elif attempt < VERIFY_RETRIES:
+                result = "retry"
+                print(f"{self.label}校验不一致，重新推送: {local_path} -> {remote_path}")
+            else:
+                result = "mismatch"
+                print(f"{self.label}重传 {attempt} 次后校验仍不一致，放弃: {local_path} -> {remote_path}")
+            self.manifest.record(host=self.pool.host_label, path=remote_path, local=local_path, size=size, sha256=digest,
+                                 remote_sha256=remote_digest, result=result, attempt=attempt + 1)
+            results.append((result, remote_path, local_path, digest, retry, done))
+        with self._cond:
+            for result, remote_path, local_path, digest, retry, done in results:
+                self.stats[result] += 1
+                self._retrying.discard(remote_path)
+                if result in ("ok", "unverified"):
+                    if self.journal:
+                        self.journal.mark_done(*done, digest=digest)
+                elif result == "retry":
+                    self._attempts[remote_path] = self._attempts.get(remote_path, 0) + 1
+                    self._retrying.add(remote_path)
+                    self._requeued += 1
+                    item, size, group = retry
+                    self.file_queue.put(item, size, group, block=False)
+                elif self.failures is not None:
+                    self.failures.append(local_path)
+
+    def drain(self):
+        """
+        立即校验所有已提交的文件并等待结果
+        :return: 这期间重新放回调度窗口的文件数，不为 0 时调用方应再次等待调度窗口清空
+        """
+        with self._cond:
+            self._flush = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._outstanding == 0)
+            self._flush = False
+            requeued, self._requeued = self._requeued, 0
+        return requeued
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def report(self):
+        stats = self.stats
+        if not any(stats.values()):
+            return
+        print(f"{self.label}传输校验: {stats['ok']} 个文件一致，重新推送 {stats['retry']} 次，{stats['mismatch']} 个文件校验失败"
+              + (f"，{stats['unverified']} 个文件未能校验" if stats["unverified"] else ""))
+
+RESUME_VERIFY_SIZE = 1024 * 1024  # 断点续传时校验已传输部分末尾的字节数
+
+def local_range_sha256(file_path, offset, length):
+    """
+    计算本地文件某个字节范围的 SHA-256
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        digest.update(f.read(length))
+    return digest.hexdigest()
+
+def remote_range_sha256(ssh, remote_path, offset, length):
     """
-    for attempt in range(retries):
+    在远程计算文件某个字节范围的 SHA-256（tail -c +N 会直接定位，不读取前面的数据）
+    """
+    path = shlex.quote(remote_path)
+    stdin, stdout, stderr = ssh.exec_command(f"tail -c +{offset + 1} {path} | head -c {length} | sha256sum")
+    return stdout.read().decode().split(" ")[0]
+
+def sftp_replace(sftp, temp_path, remote_path):
+    """
+    将远程临时文件原子地重命名为目标文件
+    """
+    try:
+        sftp.posix_rename(temp_path, remote_path)
+    except IOError:
+        # 服务器不支持 posix-rename 扩展时，普通 rename 不能覆盖已存在的文件
         try:
-            # 检查本地文件是否存在
-            if not os.path.exists(file_path):
-                print(f"本地文件不存在: {file_path}")
+            sftp.remove(remote_path)
+        except IOError:
+            pass
+        sftp.rename(temp_path, remote_path)
+
+def resumable_push(file_path, remote_path, pool, preserve_times=False, cache=None, limiter=None, digests=None):
+    """
+    可续传推送：数据先写入远程 .part 临时文件，重试或重新运行时从其当前长度继续，
+    续传前比较已传输部分末尾一段数据的校验和，不一致则从头开始；完成后原子重命名
+    :param digests: 不为 None 时把整个文件的 SHA-256 记入其中（续传时已传输的部分从本地文件补算）
+    """
+    size = os.path.getsize(file_path)
+    temp_path = f"{remote_path}.part"
+    metrics = pool.metrics
+    with pool.connection() as ssh, ssh.open_sftp() as sftp:
+        with metrics.phase("check"):
+            try:
+                offset = sftp.stat(temp_path).st_size
+            except IOError:
+                offset = 0
+            if offset > size:
+                offset = 0
+            if offset:
+                verify_start = max(0, offset - RESUME_VERIFY_SIZE)
+                if remote_range_sha256(ssh, temp_path, verify_start, offset - verify_start) == local_range_sha256(file_path, verify_start, offset - verify_start):
+                    print(f"断点续传: {file_path} -> {remote_path}，从 {format_size(offset)} 处继续")
+                else:
+                    print(f"已传输部分校验不一致，从头开始推送: {file_path} -> {remote_path}")
+                    offset = 0
+            else:
+                print(f"开始推送文件: {file_path} -> {remote_path}")
+
+        with metrics.phase("transfer"):
+            digest = hashlib.sha256() if digests is not None else None
+            if digest is not None and offset:
+                digest_file_range(digest, file_path, 0, offset)
+            with sftp.open(temp_path, "r+" if offset else "w") as remote_file, \
+                    hashing(throttled(open_local_file(file_path, cache), limiter), digest) as local_file:
+                remote_file.set_pipelined(pool.profile["sftp_pipelined"])  # 流水线时不逐个等待写入确认
+                remote_file.seek(offset)
+                local_file.seek(offset)
+                for data in iter(lambda: local_file.read(CHUNK_IO_SIZE), b""):
+                    remote_file.write(data)
+
+        with metrics.phase("close"):
+            if preserve_times:
+                mtime = os.stat(file_path).st_mtime
+                sftp.utime(temp_path, (mtime, mtime))
+            sftp_replace(sftp, temp_path, remote_path)
+    if digest is not None:
+        digests[file_path] = digest.hexdigest()
+    print(f"文件推送完成: {file_path} -> {remote_path}")
+
+CHUNK_PIECE_SIZE = 64 * 1024 * 1024  # 分块传输时每个任务领取的字节范围
+CHUNK_IO_SIZE = 1024 * 1024  # 分块传输时每次读写的字节数
+CHUNK_HASH_BUFFER = 256 * 1024 * 1024  # 分块传输计算校验和时最多暂存的乱序数据字节数，超过时从文件读取
+
+def digest_file_range(digest, file_path, offset, length):
+    """
+    把本地文件 [offset, offset + length) 范围的数据计入摘要，每次读取 CHUNK_IO_SIZE 字节
+    """
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        while length:
+            data = f.read(min(CHUNK_IO_SIZE, length))
+            if not data:
+                raise EOFError(f"本地文件在计算校验和时被截断: {file_path}")
+            digest.update(data)
+            length -= len(data)
+
+class PieceHasher:
+    """
+    分块传输时计算整个文件的 SHA-256：摘要必须按偏移顺序计算，而各通道乱序传输分块
+    通道把读出的数据交给 feed()，后台线程按偏移顺序计入摘要；还没轮到的分块暂存在内存中，不必传输后再读一遍本地文件
+    暂存超过 buffer_limit 字节时新到的分块不再暂存，轮到它时从本地文件读取；断点续传跳过的分块同样从本地文件读取
+    hashlib 计算大块数据时释放 GIL，不会拖慢传输线程
+    """
+    def __init__(self, file_path, size, piece_size, done=(), buffer_limit=CHUNK_HASH_BUFFER):
+        self.file_path = file_path
+        self.size = size
+        self.piece_size = piece_size
+        self.buffer_limit = buffer_limit
+        self._digest = hashlib.sha256()
+        self._complete = set(done)
+        self._from_file = set(done)  # 完成后从文件读取的分块
+        self._chunks = {}  # {分块偏移: deque([数据, ...])}，已读出、还没计入摘要的数据
+        self._buffered = 0
+        self._head = 0  # 正在计入摘要的分块偏移
+        self._aborted = False
+        self._error = None
+        self._cond = Condition()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def feed(self, offset, data):
+        """
+        交给分块 offset 紧接着上一次读出的数据（每个分块由一个通道从头到尾顺序读出）
+        """
+        with self._cond:
+            if self._aborted or offset in self._from_file:
                 return
-            if not os.access(file_path, os.R_OK):
-                print(f"本地文件不可读: {file_path}")
+            if offset != self._head and self._buffered + len(data) > self.buffer_limit:
+                self._from_file.add(offset)
+                self._buffered -= sum(len(chunk) for chunk in self._chunks.pop(offset, ()))
                 return
+            self._chunks.setdefault(offset, deque()).append(data)
+            self._buffered += len(data)
+            self._cond.notify_all()
+
+    def from_file(self, offset):
+        """
+        分块 offset 是否在完成后从文件读取；在这个分块的 feed() 全部调用之后才确定
+        """
+        with self._cond:
+            return offset in self._from_file
+
+    def complete(self, offset):
+        with self._cond:
+            self._complete.add(offset)
+            self._cond.notify_all()
+
+    def abort(self):
+        with self._cond:
+            self._aborted = True
+            self._chunks.clear()
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            for offset in range(0, self.size, self.piece_size):
+                while True:
+                    with self._cond:
+                        self._head = offset
+                        self._cond.wait_for(lambda: self._aborted or offset in self._complete or self._chunks.get(offset))
+                        if self._aborted:
+                            return
+                        # 分块完成前的 feed() 都已放入 _chunks，取走后若已完成即可计算下一个分块
+                        chunks = self._chunks.pop(offset, ())
+                        self._buffered -= sum(len(chunk) for chunk in chunks)
+                        finished = offset in self._complete
+                        from_file = offset in self._from_file
+                    if from_file:
+                        digest_file_range(self._digest, self.file_path, offset, min(self.piece_size, self.size - offset))
+                        break
+                    for chunk in chunks:
+                        self._digest.update(chunk)
+                    if finished:
+                        break
+        except Exception as e:
+            self._error = e
+
+    def hexdigest(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._digest.hexdigest()
+
+def chunked_push(file_path, remote_path, pool, streams, preserve_times=False, journal=None, cache=None, limiter=None, digests=None):
+    """
+    分块并发推送大文件：按字节范围切分，多个连接各自打开 SFTP 句柄按偏移写入同一个远程临时文件，
+    全部完成后原子重命名为目标文件
+    :param streams: 并发通道数，每个通道从连接池获取一个连接
+    :param journal: 任务日志，记录已完成的分块，重试或重新运行时跳过这些分块
+    :param cache: 多主机推送时的共享读取缓存
+    :param limiter: 限速器，每个通道使用它的一个副本（fork）
+    :param digests: 不为 None 时把整个文件的 SHA-256 记入其中，由 PieceHasher 用发送的数据计算
+    """
+    local_stat = os.stat(file_path)
+    size = local_stat.st_size
+    temp_path = f"{remote_path}.part"
+    done = journal.pieces(remote_path, size, local_stat.st_mtime) if journal else set()
+    with pool.connection() as ssh, ssh.open_sftp() as sftp, pool.metrics.phase("check"):
+        if done:
+            try:
+                if sftp.stat(temp_path).st_size != size:
+                    done = set()
+            except IOError:
+                done = set()
+        if done:
+            print(f"断点续传: {file_path} -> {remote_path}，跳过已完成的 {len(done)} 个分块")
+        else:
+            with sftp.open(temp_path, "w") as remote_file:
+                remote_file.truncate(size)
 
-            # 创建 SSH 客户端
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            print(f"正在连接远程服务器 {remote_host}:{remote_port}...")
-            ssh.connect(remote_host, port=remote_port, username=remote_user, password=remote_password, timeout=6000)  # 设置超时时间
-            print(f"成功连接到远程服务器 {remote_host}:{remote_port}！")
+    pending = Queue()
+    for offset in range(0, size, CHUNK_PIECE_SIZE):
+        if offset not in done:
+            pending.put((offset, min(CHUNK_PIECE_SIZE, size - offset)))
 
+    def stream():
+        stream_limiter = limiter.fork() if limiter is not None else None
+        with pool.connection() as ssh, ssh.open_sftp() as sftp, throttled(open_local_file(file_path, cache), stream_limiter) as local_file:
+            while True:
+                try:
+                    offset, length = pending.get_nowait()
+                except Empty:
+                    return
+                # 每个分块单独打开句柄：关闭是同步请求，返回时之前流水线发出的写入都已被服务端处理
+                with sftp.open(temp_path, "r+") as remote_file:
+                    remote_file.set_pipelined(pool.profile["sftp_pipelined"])  # 流水线时不逐个等待写入确认
+                    remote_file.seek(offset)
+                    local_file.seek(offset)
+                    while length:
+                        data = local_file.read(min(CHUNK_IO_SIZE, length))
+                        if not data:
+                            raise EOFError(f"本地文件在传输过程中被截断: {file_path}")
+                        remote_file.write(data)
+                        if hasher is not None:
+                            hasher.feed(offset, data)
+                        length -= len(data)
+                if journal:
+                    journal.mark_piece(remote_path, size, local_stat.st_mtime, offset)
+                if hasher is not None:
+                    hasher.complete(offset)
+
+    print(f"开始分块推送文件: {file_path} -> {remote_path}（{format_size(size)}，{streams} 路并发）")
+    started = time.time()
+    hasher = PieceHasher(file_path, size, CHUNK_PIECE_SIZE, done) if digests is not None else None
+    try:
+        with pool.metrics.phase("transfer"), ThreadPoolExecutor(max_workers=streams) as executor:
+            for future in [executor.submit(stream) for _ in range(min(streams, pending.qsize()))]:
+                future.result()
+    except Exception:
+        if hasher is not None:
+            hasher.abort()
+        raise
+    if hasher is not None:
+        digests[file_path] = hasher.hexdigest()
+
+    with pool.connection() as ssh, ssh.open_sftp() as sftp, pool.metrics.phase("close"):
+        if preserve_times:
+            sftp.utime(temp_path, (local_stat.st_mtime, local_stat.st_mtime))
+        sftp_replace(sftp, temp_path, remote_path)
+    elapsed = max(time.time() - started, 1e-6)
+    print(f"分块推送完成: {file_path} -> {remote_path}，耗时 {elapsed:.1f} 秒，总吞吐 {format_size(size / elapsed)}/s")
+
+def scp_transfer(file_path, remote_path, pool, check_remote=True, skip_existing=True, preserve_times=False, method="scp",
+                 chunk_streams=4, journal=None, cache=None, limiter=None, digests=None, compressor=None):
+    """
+    使用 SCP 传输文件到远程服务器
+    连接从连接池中获取，传输结束后归还以供复用；出错时抛出异常，由工作线程按错误类型决定是否延迟重试
+    :param check_remote: 是否逐个文件检查远程文件和目录；已通过远程索引判断过时为 False
+    :param skip_existing: 逐个文件检查时，远程文件已存在是否跳过
+    :param preserve_times: 是否在远程保留本地文件的修改时间（增量同步依赖它）
+    :param method: scp（完整传输）、delta（远程已有旧版本，尝试只传输变化的块）、chunked（大文件分块并发传输）、
+                   compressed（本地压缩、远程解压）或 resumable（写入 .part 临时文件，可断点续传）
+    :param chunk_streams: chunked 方式的并发通道数
+    :param journal: 任务日志，chunked 方式用它记录已完成的分块
+    :param cache: 多主机推送时的共享读取缓存，本地文件只从磁盘读取一次
+    :param limiter: 限速器（BandwidthLimiter），None 表示不限速
+    :param digests: 不为 None 时把传输过程中计算的本地文件 SHA-256 记入其中；按规则跳过的文件不记录
+    :param compressor: compressed 方式使用的压缩线程池，None 时 compressed 方式改用 scp
+    :return: 传输成功或按规则跳过时返回 True，放弃时返回 False
+    """
+    # 检查本地文件是否存在
+    if not os.path.exists(file_path):
+        print(f"本地文件不存在: {file_path}")
+        return False
+    if not os.access(file_path, os.R_OK):
+        print(f"本地文件不可读: {file_path}")
+        return False
+
+    if method == "chunked":
+        chunked_push(file_path, remote_path, pool, chunk_streams, preserve_times=preserve_times, journal=journal, cache=cache,
+                     limiter=limiter, digests=digests)
+        return True
+    if method == "resumable":
+        resumable_push(file_path, remote_path, pool, preserve_times=preserve_times, cache=cache, limiter=limiter, digests=digests)
+        return True
+
+    metrics = pool.metrics
+    with pool.connection() as ssh:
+        if check_remote:
             # 检查远程文件是否存在
-            if remote_file_exists(ssh, remote_path):
+            with metrics.phase("check"):
+                exists = skip_existing and remote_file_exists(ssh, remote_path)
+            if exists:
                 print(f"文件已存在，跳过推送: {file_path} -> {remote_path}")
-                ssh.close()
-                return
+                return True
 
             # 确保远程目录存在
             remote_dir = os.path.dirname(remote_path)
-            if not remote_mkdir(ssh, remote_dir):
+            with metrics.phase("mkdir"):
+                created = remote_mkdir(ssh, remote_dir)
+            if not created:
                 print(f"无法创建远程目录: {remote_dir}")
-                ssh.close()
-                return
+                return False
 
-            # 创建 SCP 客户端
-            print(f"开始推送文件: {file_path} -> {remote_path}")
-            with SCPClient(ssh.get_transport(), socket_timeout=6000) as scp:  # 设置 socket 超时时间
-                scp.put(file_path, remote_path)
-                print(f"文件推送完成: {file_path} -> {remote_path}")
+        if method == "delta":
+            with metrics.phase("transfer"):
+                if delta_push(ssh, file_path, remote_path, limiter=limiter, digests=digests):
+                    return True
 
-            ssh.close()
-            return  # 传输成功，退出函数
-        except Exception as e:
-            print(f"推送文件失败 (尝试 {attempt + 1}/{retries}): {file_path} -> {remote_path}")
-            print(f"错误详情: {e}")
-            print("堆栈跟踪:")
-            traceback.print_exc()
-            if attempt < retries - 1:
-                print(f"等待 5 秒后重试...")
-                time.sleep(5)  # 等待 5 秒后重试
-            else:
-                print(f"重试次数已达上限，放弃推送: {file_path} -> {remote_path}")
+        if method == "compressed" and compressor is not None:
+            with metrics.phase("transfer"):
+                if compressed_push(ssh, file_path, remote_path, compressor, preserve_times=preserve_times, cache=cache, limiter=limiter,
+                                   digests=digests):
+                    return True
 
-def worker(file_queue, remote_base_path, remote_host, remote_port, remote_user, remote_password, stop_event):
+        # 创建 SCP 客户端（在已有连接上打开新通道）
+        print(f"开始推送文件: {file_path} -> {remote_path}")
+        progress = limiter.scp_progress() if limiter is not None else None
+        scp = SCPClient(ssh.get_transport(), buff_size=pool.profile["scp_buffer"], socket_timeout=SOCKET_TIMEOUT, progress=progress)
+        # 自己打开文件交给 scp.putfo（而不是 scp.put）：校验和在发送的同一次读取中计算，多主机推送时从共享缓存读取
+        digest = hashlib.sha256() if digests is not None else None
+        local_stat = os.stat(file_path)
+        try:
+            with metrics.phase("transfer"):
+                with hashing(open_local_file(file_path, cache), digest) as f:
+                    scp.putfo(f, remote_path, mode=oct(local_stat.st_mode)[-4:], size=local_stat.st_size)
+        finally:
+            with metrics.phase("close"):
+                scp.close()
+        if preserve_times:
+            with metrics.phase("close"):
+                remote_set_mtime(ssh, remote_path, local_stat.st_mtime)
+        if digest is not None:
+            digests[file_path] = digest.hexdigest()
+        print(f"文件推送完成: {file_path} -> {remote_path}")
+
+    return True
+
+def worker(file_queue, remote_base_path, pool, stop_event, check_remote=True, sync_mode="skip", chunk_streams=4, journal=None, failures=None,
+           cache=None, limiter=None, verifier=None, compressor=None, index=0, controller=None):
     """
     工作线程：从队列中获取文件并推送
+    成功的文件记入任务日志，放弃的文件记入 failures，每个文件或打包的耗时和结果记入连接池的传输指标
+    可重试的错误不在线程内等待：任务通过 file_queue.retry() 延迟放回，线程直接处理下一个任务
+    limiter 不为 None 时，每个线程使用它的一个副本（fork），每个文件或打包单独计算单文件限速
+    verifier 不为 None 时，传输中计算的 SHA-256 交给它批量校验，校验一致后才记入任务日志
+    compressor 不为 None 时打包压缩后推送，compressed 方式的文件用它压缩
+    controller 不为 None 时，编号 index 不小于它当前允许的并发数的线程暂停取任务
     """
+    if limiter is not None:
+        limiter = limiter.fork()
+    metrics = pool.metrics
+
+    def file_size(file_path):
+        try:
+            return os.path.getsize(file_path)
+        except OSError:
+            return 0
+
+    def finished(file_path, remote_path, method, digests):
+        if not journal and verifier is None:
+            return
+        local_stat = os.stat(file_path)
+        done = (os.path.normpath(remote_path), local_stat.st_size, local_stat.st_mtime)
+        if verifier is not None and digests.get(file_path) is not None:
+            # 重传时分块和可续传方式保持不变，其它方式（包括打包和增量）都完整推送单个文件
+            retry = ((file_path, remote_path, method if method in ("chunked", "resumable") else "scp"), local_stat.st_size,
+                     os.path.dirname(remote_path))
+            verifier.add(remote_path, file_path, local_stat.st_size, digests[file_path], retry, done)
+        elif journal:
+            journal.mark_done(*done)
+
+    def retry_later(item, size, group, key, error):
+        # 可重试的错误延迟放回调度窗口；不可重试或次数已用完时返回 False
+        retryable = is_retryable(error)
+        unavailable = isinstance(error, HostUnavailableError)
+        delay = file_queue.retry(item, size, group, key, error.retry_after if unavailable else None, count=not unavailable) if retryable else None
+        metrics.record_error(error, retrying=delay is not None and not unavailable)
+        if delay is not None:
+            if not unavailable:  # 熔断期间的等待由熔断器统一输出
+                print(f"推送失败，{delay:.1f} 秒后重试: {key}，错误: {error}")
+        elif retryable:
+            print(f"重试次数已达上限，放弃推送: {key}，错误: {error}")
+        else:
+            print(f"不可重试的错误，放弃推送: {key}，错误: {error}")
+        return delay is not None
+
     while not stop_event.is_set():
+        if controller is not None and not controller.admit(index, stop_event):
+            break
         try:
             # 从队列中获取任务，设置超时时间
-            local_file_path, remote_file_path = file_queue.get(timeout=5)  # 设置超时时间
+            # 打包任务的 local_file_path 是 [(本地文件路径, 相对路径), ...]，remote_file_path 是远程目标路径
+            local_file_path, remote_file_path, method = file_queue.get(timeout=5)  # 设置超时时间
             try:
-                scp_transfer(local_file_path, remote_file_path, remote_host, remote_port, remote_user, remote_password)
+                digests = {} if verifier is not None else None
+                if method == "bundle":
+                    files = [(path, os.path.join(remote_file_path, arcname)) for path, arcname in local_file_path]
+                    bundle_size = sum(file_size(path) for path, _ in files)
+                    metrics.start_file(pool.host_label, remote_file_path, bundle_size, files=len(files))
+                    skipped = []
+                    try:
+                        ok = tar_push(local_file_path, remote_file_path, pool, cache=cache,
+                                      limiter=limiter.start_file() if limiter is not None else None, digests=digests, compressor=compressor,
+                                      skipped=skipped)
+                    except Exception as e:
+                        if retry_later((local_file_path, remote_file_path, method), bundle_size, remote_file_path, remote_file_path, e):
+                            metrics.finish_file(False, e, retrying=True)
+                            continue
+                        ok = False
+                    if ok:
+                        metrics.finish_file(True, failed=len(skipped))
+                        for file_path, remote_path in files:
+                            if file_path not in skipped:
+                                finished(file_path, os.path.normpath(remote_path), method, digests)
+                            elif failures is not None:
+                                failures.append(file_path)  # 与逐个文件推送一致：不可读的文件记为失败，不记入任务日志
+                        continue
+                    method = "scp"  # 回退到逐个文件推送，打包的记录被逐个文件的记录取代
+                else:
+                    files = [(local_file_path, remote_file_path)]
+                for file_path, remote_path in files:
+                    metrics.start_file(pool.host_label, file_path, file_size(file_path))
+                    retrying = verifier is not None and verifier.retrying(remote_path)
+                    try:
+                        ok = scp_transfer(file_path, remote_path, pool, check_remote=check_remote,
+                                          skip_existing=sync_mode == "skip" and not retrying, preserve_times=sync_mode != "skip", method=method,
+                                          chunk_streams=chunk_streams, journal=journal, cache=cache,
+                                          limiter=limiter.start_file() if limiter is not None else None, digests=digests,
+                                          compressor=compressor)
+                    except Exception as e:
+                        if retry_later((file_path, remote_path, method), file_size(file_path), os.path.dirname(remote_path), file_path, e):
+                            metrics.finish_file(False, e, retrying=True)
+                            continue
+                        metrics.finish_file(False, e)
+                        ok = None
+                    else:
+                        metrics.finish_file(ok)
+                    if ok:
+                        finished(file_path, remote_path, method, digests)
+                    elif failures is not None:
+                        failures.append(file_path)
             except Exception as e:
+                metrics.finish_file(False, e)
                 print(f"推送文件失败: {local_file_path} -> {remote_file_path}, 错误: {e}")
+                if failures is not None:
+                    if isinstance(local_file_path, list):  # 打包任务
+                        failures.extend(path for path, _ in local_file_path)
+                    else:
+                        failures.append(local_file_path)
             finally:
                 file_queue.task_done()  # 确保任务完成
+        except Empty:
+            continue  # 枚举线程可能还在产生任务，直到收到退出通知
         except Exception as e:
-            if not file_queue.empty():
-                print(f"工作线程错误: {e}")
+            print(f"工作线程错误: {e}")
             break  # 退出线程
 
-def push_files(local_path, pattern, remote_host, remote_port, remote_user, remote_password, remote_base_path, threads):
+SCHEDULE_POLICIES = ("fifo", "largest", "interleave", "locality")
+SCHEDULE_DEFAULT_RATE = 10 * 1024 * 1024  # 还没有完成的任务可供估算时，假定每个工作线程的吞吐（字节/秒）
+SCHEDULE_DEFAULT_OVERHEAD = 0.05  # 同上，假定每个任务的固定开销（秒）
+SCHEDULE_MIN_SAMPLE_BYTES = 16 * 1024 * 1024  # 已完成的字节数少于此值时不根据样本估算吞吐
+
+class TransferScheduler:
+    """
+    传输调度器：位于枚举线程和工作线程之间，代替普通队列
+    枚举线程放入的任务先进入一个有界的前瞻窗口，工作线程取任务时按调度策略从窗口中挑选：
+      fifo        按枚举顺序
+      largest     最大的任务优先，避免几个大文件最后才开始、拖长整体耗时
+      interleave  大小任务交替，大文件占满带宽的同时小文件的固定开销被摊薄
+      locality    同一目录的任务连续发出，目录之间按最大任务优先
+    失败的任务通过 retry() 延迟放回，延迟到期前不会被取出，工作线程不必原地等待
+    同时记录每个任务的大小和耗时，用于预测剩余耗时并在结束时与实际耗时对比
     """
-    推送文件或文件夹到远程服务器
+    def __init__(self, policy="largest", maxsize=1024, workers=4):
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError(f"未知的调度策略: {policy}")
+        self.policy = policy
+        self.maxsize = maxsize
+        self.workers = workers
+        self._pending = []  # [(任务, 大小, 分组)]
+        self._overflow = deque()  # 不等待放入时窗口已满的任务，窗口有空位时按顺序补入
+        self._delayed = []  # 等待重试的任务（堆）：[(到期时间, 序号, 任务, 大小, 分组)]
+        self._attempts = {}  # {任务标识: 已重试次数}
+        self._sequence = 0
+        self._unfinished = 0
+        self._cond = Condition()
+        self._local = local()  # 每个工作线程当前任务的大小和开始时间
+        self._take_large = True  # interleave：这一次取大任务还是小任务
+        self._group = None  # locality：上一次发出的任务所在分组
+        self._samples = []  # 已完成任务的 (大小, 耗时)
+        self._started = time.time()
+        self._finished = None  # 最近一次所有任务都完成的时间，作为实际结束时间（不含工作线程退出的等待）
+        self._closed = False
+        self._predict_requested = False  # 枚举已结束、等待足够的已完成任务后再预测
+        self._predicted = None
+
+    def put(self, item, size, group=None, block=True):
+        """
+        放入任务；窗口已满时等待工作线程取走
+        :param block: 为 False 时不等待，窗口已满的任务暂存在溢出列表中（多主机推送时慢主机不拖住枚举线程）
+        """
+        with self._cond:
+            if not block and len(self._pending) >= self.maxsize:
+                self._overflow.append((item, size, group))
+                self._unfinished += 1
+                return
+            while len(self._pending) >= self.maxsize:
+                self._cond.wait()
+            self._pending.append((item, size, group))
+            self._unfinished += 1
+            self._cond.notify_all()
+
+    def retry(self, item, size, group, key, retry_after=None, count=True):
+        """
+        任务失败后延迟放回：第 n 次重试延迟 RETRY_BASE_DELAY * 2^(n-1) 秒（随机抖动，不超过 RETRY_MAX_DELAY），
+        且不短于 retry_after（例如主机熔断的剩余冷却时间）
+        :param key: 任务标识（文件路径），同一个文件的重试次数累计
+        :param count: 为 False 时不计入重试次数（主机熔断期间的等待由熔断器限制总时长）
+        :return: 延迟的秒数；重试次数已用完时返回 None，任务不再放回
+        """
+        with self._cond:
+            attempt = self._attempts.get(key, 0)
+            if count:
+                if attempt >= RETRY_LIMIT:
+                    return None
+                self._attempts[key] = attempt + 1
+            self._local.current = None  # 失败的尝试不计入耗时样本
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+            delay = max(random.uniform(delay / 2, delay), retry_after or 0)
+            self._sequence += 1
+            heapq.heappush(self._delayed, (time.time() + delay, self._sequence, item, size, group))
+            self._unfinished += 1
+            self._cond.notify_all()
+        return delay
+
+    def _promote(self):
+        """
+        把已到期的重试任务移入窗口（调用方持有 self._cond），返回下一个重试任务的到期时间
+        """
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, item, size, group = heapq.heappop(self._delayed)
+            (self._pending if len(self._pending) < self.maxsize else self._overflow).append((item, size, group))
+        return self._delayed[0][0] if self._delayed else None
+
+    def qsize(self):
+        """
+        窗口、溢出列表和重试等待中尚未取走的任务数
+        """
+        with self._cond:
+            return len(self._pending) + len(self._overflow) + len(self._delayed)
+
+    def _pick(self, pending):
+        """
+        按调度策略返回下一个要发出的任务在 pending 中的下标
+        """
+        if self.policy == "fifo":
+            return 0
+        if self.policy == "interleave":
+            choose = max if self._take_large else min
+            self._take_large = not self._take_large
+            return choose(range(len(pending)), key=lambda i: pending[i][1])
+        largest = max(range(len(pending)), key=lambda i: pending[i][1])
+        if self.policy == "locality":
+            same_group = [i for i in range(len(pending)) if pending[i][2] == self._group]
+            if same_group:
+                return max(same_group, key=lambda i: pending[i][1])
+            self._group = pending[largest][2]
+        return largest
+
+    def get(self, timeout=None):
+        """
+        按调度策略取出一个任务，超时未取到时抛出 queue.Empty
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while True:
+                next_due = self._promote()
+                if self._pending:
+                    break
+                wake = min(t for t in (next_due, deadline) if t is not None) if next_due or deadline else None
+                if self._closed or deadline is not None and time.time() >= deadline:
+                    raise Empty
+                self._cond.wait(wake - time.time() if wake is not None else None)
+            item, size, _ = self._pending.pop(self._pick(self._pending))
+            if self._overflow:
+                self._pending.append(self._overflow.popleft())
+            self._cond.notify_all()
+        self._local.current = (size, time.time())
+        return item
+
+    def task_done(self):
+        current = getattr(self._local, "current", None)
+        self._local.current = None
+        with self._cond:
+            if current is not None:
+                size, started = current
+                self._samples.append((size, time.time() - started))
+            self._unfinished -= 1
+            if not self._unfinished:
+                self._finished = time.time()
+            self._cond.notify_all()
+            ready = self._predict_requested and len(self._samples) >= self.workers
+            if ready:
+                self._predict_requested = False
+        if ready:
+            self._predict()
+
+    def join(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._unfinished == 0)
+
+    def close(self):
+        """
+        任务全部结束后调用：正在 get() 中等待的工作线程立即抛出 queue.Empty，不必等到超时才看到退出通知
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _estimate(self):
+        """
+        用已完成任务估算：最短的任务耗时近似为每个任务的固定开销，扣除固定开销后的总字节数 / 总耗时为单线程吞吐
+        已完成的字节数太少时吞吐使用默认值
+        """
+        samples = self._samples[-1000:]
+        if not samples:
+            return SCHEDULE_DEFAULT_RATE, SCHEDULE_DEFAULT_OVERHEAD
+        overhead = min(elapsed for _, elapsed in samples)
+        total_size = sum(size for size, _ in samples)
+        transfer_time = sum(elapsed for _, elapsed in samples) - overhead * len(samples)
+        if total_size < SCHEDULE_MIN_SAMPLE_BYTES or transfer_time <= 0:
+            return SCHEDULE_DEFAULT_RATE, overhead
+        return total_size / transfer_time, overhead
+
+    def predict(self):
+        """
+        枚举结束后调用：已完成的任务足够估算吞吐（每个工作线程一个）时立即预测，否则等到足够时再预测
+        """
+        with self._cond:
+            ready = len(self._samples) >= self.workers
+            self._predict_requested = not ready
+        if ready:
+            self._predict()
+
+    def _predict(self):
+        """
+        按调度策略的发放顺序把窗口中剩余的任务模拟分配给各工作线程，
+        预测整个任务的完成时间（从调度器创建时算起的秒数）
+        """
+        with self._cond:
+            rate, overhead = self._estimate()
+            in_flight = self._unfinished - len(self._pending) - len(self._overflow) - len(self._delayed)
+            # 在副本上重放调度策略，得到剩余任务的发放顺序，之后恢复策略状态
+            state = (self._take_large, self._group)
+            pending, ordered = list(self._pending), []
+            while pending:
+                ordered.append(pending.pop(self._pick(pending)))
+            self._take_large, self._group = state
+            ordered.extend(self._overflow)
+            ordered.extend(task[2:] for task in sorted(self._delayed))
+            remaining = len(ordered)
+        # 正在传输的任务按平均耗时的一半估算剩余时间
+        average = sum(elapsed for _, elapsed in self._samples) / len(self._samples) if self._samples else overhead
+        finish = [average / 2 if i < in_flight else 0.0 for i in range(self.workers)]
+        for _, size, _ in ordered:
+            index = finish.index(min(finish))
+            finish[index] += overhead + size / rate
+        elapsed = time.time() - self._started
+        self._predicted = elapsed + max(finish)
+        print(f"调度预测（{self.policy}）: 剩余 {remaining} 个任务，单线程吞吐约 {format_size(rate)}/s，"
+              f"每个任务固定开销约 {overhead:.2f} 秒，预计 {self._predicted - elapsed:.1f} 秒后全部完成")
+
+    def report(self):
+        """
+        任务结束后输出预测耗时与实际耗时的对比
+        """
+        actual = max((self._finished or time.time()) - self._started, 1e-6)
+        total_size = sum(size for size, _ in self._samples)
+        summary = f"共 {len(self._samples)} 个任务（{format_size(total_size)}），总吞吐 {format_size(total_size / actual)}/s"
+        if self._predicted is None:
+            print(f"调度统计（{self.policy}）: {summary}，实际耗时 {actual:.1f} 秒")
+        else:
+            print(f"调度统计（{self.policy}）: {summary}，预计耗时 {self._predicted:.1f} 秒，"
+                  f"实际耗时 {actual:.1f} 秒（偏差 {actual - self._predicted:+.1f} 秒）")
+
+CONCURRENCY_INTERVAL = 5  # 并发控制每隔这么多秒采样一次吞吐、错误数和建立连接的耗时，做一次调整
+CONCURRENCY_MIN_GAIN = 0.05  # 增加一个线程后吞吐至少提高这个比例才继续增加，否则撤回
+CONCURRENCY_HOLD = 6  # 撤回或因出错减少线程后，保持这么多个采样周期再尝试增加
+CONCURRENCY_RELAX = 24  # 出错降低上限后，连续这么多个有进展且没有出错的周期才把上限放宽一个
+CONCURRENCY_SHIFT = 0.3  # 撤回后的保持期内吞吐变化超过这个比例时视为负载变了（例如从大文件转到小文件），提前结束保持
+CONCURRENCY_SLOW_CONNECT = 3.0  # 新连接的握手耗时超过此前平均值的这么多倍（且至少慢 0.5 秒）时视为远程已过载，减少一个线程
+
+class ConcurrencyController:
+    """
+    自适应并发（AIMD）：启动 max_workers 个工作线程，只有编号小于当前并发数的线程取任务，其余线程等待
+    每 CONCURRENCY_INTERVAL 秒根据该主机传输的字节数、可重试的错误数和新连接的握手耗时调整并发数：
+    - 出现可重试的错误（连接被拒绝、超时、断开，通常是超出了 sshd 的 MaxStartups/MaxSessions）时减半，
+      并把上限降到出错时的并发数以下，之后每 CONCURRENCY_RELAX 个周期没有出错才放宽一个
+    - 新连接的握手明显变慢（远程 sshd 或 CPU 已过载）时减一
+    - 否则每个周期加一，只要吞吐随之提高；加一后吞吐没有提高 CONCURRENCY_MIN_GAIN 则撤回，保持一段时间再试，
+      保持期内吞吐明显变化（文件大小分布变了，最佳并发数也随之改变）时立即再试
+    调度窗口中等待的任务少于并发数时（枚举还没跟上或即将结束），或周期内没有传输任何数据时（例如主机熔断中），吞吐不反映并发数，不做调整
+    """
+    def __init__(self, pool, file_queue, initial, min_workers, max_workers, label=""):
+        """
+        :param pool: 该主机的连接池，传输指标和建立连接的耗时从它读取
+        :param file_queue: 该主机的调度窗口，用于判断是否有足够的等待任务
+        :param initial: 初始并发数
+        :param min_workers: 并发数下限
+        :param max_workers: 并发数上限，也是启动的工作线程数
+        """
+        self.pool = pool
+        self.file_queue = file_queue
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.limit = min(max(initial, self.min_workers), self.max_workers)
+        self.label = label
+        self.peak = self.limit
+        self.adjustments = 0
+        self._cond = Condition()
+        self._ceiling = self.max_workers  # 出错后降低的上限
+        self._clean = 0  # 上次出错之后有进展且没有出错的周期数
+        self._hold = 0  # 剩余的保持周期数
+        self._hold_rate = None  # 撤回时的吞吐，保持期内据此判断负载是否变化；出错后的保持期为 None
+        self._grew_from = None  # 上个周期加一之前的吞吐；None 表示上个周期没有加一
+
+    def admit(self, index, stop_event):
+        """
+        编号为 index 的工作线程取任务前调用：编号不小于当前并发数时等待
+        :return: stop_event 已设置时返回 False，线程应退出
+        """
+        with self._cond:
+            while index >= self.limit and not stop_event.is_set():
+                self._cond.wait(1)
+        return not stop_event.is_set()
+
+    def run(self, stop_event):
+        """
+        控制线程：周期性采样并调整，stop_event 设置后退出
+        """
+        last = self._sample()
+        while not stop_event.wait(CONCURRENCY_INTERVAL):
+            current = self._sample()
+            self._adjust(last, current)
+            last = current
+
+    def _sample(self):
+        counters = self.pool.metrics.snapshot()[1].get(self.pool.host_label, {})
+        connections, connect_seconds = self.pool.connect_stats
+        return time.time(), counters.get("bytes", 0), counters.get("retries", 0), connections, connect_seconds
+
+    def _set(self, limit, reason):
+        with self._cond:
+            previous, self.limit = self.limit, limit
+            self._cond.notify_all()
+        self.adjustments += 1
+        self.peak = max(self.peak, limit)
+        print(f"{self.label}并发调整: {previous} -> {limit} 个线程（{reason}）")
+
+    def _adjust(self, last, current):
+        rate = (current[1] - last[1]) / max(current[0] - last[0], 1e-6)
+        errors = current[2] - last[2]
+        limit = self.limit
+        grew_from, self._grew_from = self._grew_from, None
+        if errors:
+            self._ceiling = max(self.min_workers, limit - 1)
+            self._hold, self._hold_rate = CONCURRENCY_HOLD, None
+            self._clean = 0
+            if limit > self.min_workers:
+                self._set(max(self.min_workers, limit // 2), f"{CONCURRENCY_INTERVAL} 秒内 {errors} 次可重试的错误")
+            return
+        connections = current[3] - last[3]
+        if connections and last[3]:
+            connect_time, baseline = (current[4] - last[4]) / connections, last[4] / last[3]
+            if connect_time > baseline * CONCURRENCY_SLOW_CONNECT and connect_time > baseline + 0.5 and limit > self.min_workers:
+                self._hold, self._hold_rate = CONCURRENCY_HOLD, None
+                self._set(limit - 1, f"新连接握手耗时 {connect_time:.2f} 秒，此前平均 {baseline:.2f} 秒")
+                return
+        if self.file_queue.qsize() < limit or not rate:
+            return
+        self._clean += 1
+        if self._ceiling < self.max_workers and self._clean % CONCURRENCY_RELAX == 0:
+            self._ceiling += 1
+        if grew_from is not None and rate < grew_from * (1 + CONCURRENCY_MIN_GAIN):
+            self._hold, self._hold_rate = CONCURRENCY_HOLD, rate
+            self._set(limit - 1, f"吞吐 {format_size(rate)}/s，没有高于 {limit - 1} 个线程时的 {format_size(grew_from)}/s")
+            return
+        if self._hold and self._hold_rate is not None and abs(rate - self._hold_rate) > self._hold_rate * CONCURRENCY_SHIFT:
+            self._hold = 0
+        if self._hold:
+            self._hold -= 1
+            return
+        if limit < self._ceiling:
+            self._grew_from = rate
+            self._set(limit + 1, f"吞吐 {format_size(rate)}/s")
+
+    def report(self):
+        print(f"{self.label}并发控制: 最终 {self.limit} 个线程，最多 {self.peak} 个，调整 {self.adjustments} 次"
+              f"（范围 {self.min_workers}-{self.max_workers}）")
+
+FILE_QUEUE_SIZE = 1024  # 调度窗口的容量，窗口满时枚举线程等待工作线程消费
+ENUM_BATCH_SIZE = 1000  # 枚举时每积累这么多文件批量创建一次远程目录、比较一次校验和
+
+def scan_local_files(local_path, pattern):
+    """
+    用 os.scandir 逐个目录遍历本地文件夹，边遍历边产出匹配的文件，不预先收集整棵目录树
+    与 os.walk 一样不进入指向目录的符号链接
+    :return: 生成 (本地文件路径, 相对路径, os.stat_result)
+    """
+    stack = [local_path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                subdirs = []
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file() and fnmatch.fnmatch(entry.name, pattern):
+                            yield entry.path, os.path.relpath(entry.path, local_path), entry.stat()
+                    except OSError as e:
+                        print(f"本地文件不可访问: {entry.path}, 错误: {e}")
+        except OSError as e:
+            print(f"无法读取本地目录: {current}, 错误: {e}")
+            continue
+        stack.extend(reversed(subdirs))
+
+def parse_hosts(remote_host, remote_port):
+    """
+    解析目标主机列表：remote_host 可以是列表，或用逗号分隔的字符串；
+    每一项可以写成 host、host:port 或 [IPv6]:port，未写端口时使用 remote_port
+    :return: [(主机, 端口), ...]
+    """
+    specs = remote_host if isinstance(remote_host, (list, tuple)) else remote_host.split(",")
+    hosts = []
+    for spec in specs:
+        spec = spec.strip()
+        if not spec:
+            continue
+        host, port = spec, remote_port
+        if spec.startswith("[") and "]" in spec:
+            host, _, rest = spec[1:].partition("]")
+            if rest.startswith(":"):
+                port = int(rest[1:])
+        elif spec.count(":") == 1:
+            host, port = spec.split(":")
+            port = int(port)
+        hosts.append((host, port))
+    return hosts
+
+class HostPush:
+    """
+    一台目标主机的推送状态：连接池、任务日志、远程索引、调度窗口、工作线程和失败列表
+    多主机推送时每台主机一份，由同一个枚举线程喂入，各自独立推送，一台主机慢或失败不影响其它主机
+    """
+    def __init__(self, remote_host, remote_port, remote_user, remote_password, remote_base_path, local_path, threads, max_sessions,
+                 options, journal_path=None, label="", rate_bucket=None, metrics=None, manifest=None, state=None):
+        """
+        :param options: push_files 的同步选项（sync_mode、dry_run、各传输方式的阈值、chunk_streams、schedule_policy、各级限速、verify、
+                        dedup_threshold、dedup_mode、reconcile_interval、transport_profile、compress、adaptive_threads、
+                        min_threads、max_threads、watch）
+        :param label: 输出前缀，多主机推送时为 "[主机:端口] "
+        :param rate_bucket: 所有主机共享的全局令牌桶，None 表示不限制全局速率
+        :param metrics: 所有主机共享的传输指标，按主机分别汇总
+        :param manifest: 所有主机共享的校验清单
+        :param state: 所有主机共享的传输状态库（TransferState），None 表示不使用
+        """
+        self.remote_base_path = remote_base_path
+        self.threads = threads
+        self.options = options
+        self.label = label
+        # 所有工作线程共享同一个连接池；自动调整并发时连接数随并发数增长，默认上限与最大并发数相同
+        workers = options["max_threads"] if options["adaptive_threads"] else threads
+        self.pool = SSHConnectionPool(remote_host, remote_port, remote_user, remote_password, max_sessions=max_sessions or workers,
+                                      metrics=metrics, profile=options["transport_profile"], state=state, probe=not options["dry_run"])
+        if os.path.isfile(local_path):
+            self.pool.planned_bytes = os.path.getsize(local_path)  # 推送单个文件时事先知道传输量，小文件不测量带宽
+
+        # 限速器：同时受全局、本主机和单个文件的速率限制，都不限速时只用于统计已传输的字节数
+        host_bucket = TokenBucket(options["host_rate_limit"]) if options["host_rate_limit"] else None
+        self.limiter = BandwidthLimiter([rate_bucket, host_bucket], options["file_rate_limit"], self.pool.metrics, self.pool.host_label)
+
+        # 任务日志：同一任务中断后重新运行时跳过已完成的文件
+        if journal_path is None:
+            job_id = hashlib.sha1(f"{remote_host}:{remote_port}:{os.path.abspath(local_path)}:{remote_base_path}".encode()).hexdigest()[:12]
+            journal_path = f".push_files-{job_id}.journal"
+        self.journal_path = journal_path
+        # 记为完成的文件同时写入状态库（下次运行时在本地判断跳过）和远程索引（监视模式下后续批次据此比较）
+        self.state = state
+        self.journal = TransferJournal(journal_path, on_done=self.pushed)
+
+        self.file_queue = TransferScheduler(options["schedule_policy"], maxsize=FILE_QUEUE_SIZE, workers=threads)  # 有界窗口：工作线程跟不上时枚举线程等待
+        self.pool.metrics.watch_queue(self.pool.host_label, self.file_queue)
+        self.controller = ConcurrencyController(self.pool, self.file_queue, threads, options["min_threads"], options["max_threads"], label) \
+            if options["adaptive_threads"] else None
+        self.plan = {"transfer": [0, 0], "skip": [0, 0], "dedup": [0, 0]}  # [文件数, 字节数]
+        # 当前批次：待入队的任务、缺失的远程目录、需要比较校验和的文件、与已计划的文件大小相同需要判断是否重复的文件
+        self.batch = {"items": [], "dirs": set(), "checksum": [], "dedup": []}
+        # 去重索引：按大小分组的已计划文件（还没有计算校验和的）、已知内容的已计划文件、等待在远程复制的重复文件
+        self.dedup = {"sizes": {}, "digests": {}, "duplicates": []}
+        self.bundle = {"files": [], "bytes": 0}  # 正在累积的小文件打包
+        self.block = True  # 调度窗口满时是否等待；多主机推送时为 False
+        self.failures = []
+        self.thread_list = []
+        self.stop_event = Event()  # 用于通知线程退出
+        self.manifest = manifest
+        self.verifier = None
+        self.remote_index = None
+        self.remote_files, self.remote_dirs = {}, set()
+        self.index_from_state = False  # 远程索引取自状态库（未到核对时间）而不是远程
+        self.compress = None  # 是否压缩推送，第一次需要时根据传输参数预设决定
+
+    def prepare(self):
+        """
+        一次性获取远程目标路径的索引，之后的跳过判断都在本地完成
+        状态库在核对间隔内与远程核对过时，先在远程统计目标路径下的文件数和总字节数（只传回一行），与状态库的记录一致
+        才用状态库的记录作为远程索引；不一致（目标被清空、删除了部分文件、被其它程序改动或有状态库之外的文件）或无法统计时，
+        与超过核对间隔一样列出远程索引，并删除状态库中远程已不存在或大小不同的记录
+        :return: 无法连接时返回 False
+        """
+        host = self.pool.host_label
+        reconciled = self.state.last_reconciled("push", host, self.remote_base_path) if self.state is not None else None
+        if reconciled is not None and time.time() - reconciled < self.options["reconcile_interval"]:
+            files = self.state.files_under("push", host, self.remote_base_path)
+            recorded = (len(files), sum(size for size, _ in files.values()))
+            try:
+                with self.pool.connection() as ssh:
+                    actual = remote_tree_summary(ssh, self.remote_base_path)
+            except Exception as e:
+                actual = None
+                print(f"{self.label}无法核对状态库，重新列出远程索引: {e}")
+            if actual == recorded:
+                self.remote_index = (files, {os.path.dirname(path) for path in files})
+                self.remote_files, self.remote_dirs = self.remote_index
+                self.index_from_state = True
+                print(f"{self.label}使用状态库中的 {len(files)} 条记录作为远程索引（{(time.time() - reconciled) / 3600:.1f} 小时前与远程完整核对过，"
+                      f"文件数和总字节数与远程一致）")
+                return True
+            if actual is not None:
+                print(f"{self.label}远程有 {actual[0]} 个文件（{format_size(actual[1])}），与状态库的 {recorded[0]} 个文件"
+                      f"（{format_size(recorded[1])}）不一致，重新列出远程索引")
+        try:
+            with self.pool.connection() as ssh:
+                self.remote_index = build_remote_index(ssh, self.remote_base_path)
+        except Exception as e:
+            print(f"{self.label}无法连接远程服务器，跳过该主机: {e}")
+            self.journal.close()
+            return False
+        if self.remote_index is None:
+            if self.options["sync_mode"] == "skip":
+                print(f"{self.label}无法获取远程索引，回退到逐个文件检查")
+            else:
+                print(f"{self.label}无法获取远程索引，无法比较文件差异，将推送全部文件")
+        self.remote_files, self.remote_dirs = self.remote_index or ({}, set())
+        if self.state is not None and self.remote_index is not None:
+            removed = self.state.reconcile("push", host, self.remote_base_path, self.remote_files)
+            if removed:
+                print(f"{self.label}状态库与远程核对: 删除 {removed} 条远程已不存在或已变化的记录")
+        return True
+
+    def pushed(self, remote_file_path, size, mtime, digest=None):
+        if self.remote_index is not None:
+            self.remote_files[remote_file_path] = (size, mtime)
+        if self.state is not None:
+            self.state.record("push", self.pool.host_label, remote_file_path, size, mtime, digest)
+
+    def remember(self, local_file_path, remote_file_path, size, digest=None):
+        # 远程已与本地一致的文件（无需推送）也记入状态库，下次运行不必再比较
+        if self.state is not None:
+            try:
+                mtime = os.stat(local_file_path).st_mtime
+            except OSError:
+                return
+            self.state.record("push", self.pool.host_label, os.path.normpath(remote_file_path), size, mtime, digest)
+
+    def flush_bundle(self):
+        if self.bundle["files"]:
+            self.file_queue.put((self.bundle["files"], self.remote_base_path, "bundle"), self.bundle["bytes"], self.remote_base_path, block=self.block)
+            self.bundle["files"], self.bundle["bytes"] = [], 0
+
+    def flush_batch(self):
+        # 先批量创建本批次缺失的远程目录，再把任务交给工作线程
+        new_dirs = self.batch["dirs"] - self.remote_dirs
+        if new_dirs:
+            with self.pool.connection() as ssh:
+                if not remote_mkdirs(ssh, new_dirs):
+                    for remote_dir in sorted(new_dirs):
+                        remote_mkdir(ssh, remote_dir)
+            self.remote_dirs.update(new_dirs)
+        for item, size in self.batch["items"]:
+            self.file_queue.put(item, size, os.path.dirname(item[1]), block=self.block)
+        self.batch["items"], self.batch["dirs"] = [], set()
+
+    def compress_enabled(self):
+        if self.compress is None:
+            if self.options["compress"] == "auto" and self.pool.profile_name == "auto":
+                # 远程索引取自状态库时还没有连接过：先建立一个连接（之后由工作线程复用），测量链路后选定预设
+                try:
+                    with self.pool.connection():
+                        pass
+                except Exception as e:
+                    print(f"{self.label}无法测量链路，不压缩推送: {e}")
+            self.compress = compression_enabled(self.options["compress"], self.pool)
+            if self.compress and not self.remote_has_gzip():
+                print(f"{self.label}远程没有 gzip，不压缩推送")
+                self.compress = False
+            if self.compress:
+                print(f"{self.label}压缩推送可压缩的文件和打包")
+        return self.compress
+
+    def remote_has_gzip(self):
+        # 每台主机只检查一次；无法检查时假定存在，由 compressed_push 按远程的退出状态逐个文件回退
+        try:
+            with self.pool.connection() as ssh:
+                stdin, stdout, stderr = ssh.exec_command("command -v gzip")
+                return stdout.channel.recv_exit_status() == 0
+        except Exception:
+            return True
+
+    def transfer_method(self, local_file_path, remote_file_path, size):
+        options = self.options
+        if options["delta_threshold"] and size >= options["delta_threshold"] and remote_file_path in self.remote_files:
+            return "delta"
+        if options["bundle_threshold"] and size < options["bundle_threshold"] and self.remote_index is not None:
+            # 逐个文件检查远程时无法打包（tar 会覆盖已存在的文件）
+            return "bundle"
+        if options["chunk_threshold"] and size >= options["chunk_threshold"] and self.remote_index is not None:
+            return "chunked"
+        if size >= COMPRESS_MIN_SIZE and options["compress"] != "off" and self.compress_enabled() and compressible(local_file_path):
+            return "compressed"
+        if options["resume_threshold"] and size >= options["resume_threshold"] and self.remote_index is not None:
+            return "resumable"
+        return "scp"
+
+    def schedule(self, local_file_path, remote_file_path, size, dedup=True):
+        """
+        :param dedup: 是否参与去重；与已计划的文件大小相同时先放入本批次，由 resolve_duplicates() 比较内容后再决定
+        """
+        options = self.options
+        # 逐个文件检查远程时不去重（无法知道远程是否已有目标文件）
+        if dedup and options["dedup_threshold"] and size >= options["dedup_threshold"] and self.remote_index is not None:
+            if size in self.dedup["sizes"]:
+                self.batch["dedup"].append((local_file_path, remote_file_path, size))
+                return
+            self.dedup["sizes"][size] = [(local_file_path, remote_file_path)]
+        self.plan["transfer"][0] += 1
+        self.plan["transfer"][1] += size
+        method = self.transfer_method(local_file_path, remote_file_path, size)
+        if options["dry_run"]:
+            label = {"delta": "（增量）", "bundle": "（打包）", "chunked": "（分块）", "compressed": "（压缩）", "resumable": "（可续传）"}.get(method, "")
+            print(f"{self.label}[试运行] 将推送{label}: {local_file_path} -> {remote_file_path} ({format_size(size)})")
+        elif method == "bundle":
+            self.bundle["files"].append((local_file_path, os.path.relpath(remote_file_path, self.remote_base_path)))
+            self.bundle["bytes"] += size
+            if self.bundle["bytes"] >= options["bundle_size"] or len(self.bundle["files"]) >= TAR_BUNDLE_MAX_FILES:
+                self.flush_bundle()
+        else:
+            if self.remote_index is not None:
+                self.batch["dirs"].add(os.path.dirname(remote_file_path))
+            self.batch["items"].append(((local_file_path, os.path.normpath(remote_file_path), method), size))
+            if len(self.batch["items"]) >= ENUM_BATCH_SIZE:
+                self.flush_batch()
+
+    def skip(self, local_file_path, remote_file_path, size, reason):
+        self.plan["skip"][0] += 1
+        self.plan["skip"][1] += size
+        print(f"{self.label}{reason}，跳过推送: {local_file_path} -> {remote_file_path}")
+
+    def compare_checksums(self, executor, local_sums):
+        """
+        大小相同的文件：本地并发计算校验和，远程一次批量计算，只推送内容不同的文件
+        :param local_sums: {本地文件路径: SHA-256}，多台主机共用，同一文件只计算一次
+        """
+        candidates, self.batch["checksum"] = self.batch["checksum"], []
+        if not candidates:
+            return
+        remote_sums = {}
+        if self.index_from_state:
+            # 远程索引取自状态库时，状态库中记录的 SHA-256 就是远程文件的内容，不必再到远程计算
+            for _, remote_file_path, _ in candidates:
+                record = self.state.get("push", self.pool.host_label, remote_file_path)
+                if record is not None and record[2] is not None:
+                    remote_sums[remote_file_path] = record[2]
+        unknown = [remote for _, remote, _ in candidates if remote not in remote_sums]
+        if unknown:
+            with self.pool.connection() as ssh:
+                remote_sums.update(remote_sha256sums(ssh, unknown))
+        missing = [path for path in dict.fromkeys(local for local, _, _ in candidates) if path not in local_sums]
+        local_sums.update(zip(missing, executor.map(file_sha256, missing)))
+        for local_file_path, remote_file_path, size in candidates:
+            if remote_sums.get(remote_file_path) == local_sums[local_file_path]:
+                self.skip(local_file_path, remote_file_path, size, "校验和一致")
+                self.remember(local_file_path, remote_file_path, size, local_sums[local_file_path])
+            else:
+                self.schedule(local_file_path, remote_file_path, size)
+
+    def resolve_duplicates(self, executor, local_sums):
+        """
+        与已计划的文件大小相同的文件：并发计算校验和（同样大小的已计划文件也补算），
+        内容与某个已计划文件相同的只推送一次，其余在所有任务完成后由远程从它复制
+        :param local_sums: {本地文件路径: SHA-256}，多台主机共用，同一文件只计算一次
+        """
+        candidates, self.batch["dedup"] = self.batch["dedup"], []
+        if not candidates:
+            return
+        sizes, digests = self.dedup["sizes"], self.dedup["digests"]
+        members = [member for size in dict.fromkeys(size for _, _, size in candidates) for member in sizes[size]]
+
+        def checksum(path):
+            try:
+                return file_sha256(path)
+            except OSError:
+                return None  # 文件不可读，按不重复处理，由推送过程报告错误
+
+        missing = [path for path in dict.fromkeys([local for local, _ in members] + [local for local, _, _ in candidates]) if path not in local_sums]
+        local_sums.update(zip(missing, executor.map(checksum, missing)))
+        for local_file_path, remote_file_path in members:
+            if local_sums[local_file_path] is not None:
+                digests.setdefault(local_sums[local_file_path], (local_file_path, remote_file_path))
+        for _, _, size in candidates:
+            sizes[size] = []
+        for local_file_path, remote_file_path, size in candidates:
+            digest = local_sums[local_file_path]
+            primary = digests.get(digest) if digest is not None else None
+            if primary is None:
+                if digest is not None:
+                    digests[digest] = (local_file_path, remote_file_path)
+                self.schedule(local_file_path, remote_file_path, size, dedup=False)
+                continue
+            self.plan["dedup"][0] += 1
+            self.plan["dedup"][1] += size
+            if self.options["dry_run"]:
+                print(f"{self.label}[试运行] 内容与 {primary[0]} 相同，将在远程复制: {primary[1]} -> {remote_file_path} ({format_size(size)})")
+            else:
+                if self.remote_index is not None:
+                    self.batch["dirs"].add(os.path.dirname(remote_file_path))
+                self.dedup["duplicates"].append((primary, local_file_path, remote_file_path, size))
+
+    def copy_duplicates(self):
+        """
+        所有任务完成（并校验）后，用一条命令在远程批量创建重复文件；
+        来源推送失败或远程创建失败的重复文件重新放回调度窗口，按普通文件推送
+        :return: 重新放回调度窗口的文件数，不为 0 时调用方应再次等待调度窗口清空
+        """
+        duplicates, self.dedup["duplicates"] = self.dedup["duplicates"], []
+        if not duplicates:
+            return 0
+        failed = set(self.failures)
+        preserve_times = self.options["sync_mode"] != "skip"
+        copies, created = [], set()
+        for (primary_local, primary_remote), local_file_path, remote_file_path, size in duplicates:
+            if primary_local not in failed:
+                try:
+                    mtime = os.stat(local_file_path).st_mtime
+                except OSError:
+                    continue  # 文件已被删除，重新推送时报告
+                # 硬链接与来源共用修改时间，设置它会改动来源文件
+                copies.append((primary_remote, remote_file_path, mtime if preserve_times and self.options["dedup_mode"] == "copy" else None, mtime))
+        try:
+            with self.pool.connection() as ssh:
+                created = remote_copy_files(ssh, [(source, target, mtime) for source, target, mtime, _ in copies], self.options["dedup_mode"])
+        except Exception as e:
+            print(f"{self.label}无法在远程创建重复文件: {e}")
+        saved = 0
+        mtimes = {target: mtime for _, target, _, mtime in copies}
+        requeued = 0
+        for _, local_file_path, remote_file_path, size in duplicates:
+            if remote_file_path in created:
+                saved += size
+                self.journal.mark_done(os.path.normpath(remote_file_path), size, mtimes[remote_file_path])
+            else:
+                method = self.transfer_method(local_file_path, remote_file_path, size)
+                self.file_queue.put((local_file_path, remote_file_path, "scp" if method == "bundle" else method), size,
+                                    os.path.dirname(remote_file_path), block=False)
+                requeued += 1
+        self.pool.metrics.add_dedup(self.pool.host_label, len(created), saved)
+        print(f"{self.label}去重: 在远程创建 {len(created)} 个重复文件，节省传输 {format_size(saved)}"
+              + (f"，{requeued} 个无法创建，改为逐个推送" if requeued else ""))
+        return requeued
+
+    def enqueue(self, local_file_path, remote_file_path, local_stat):
+        # 日志只在远程文件仍然存在时可信（远程可能在两次运行之间被清理）
+        if self.journal.is_done(os.path.normpath(remote_file_path), local_stat.st_size, local_stat.st_mtime) and \
+                (self.remote_index is None or os.path.normpath(remote_file_path) in self.remote_files):
+            self.skip(local_file_path, remote_file_path, local_stat.st_size, "任务日志记录已完成")
+            return
+        if self.remote_index is not None:
+            remote_file_path = os.path.normpath(remote_file_path)
+            remote_entry = self.remote_files.get(remote_file_path)
+            # 状态库记录的源文件与本地一致、远程文件仍在且大小相同：之前推送过，不必再比较
+            if self.state is not None and remote_entry is not None and remote_entry[0] == local_stat.st_size:
+                record = self.state.get("push", self.pool.host_label, remote_file_path)
+                if record is not None and tuple(record[:2]) == (local_stat.st_size, int(local_stat.st_mtime)):
+                    self.skip(local_file_path, remote_file_path, local_stat.st_size, "状态库记录已推送")
+                    return
+            decision = needs_transfer(local_stat.st_size, local_stat.st_mtime, remote_entry, self.options["sync_mode"])
+            if decision is None:
+                self.batch["checksum"].append((local_file_path, remote_file_path, local_stat.st_size))
+                return
+            if not decision:
+                self.skip(local_file_path, remote_file_path, local_stat.st_size, "文件已存在" if self.options["sync_mode"] == "skip" else "文件未变化")
+                if self.options["sync_mode"] != "skip":  # 只比较是否存在时不知道远程内容，不记入状态库
+                    self.remember(local_file_path, remote_file_path, local_stat.st_size)
+                return
+        self.schedule(local_file_path, remote_file_path, local_stat.st_size)
+
+    def finish_enumeration(self, executor, local_sums):
+        self.compare_checksums(executor, local_sums)
+        self.resolve_duplicates(executor, local_sums)
+        self.flush_batch()
+        self.flush_bundle()
+        dedup = self.plan["dedup"]
+        print(f"{self.label}同步计划: 需要推送 {self.plan['transfer'][0]} 个文件（{format_size(self.plan['transfer'][1])}），"
+              f"跳过 {self.plan['skip'][0]} 个文件（{format_size(self.plan['skip'][1])}）"
+              + (f"，{dedup[0]} 个重复文件（{format_size(dedup[1])}）在远程复制" if dedup[0] else ""))
+        if not self.options["dry_run"] and not self.options["watch"]:
+            self.file_queue.predict()
+
+    def start(self, cache=None, compressor=None):
+        """
+        启动工作线程
+        :param cache: 多主机推送时的共享读取缓存
+        :param compressor: 所有主机共享的压缩线程池，该主机不压缩推送时不使用
+        """
+        check_remote = self.remote_index is None
+        sync_mode, chunk_streams = self.options["sync_mode"], self.options["chunk_streams"]
+        if compressor is not None and not self.compress_enabled():
+            compressor = None
+        if self.options["verify"]:
+            self.verifier = TransferVerifier(self.pool, self.file_queue, self.journal, self.failures, self.manifest, self.label)
+        controller = self.controller
+        for index in range(controller.max_workers if controller is not None else self.threads):
+            thread = Thread(target=worker, args=(self.file_queue, self.remote_base_path, self.pool, self.stop_event, check_remote, sync_mode,
+                                                 chunk_streams, self.journal, self.failures, cache, self.limiter, self.verifier, compressor,
+                                                 index, controller), daemon=True)
+            thread.start()
+            self.thread_list.append(thread)
+        if controller is not None:
+            Thread(target=controller.run, args=(self.stop_event,), daemon=True).start()
+
+    def settle(self):
+        """
+        等待调度窗口中的任务全部完成，工作线程继续运行
+        """
+        # 校验不一致的文件、无法在远程复制的重复文件会重新放回调度窗口，等它们也推送并校验完
+        while True:
+            self.file_queue.join()
+            if self.verifier is not None and self.verifier.drain():
+                continue
+            if not self.copy_duplicates():
+                break
+
+    def reset_batch(self):
+        """
+        监视模式每批推送完成后调用：清空同步计划、去重索引（本地文件可能已变化）和失败列表
+        :return: 本批推送失败的本地文件
+        """
+        failed = list(self.failures)
+        del self.failures[:]  # 工作线程和校验线程持有同一个列表
+        self.plan = {"transfer": [0, 0], "skip": [0, 0], "dedup": [0, 0]}
+        self.dedup = {"sizes": {}, "digests": {}, "duplicates": []}
+        return failed
+
+    def wait(self):
+        """
+        等待该主机的所有任务完成、工作线程退出，输出结果
+        """
+        self.settle()
+        if self.verifier is not None:
+            self.verifier.close()
+
+        # 通知线程退出
+        self.stop_event.set()
+        self.file_queue.close()
+
+        # 等待所有线程退出
+        for thread in self.thread_list:
+            thread.join()
+
+        self.pool.close_all()
+        self.file_queue.report()
+        if self.controller is not None:
+            self.controller.report()
+        if self.verifier is not None:
+            self.verifier.report()
+        if self.failures:
+            self.journal.close()
+            print(f"{self.label}{len(self.failures)} 个文件推送失败，重新运行同一任务将跳过已完成的文件并从断点继续（任务日志: {self.journal_path}）")
+        else:
+            self.journal.close(remove=True)
+            print(f"{self.label}所有文件推送完成！")
+
+    def close(self):
+        if self.verifier is not None:
+            self.verifier.close()
+        self.pool.close_all()
+        self.journal.close()
+
+WATCH_DEBOUNCE = 1.0  # 监视模式：最后一个事件之后安静这么多秒再推送，合并同一文件的多次写入
+WATCH_MAX_DELAY = 10.0  # 监视模式：事件持续不断时，第一个事件之后最多等待这么多秒就推送
+WATCH_BATCH_FILES = 10000  # 监视模式：积累这么多个变化的文件时立即推送
+WATCH_CATCHUP_SLACK = 2  # 重启追赶时，把上次检查点之前这么多秒内变化的文件也算上（文件系统时间精度和时钟误差）
+
+class InotifyWatcher:
+    """
+    用 Linux inotify 递归监视一个目录树（通过 ctypes 调用 libc，不需要第三方库）
+    只关心写完关闭（IN_CLOSE_WRITE）和移入（IN_MOVED_TO）的文件；新建的子目录自动加入监视，其中已有的文件作为变化的文件返回
+    没有事件时阻塞在 select 上，空闲时不占用 CPU
+    """
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE_SELF = 0x400
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+    EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self, root):
+        self.root = root
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_init1 失败: {os.strerror(ctypes.get_errno())}")
+        self._dirs = {}  # {watch descriptor: 目录路径}
+        self.overflowed = False  # 内核事件队列溢出过，期间的事件已丢失，调用方应按时间追赶
+        self.add_tree(root)
+
+    def add_tree(self, top):
+        """
+        递归监视 top 及其子目录（不进入指向目录的符号链接）
+        :return: 子目录中已有的文件路径（监视建立之前就已写入，不会再有事件）
+        """
+        existing = []
+        for current, subdirs, files in os.walk(top):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(current), self.MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise OSError(error, "inotify 监视数量已达上限，请调大 /proc/sys/fs/inotify/max_user_watches")
+                print(f"无法监视目录: {current}, 错误: {os.strerror(error)}")
+                continue
+            self._dirs[wd] = current
+            if current != top:
+                existing.extend(os.path.join(current, name) for name in files)
+        return existing
+
+    def read(self, timeout=None):
+        """
+        等待并读取事件，timeout 秒内没有事件时返回空列表
+        :return: 变化的文件路径列表（可能重复）
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        changed = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                name = data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b"\0")
+                offset += self.EVENT.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    self.overflowed = True
+                    continue
+                directory = self._dirs.get(wd)
+                if directory is None:
+                    continue
+                if mask & (self.IN_IGNORED | self.IN_DELETE_SELF):
+                    self._dirs.pop(wd, None)  # 目录已删除
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        changed.extend(self.add_tree(path))
+                elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                    changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+class WatchLog:
+    """
+    监视模式的持久化事件日志（JSON Lines）：收到的每个变化的文件先追加到日志并落盘，再等待推送；
+    一批推送完成后写检查点：日志重写为检查点时间加上仍未推送（或推送失败）的文件
+    重启时先推送日志中未完成的文件，再只补推上次检查点之后修改过的本地文件（只比较本地的修改时间，不逐个询问远程）
+    """
+    def __init__(self, path):
+        self.path = path
+        self.checkpoint = None  # 上一次检查点的时间，None 表示没有日志（第一次运行）
+        self.pending = {}  # 日志中尚未推送的文件（有序，值无意义）
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 上次中断时可能留下不完整的最后一行
+                    if "checkpoint" in record:
+                        self.checkpoint = record["checkpoint"]
+                    else:
+                        self.pending[record["path"]] = None
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, paths):
+        """
+        记录一批收到的变化（一次落盘）
+        """
+        for path in paths:
+            self._file.write(json.dumps({"path": path}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def mark_checkpoint(self, at, pending):
+        """
+        写检查点：at 之前发生的变化都已处理，pending 是仍需推送的文件
+        """
+        self.checkpoint = at
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"checkpoint": at}) + "\n")
+            for path in pending:
+                f.write(json.dumps({"path": path}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        self._file.close()
+
+def watch_local_changes(local_path, pattern, targets, feed, log_path, debounce=WATCH_DEBOUNCE, ignore=()):
+    """
+    监视模式主循环：用 inotify 监视本地文件夹，合并短时间内的多次事件后把变化的文件成批交给 feed()，
+    由各主机已在运行的工作线程和连接池推送；每批完成后写检查点。按 Ctrl+C 停止
+    没有事件日志时先完整推送一次；有日志时只推送日志中未完成的文件和上次检查点之后修改的本地文件
+    :param feed: 接收 (本地文件路径, 相对路径, os.stat_result) 的可迭代对象，比较后放入各主机的调度窗口
+    :param log_path: 事件日志路径（见 WatchLog）
+    :param debounce: 最后一个事件之后安静这么多秒再推送
+    :param ignore: 不推送的本地路径前缀（任务日志、状态库、事件日志等本脚本自己写入的文件）
+    """
+    root = os.path.abspath(local_path)
+    ignore = tuple(os.path.abspath(path) for path in ignore)
+    watcher = InotifyWatcher(root)  # 先建立监视再追赶，追赶期间的修改不会丢失
+    log = WatchLog(log_path)
+    cond = Condition()
+    changed = {}  # {本地文件路径: 第一次收到事件的时间}，保持事件顺序
+    events = {"last": 0.0, "overflow": False}
+    stop = Event()
+
+    def local_entry(path):
+        # 事件到达时文件可能已被删除或改名，这类文件跳过
+        if path.startswith(ignore) or not path.startswith(root + os.sep) or not fnmatch.fnmatch(os.path.basename(path), pattern):
+            return None
+        try:
+            local_stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        return path, os.path.relpath(path, root), local_stat
+
+    def catch_up(paths, since):
+        # 先处理指定的文件，再遍历本地找出 since 之后修改（或移入，移入只改变 ctime）的文件
+        seen = set()
+        for entry in filter(None, map(local_entry, paths)):
+            seen.add(entry[0])
+            yield entry
+        for path, relative_path, local_stat in scan_local_files(root, pattern):
+            if path not in seen and not path.startswith(ignore) and max(local_stat.st_mtime, local_stat.st_ctime) >= since - WATCH_CATCHUP_SLACK:
+                yield path, relative_path, local_stat
+
+    def read_events():
+        while not stop.is_set():
+            paths = [path for path in watcher.read(timeout=1) if local_entry(path) is not None]
+            with cond:
+                if paths:
+                    log.append(paths)
+                    now = time.time()
+                    for path in paths:
+                        changed.setdefault(path, now)
+                    events["last"] = now
+                if watcher.overflowed:
+                    watcher.overflowed = False
+                    events["overflow"] = True
+                if paths or events["overflow"]:
+                    cond.notify()
+
+    def push_batch(files, started):
+        feed(files)
+        failed = []
+        for target in targets:
+            target.settle()
+            failed.extend(target.reset_batch())
+        failed = list(dict.fromkeys(failed))
+        with cond:
+            log.mark_checkpoint(started, failed + [path for path in changed if path not in failed])
+        return failed
+
+    reader = Thread(target=read_events, daemon=True)
+    reader.start()
+    failed = []
+    try:
+        started = time.time()
+        if log.checkpoint is None:
+            print(f"监视模式: 没有事件日志 {log_path}，先完整推送一次")
+            failed = push_batch(scan_local_files(root, pattern), started)
+        else:
+            print(f"监视模式: 从事件日志恢复，补推 {len(log.pending)} 个未完成的文件和 "
+                  f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(log.checkpoint))} 之后修改的文件")
+            failed = push_batch(catch_up(list(log.pending), log.checkpoint), started)
+        print(f"监视模式: 正在监视 {root}，按 Ctrl+C 停止")
+        while True:
+            with cond:
+                while not changed and not events["overflow"]:
+                    cond.wait()
+                now = time.time()
+                due = min(events["last"] + debounce, min(changed.values(), default=now) + WATCH_MAX_DELAY)
+                if len(changed) < WATCH_BATCH_FILES and not events["overflow"] and now < due:
+                    cond.wait(due - now)
+                    continue
+                first_event = min(changed.values(), default=now)
+                # 上一批失败的文件随下一批重试
+                batch = list(dict.fromkeys(failed + list(changed)))
+                changed.clear()
+                overflow, events["overflow"] = events["overflow"], False
+            started = time.time()
+            if overflow:
+                print("inotify 事件队列溢出，部分事件已丢失，按修改时间补推上次检查点之后修改的文件")
+                files = catch_up(batch, log.checkpoint)
+            else:
+                files = filter(None, map(local_entry, batch))
+            failed = push_batch(files, started)
+            print(f"监视模式: 本批 {len(batch)} 个变化的文件处理完成，从第一个事件到推送完成 {time.time() - first_event:.1f} 秒"
+                  + (f"，{len(failed)} 个文件推送失败，将随下一批重试" if failed else ""))
+    except KeyboardInterrupt:
+        print("停止监视，等待进行中的推送完成")
+    finally:
+        stop.set()
+        reader.join()
+        watcher.close()
+        log.close()
+
+def push_files(local_path, pattern, remote_host, remote_port, remote_user, remote_password, remote_base_path, threads, max_sessions=None,
+               adaptive_threads=True, min_threads=1, max_threads=None, sync_mode="skip", dry_run=False, delta_threshold=64 * 1024 * 1024, bundle_threshold=1024 * 1024, bundle_size=64 * 1024 * 1024,
+               chunk_threshold=256 * 1024 * 1024, chunk_streams=4, resume_threshold=16 * 1024 * 1024, journal_path=None,
+               schedule_policy="largest", rate_limit=0, host_rate_limit=0, file_rate_limit=0, rate_schedule=None,
+               metrics_path=None, prom_path=None, progress_interval=5, verify=True, manifest_path=None, dedup_threshold=1024 * 1024,
+               dedup_mode="copy", state_path=STATE_PATH, reconcile_interval=24 * 3600, transport_profile="auto", compress="auto",
+               watch=False, watch_log_path=None, watch_debounce=WATCH_DEBOUNCE):
+    """
+    推送文件或文件夹到一台或多台远程服务器
+    本地文件由枚举线程边遍历边放入有界队列，工作线程同时开始推送，内存占用与文件总数无关
+    多台主机时只遍历一次，每台主机有独立的连接池、调度窗口、工作线程和失败记录；
+    本地文件通过共享读取缓存只从磁盘读取一次，慢主机的积压暂存在它自己的溢出列表中，不拖住其它主机
     :param local_path: 本地路径（文件或文件夹）
     :param pattern: 文件名匹配模式（例如 "*.txt"）
-    :param remote_host: 远程服务器地址
-    :param remote_port: 远程服务器端口
+    :param remote_host: 远程服务器地址；多台时为列表或逗号分隔的字符串，每项可写成 host:port
+    :param remote_port: 远程服务器端口（未单独指定端口的主机使用）
     :param remote_user: 远程服务器用户名
     :param remote_password: 远程服务器密码
-    :param remote_base_path: 远程服务器目标路径
-    :param threads: 并发线程数
-    """
-    if os.path.isfile(local_path):
-        # 如果是文件，直接加入队列
-        if fnmatch.fnmatch(os.path.basename(local_path), pattern):
-            remote_file_path = os.path.join(remote_base_path, os.path.basename(local_path))
-            file_queue.put((local_path, remote_file_path))
-    elif os.path.isdir(local_path):
-        # 如果是文件夹，遍历文件夹并匹配文件
-        for root, _, files in os.walk(local_path):
-            for file in files:
-                if fnmatch.fnmatch(file, pattern):
-                    local_file_path = os.path.join(root, file)
-                    # 计算远程路径，保持目录结构
-                    relative_path = os.path.relpath(local_file_path, local_path)
-                    remote_file_path = os.path.join(remote_base_path, relative_path)
-                    file_queue.put((local_file_path, remote_file_path))
-    else:
+    :param remote_base_path: 远程目标路径
+    :param threads: 每台主机的并发线程数；自动调整并发时为初始值
+    :param max_sessions: 每台主机最大 SSH 连接数（默认与线程数相同，自动调整并发时与 max_threads 相同）
+    :param adaptive_threads: 是否根据每台主机的吞吐、可重试的错误和建立连接的耗时自动调整并发线程数，见 ConcurrencyController
+    :param min_threads: 自动调整并发时每台主机的最小线程数
+    :param max_threads: 自动调整并发时每台主机的最大线程数，默认为 threads 的 4 倍
+    :param sync_mode: skip（远程已存在即跳过）、sync（大小或修改时间不同才推送）、checksum（大小相同时再比较 SHA-256）
+    :param dry_run: 只输出同步计划（文件数和字节数），不实际推送
+    :param delta_threshold: 远程已有旧版本且不小于该字节数的文件使用块级增量传输，0 表示关闭
+    :param bundle_threshold: 小于该字节数的文件打包成 tar 流批量推送，0 表示关闭
+    :param bundle_size: 每个打包的字节数上限
+    :param chunk_threshold: 不小于该字节数的文件切分为字节范围，通过多个通道并发传输，0 表示关闭
+    :param chunk_streams: 单个大文件的并发通道数
+    :param resume_threshold: 不小于该字节数的文件写入远程 .part 临时文件，失败后可断点续传，0 表示关闭
+    :param journal_path: 任务日志路径，默认根据主机和路径在当前目录生成；重新运行同一任务时跳过日志中已完成的文件
+    :param schedule_policy: 工作线程取任务的调度策略 fifo/largest/interleave/locality，见 TransferScheduler
+    :param rate_limit: 全局限速（字节/秒），所有主机、所有线程共享，0 表示不限速
+    :param host_rate_limit: 每台主机的限速（字节/秒），0 表示不限速
+    :param file_rate_limit: 单个文件的限速（字节/秒），0 表示不限速
+    :param rate_schedule: 全局限速时间表，例如 "08:00-20:00=10M,20:00-08:00=100M"，不在任何时间段内时使用 rate_limit
+    :param metrics_path: 每个文件推送结束时向该文件追加一行 JSON（各阶段耗时、字节数、重试次数、错误），None 表示不写
+    :param prom_path: 定期以 Prometheus 文本格式写入汇总指标的文件路径，None 表示不写
+    :param progress_interval: 进度显示间隔（秒），0 表示不显示
+    :param verify: 是否校验推送结果：传输时计算本地 SHA-256，远程批量计算后比较，不一致的文件自动重新推送
+    :param manifest_path: 向该文件追加每个文件的校验结果（JSON lines，见 ChecksumManifest），None 表示不写
+    :param dedup_threshold: 不小于该字节数的文件参与去重：大小相同的文件比较 SHA-256，相同内容只推送一次，0 表示关闭
+    :param dedup_mode: 重复文件在远程的创建方式：copy（cp --reflink=auto，文件系统支持时共享数据块）或 hardlink（硬链接）
+    :param state_path: 传输状态库（SQLite）路径，记录每台主机已推送的文件，跨运行在本地判断跳过；None 表示不使用
+    :param reconcile_interval: 与远程完整核对（列出远程索引）的间隔（秒）；间隔内重新运行时只在远程统计文件数和总字节数，与状态库
+                               一致才直接使用状态库、不列出远程索引（大小不变的改动不会被发现），不一致时完整核对；0 表示每次都核对
+    :param transport_profile: 传输参数预设（窗口、包长、算法顺序、压缩、SFTP 在途请求数），见 TRANSPORT_PROFILES；
+                              auto 表示每台主机在第一个连接上测量往返延迟和带宽后自动选择：每台主机一次测量，广域网上带宽测量会发送
+                              最多 PROFILE_PROBE_BYTES 字节；结果缓存在状态库中，试运行和小任务不测量带宽，见 SSHConnectionPool._choose_profile
+    :param compress: 压缩推送：on 表示可压缩的文件（按扩展名和试压缩判断）和打包在本地压缩线程池中压缩、远程解压，不可压缩的原样推送；
+                     off 表示不压缩；auto 表示只对选择了 wan 预设的主机压缩
+    :param watch: 推送完成后持续监视本地文件夹（Linux inotify），变化的文件合并成批后通过已建立的连接推送，按 Ctrl+C 停止
+    :param watch_log_path: 监视模式的事件日志路径，默认根据主机和路径在当前目录生成；重启时据此只补推中断期间的变化
+    :param watch_debounce: 监视模式下最后一个事件之后安静这么多秒再推送（持续有事件时最多等待 WATCH_MAX_DELAY 秒）
+    """
+    if not os.path.exists(local_path):
         print(f"无效路径: {local_path}")
         return
+    if watch and not os.path.isdir(local_path):
+        print(f"监视模式只支持文件夹: {local_path}")
+        return
+    if watch and sync_mode == "skip":
+        # 被修改的文件在远程已经存在，只比较是否存在会跳过它们
+        print("监视模式下同步模式 skip 改为 sync（比较大小和修改时间）")
+        sync_mode = "sync"
 
-    # 创建并启动线程
-    stop_event = Event()  # 用于通知线程退出
-    thread_list = []
-    for _ in range(threads):
-        thread = Thread(target=worker, args=(file_queue, remote_base_path, remote_host, remote_port, remote_user, remote_password, stop_event), daemon=True)
-        thread.start()
-        thread_list.append(thread)
+    options = {
+        "sync_mode": sync_mode,
+        "dry_run": dry_run,
+        "adaptive_threads": adaptive_threads and not dry_run,
+        "min_threads": min_threads,
+        "max_threads": max(max_threads or threads * 4, threads),
+        "delta_threshold": delta_threshold,
+        "bundle_threshold": bundle_threshold,
+        "bundle_size": bundle_size,
+        "chunk_threshold": chunk_threshold,
+        "chunk_streams": chunk_streams,
+        "resume_threshold": resume_threshold,
+        "schedule_policy": schedule_policy,
+        "host_rate_limit": host_rate_limit,
+        "file_rate_limit": file_rate_limit,
+        "verify": verify,
+        "dedup_threshold": dedup_threshold,
+        "dedup_mode": dedup_mode,
+        "reconcile_interval": reconcile_interval,
+        "transport_profile": transport_profile,
+        "compress": compress,
+        "watch": watch and not dry_run,
+    }
+    if dedup_mode not in DEDUP_COMMANDS:
+        print(f"未知的去重方式: {dedup_mode}")
+        return
+    if transport_profile != "auto" and transport_profile not in TRANSPORT_PROFILES:
+        print(f"未知的传输参数预设: {transport_profile}")
+        return
+    if compress not in COMPRESS_MODES:
+        print(f"未知的压缩方式: {compress}")
+        return
+    schedule = parse_rate_schedule(rate_schedule)
+    rate_bucket = TokenBucket(rate_limit, schedule) if rate_limit or schedule else None
+    metrics = TransferMetrics(metrics_path)
+    manifest = ChecksumManifest(manifest_path if verify and not dry_run else None)
+    state = TransferState(state_path) if state_path else None
+    hosts = parse_hosts(remote_host, remote_port)
+    multi_host = len(hosts) > 1
+    targets = []
+    for host, port in hosts:
+        target = HostPush(host, port, remote_user, remote_password, remote_base_path, local_path, threads, max_sessions, options,
+                          journal_path=f"{journal_path}.{host}_{port}" if journal_path and multi_host else journal_path,
+                          label=f"[{host}:{port}] " if multi_host else "", rate_bucket=rate_bucket,
+                          metrics=metrics, manifest=manifest, state=state)
+        if target.prepare():
+            target.block = not multi_host
+            targets.append(target)
+    if not targets:
+        print("没有可用的目标主机")
+        metrics.close()
+        manifest.close()
+        if state is not None:
+            state.close()
+        return
 
-    # 等待所有任务完成
-    file_queue.join()
+    def feed(files):
+        """
+        把 (本地文件路径, 相对路径, os.stat_result) 逐批比较、创建目录后放入各主机的调度窗口
+        """
+        local_sums = {}  # 本批次已计算的本地校验和，多台主机共用
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for local_file_path, relative_path, local_stat in files:
+                for target in targets:
+                    target.enqueue(local_file_path, os.path.join(remote_base_path, relative_path), local_stat)
+                if any(len(target.batch["checksum"]) >= ENUM_BATCH_SIZE or len(target.batch["dedup"]) >= ENUM_BATCH_SIZE for target in targets):
+                    for target in targets:
+                        target.compare_checksums(executor, local_sums)
+                        target.resolve_duplicates(executor, local_sums)
+                    local_sums.clear()
+            for target in targets:
+                target.finish_enumeration(executor, local_sums)
 
-    # 通知线程退出
-    stop_event.set()
+    def produce():
+        """
+        枚举线程：遍历本地文件（只遍历一次），交给 feed()
+        """
+        if os.path.isfile(local_path):
+            # 如果是文件，直接加入队列
+            files = [(local_path, os.path.basename(local_path), os.stat(local_path))] \
+                if fnmatch.fnmatch(os.path.basename(local_path), pattern) else []
+        else:
+            # 如果是文件夹，遍历文件夹并匹配文件，保持目录结构
+            files = scan_local_files(local_path, pattern)
+        feed(files)
 
-    # 等待所有线程退出
-    for thread in thread_list:
-        thread.join()
+    if dry_run:
+        produce()
+        for target in targets:
+            target.close()
+        metrics.close()
+        manifest.close()
+        if state is not None:
+            state.close()
+        return
 
-    print("所有文件推送完成！")
+    # 先启动工作线程，再启动枚举线程，第一批文件入队后立即开始推送
+    cache = SharedFileCache() if multi_host else None
+    compressor = Compressor() if compress != "off" else None
+    for target in targets:
+        target.start(cache, compressor)
+    reporter_stop = Event()
+    if progress_interval or prom_path:
+        # 监视模式下空闲时不输出进度，每批完成后输出一行结果
+        Thread(target=metrics.report_periodically, args=(reporter_stop, progress_interval or METRICS_INTERVAL, progress_interval > 0 and not watch,
+                                                         prom_path), daemon=True).start()
+    if watch:
+        if watch_log_path is None:
+            job_id = hashlib.sha1(f"{remote_host}:{remote_port}:{os.path.abspath(local_path)}:{remote_base_path}".encode()).hexdigest()[:12]
+            watch_log_path = f".push_files-watch-{job_id}.log"
+        # 本脚本自己写入的文件位于被监视的文件夹中时不推送，否则每次写检查点都会触发下一批
+        ignore = [watch_log_path] + [target.journal_path for target in targets] + \
+                 [path for path in (state_path, metrics_path, prom_path, manifest_path) if path]
+        watch_local_changes(local_path, pattern, targets, feed, watch_log_path, watch_debounce, ignore)
+    else:
+        producer = Thread(target=produce, daemon=True)
+        producer.start()
+        producer.join()
 
-if __name__ == "__main__":
-    # 文件队列
-    file_queue = Queue()
+    # 等待各主机的任务完成
+    for target in targets:
+        target.wait()
+    reporter_stop.set()
+    if prom_path:
+        metrics.write_prometheus(prom_path)
+    metrics.summary()
+    metrics.close()
+    manifest.close()
+    if state is not None:
+        state.close()
+    if cache is not None:
+        print(f"共享读取: 从本地磁盘读取 {format_size(cache.disk_bytes)}，向 {len(targets)} 台主机发送 {format_size(cache.served_bytes)}")
+    if compressor is not None:
+        compressor.close()
+        compressor.report()
 
+if __name__ == "__main__":
     # 获取用户输入
     config = get_user_input()
 
@@ -197,4 +3746,34 @@ if __name__ == "__main__":
         remote_password=config["remote_password"],
         remote_base_path=config["remote_path"],
         threads=config["threads"],
+        max_sessions=config["max_sessions"],
+        adaptive_threads=config["adaptive_threads"],
+        min_threads=config["min_threads"],
+        max_threads=config["max_threads"],
+        sync_mode=config["sync_mode"],
+        dry_run=config["dry_run"],
+        delta_threshold=config["delta_threshold"],
+        bundle_threshold=config["bundle_threshold"],
+        bundle_size=config["bundle_size"],
+        chunk_threshold=config["chunk_threshold"],
+        chunk_streams=config["chunk_streams"],
+        resume_threshold=config["resume_threshold"],
+        schedule_policy=config["schedule_policy"],
+        rate_limit=config["rate_limit"],
+        host_rate_limit=config["host_rate_limit"],
+        file_rate_limit=config["file_rate_limit"],
+        rate_schedule=config["rate_schedule"],
+        metrics_path=config["metrics_path"],
+        prom_path=config["prom_path"],
+        progress_interval=config["progress_interval"],
+        verify=config["verify"],
+        manifest_path=config["manifest_path"],
+        dedup_threshold=config["dedup_threshold"],
+        dedup_mode=config["dedup_mode"],
+        state_path=config["state_path"],
+        reconcile_interval=config["reconcile_interval"],
+        transport_profile=config["transport_profile"],
+        compress=config["compress"],
+        watch=config["watch"],
+        watch_debounce=config["watch_debounce"],
     )
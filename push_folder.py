@@ -3,7 +3,10 @@
 
 import paramiko
 import os
+import shlex
 import threading
+import time
+from queue import Queue
 from getpass import getpass
 
 # 远程服务器信息
@@ -19,51 +22,96 @@ LOCAL_DIR = input("请输入本地文件夹路径: ")
 # 线程数
 THREADS = int(input("请输入线程数 (默认 4): ") or 4)
 
+# 待推送文件队列：遍历线程放入，工作线程取出；每个工作线程收到 None 时退出
+file_queue = Queue(maxsize=THREADS * 256)
+
+# 已创建的远程目录，所有工作线程共享，避免重复执行 mkdir
+created_dirs = set()
+created_dirs_lock = threading.Lock()
+
+# 推送统计
+stats = {"files": 0, "bytes": 0, "failed": 0}
+stats_lock = threading.Lock()
+
+# 建立 SSH 连接和 SFTP 会话，每个工作线程一份，推送多个文件时复用
+def connect():
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect(REMOTE_HOST, port=REMOTE_PORT, username=REMOTE_USER, password=REMOTE_PASSWORD)
+    return ssh, ssh.open_sftp()
+
+# 创建远程目录（如果不存在），等待命令结束后再推送文件
+def ensure_remote_dir(ssh, remote_dir):
+    with created_dirs_lock:
+        if remote_dir in created_dirs:
+            return
+    stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {shlex.quote(remote_dir)}")
+    if stdout.channel.recv_exit_status() != 0:
+        raise IOError(f"无法创建远程目录 {remote_dir}：{stderr.read().decode().strip()}")
+    with created_dirs_lock:
+        created_dirs.add(remote_dir)
+
 # 推送文件的函数
-def scp_file(file_path):
-    try:
-        # 创建 SSH 客户端
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(REMOTE_HOST, port=REMOTE_PORT, username=REMOTE_USER, password=REMOTE_PASSWORD)
-
-        # 远程路径
-        remote_file_path = os.path.join(REMOTE_PATH, os.path.relpath(file_path, LOCAL_DIR))
-
-        # 创建远程目录（如果不存在）
-        remote_dir = os.path.dirname(remote_file_path)
-        ssh.exec_command(f"mkdir -p {remote_dir}")
-
-        # 使用 SCP 传输文件
-        with ssh.open_sftp() as sftp:
-            sftp.put(file_path, remote_file_path)
-        print(f"推送成功：{file_path} -> {remote_file_path}")
-    except Exception as e:
-        print(f"推送失败：{file_path}，错误：{e}")
-    finally:
+def scp_file(ssh, sftp, file_path):
+    # 远程路径
+    remote_file_path = os.path.join(REMOTE_PATH, os.path.relpath(file_path, LOCAL_DIR))
+
+    # 创建远程目录（如果不存在）
+    ensure_remote_dir(ssh, os.path.dirname(remote_file_path))
+
+    # 使用 SFTP 传输文件
+    sftp.put(file_path, remote_file_path)
+    print(f"推送成功：{file_path} -> {remote_file_path}")
+    with stats_lock:
+        stats["files"] += 1
+        stats["bytes"] += os.path.getsize(file_path)
+
+# 工作线程：连接只建立一次，一个文件推送完立即从队列取下一个
+def worker():
+    ssh, sftp = None, None
+    while True:
+        file_path = file_queue.get()
+        try:
+            if file_path is None:
+                break
+            try:
+                if ssh is None:
+                    ssh, sftp = connect()
+                scp_file(ssh, sftp, file_path)
+            except Exception as e:
+                print(f"推送失败：{file_path}，错误：{e}")
+                with stats_lock:
+                    stats["failed"] += 1
+                # 连接断开时丢弃，下一个文件重新连接
+                if ssh is not None and not (ssh.get_transport() and ssh.get_transport().is_active()):
+                    ssh.close()
+                    ssh, sftp = None, None
+        finally:
+            file_queue.task_done()
+    if ssh is not None:
         ssh.close()
 
-# 获取文件夹下的所有文件
-file_list = []
-for root, _, files in os.walk(LOCAL_DIR):
-    for file in files:
-        file_list.append(os.path.join(root, file))
+started = time.time()
 
-# 多线程推送
+# 启动固定数量的工作线程
 threads = []
-for file_path in file_list:
-    thread = threading.Thread(target=scp_file, args=(file_path,))
-    threads.append(thread)
+for _ in range(THREADS):
+    thread = threading.Thread(target=worker, daemon=True)
     thread.start()
+    threads.append(thread)
 
-    # 限制线程数
-    if len(threads) >= THREADS:
-        for thread in threads:
-            thread.join()
-        threads = []
+# 遍历文件夹，边遍历边放入队列
+for root, _, files in os.walk(LOCAL_DIR):
+    for file in files:
+        file_queue.put(os.path.join(root, file))
 
-# 等待剩余线程完成
+# 通知工作线程退出并等待完成
+for _ in threads:
+    file_queue.put(None)
 for thread in threads:
     thread.join()
 
+elapsed = max(time.time() - started, 1e-6)
+print(f"推送 {stats['files']} 个文件，共 {stats['bytes'] / 1024 / 1024:.1f} MB，失败 {stats['failed']} 个，"
+      f"耗时 {elapsed:.1f} 秒，吞吐 {stats['bytes'] / 1024 / 1024 / elapsed:.1f} MB/s，{stats['files'] / elapsed:.1f} 个文件/秒")
 print("文件夹推送完成！")
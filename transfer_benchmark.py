@@ -0,0 +1,603 @@
+# 依赖安装
+#sudo apt update &&  apt install python3 python3-pip && pip3 install paramiko scp
+
+# 传输基准测试：在本机启动一个进程内的 SSH/SFTP/SCP 服务器（可注入延迟和带宽限制），
+# 生成合成的文件树，分别用 push_files.py、pull_files.py 和 push_folder.py 的各种模式传输，
+# 记录文件/秒、MB/秒、CPU 时间和峰值内存，结果保存为 JSON，可与之前的结果比较。不需要网络。
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import shutil
+import socket
+import tempfile
+import subprocess
+import paramiko
+from threading import Thread, Lock
+from queue import Queue
+from datetime import datetime
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench"
+EXEC_MIN_SECONDS = 0.01  # exec 命令至少持续这么久再关闭通道，见 run_exec
+LINK_BUFFER_SIZE = 64 * 1024  # 代理每次转发的字节数
+
+def get_user_input():
+    """
+    通过交互方式获取用户输入，直接回车使用默认值，默认值下的结果可以在不同版本之间比较
+    """
+    trees = input("请输入要测试的文件树 tiny/huge/mixed，多个用逗号分隔（默认全部）: ").strip() or "tiny,huge,mixed"
+    tools = input("请输入要测试的工具 push_files/pull_files/push_folder，多个用逗号分隔（默认全部）: ").strip() or "push_files,pull_files,push_folder"
+    scale = float(input("文件树规模倍数（默认 1）: ").strip() or 1)
+    threads = int(input("请输入并发线程数（默认 4）: ").strip() or 4)
+    latency = float(input("注入的单向延迟 毫秒（默认 0）: ").strip() or 0) / 1000
+    bandwidth = float(input("注入的带宽上限 MB/s（默认 0，不限制）: ").strip() or 0) * 1024 * 1024
+    seed = int(input("生成文件树的随机种子（默认 1）: ").strip() or 1)
+    output = input("结果输出文件（默认 benchmark-时间.json）: ").strip() or f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json"
+    baseline = input("与之前的结果比较（JSON 路径，默认不比较）: ").strip() or None
+
+    return {
+        "trees": [tree.strip() for tree in trees.split(",") if tree.strip()],
+        "tools": [tool.strip() for tool in tools.split(",") if tool.strip()],
+        "scale": scale,
+        "threads": threads,
+        "latency": latency,
+        "bandwidth": bandwidth,
+        "seed": seed,
+        "output": output,
+        "baseline": baseline,
+    }
+
+# ---------------------------------------------------------------------------
+# 进程内的 SSH/SFTP/SCP 服务器：远程路径就是本机路径，exec 请求交给 /bin/sh 执行
+# ---------------------------------------------------------------------------
+
+class BenchServer(paramiko.ServerInterface):
+    """
+    接受任意密码，允许 session 通道、exec 请求和 sftp 子系统
+    """
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL if username == BENCH_USER and password == BENCH_PASSWORD else paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        Thread(target=run_exec, args=(channel, command.decode("utf-8", "surrogateescape")), daemon=True).start()
+        return True
+
+def run_exec(channel, command):
+    """
+    执行一条 exec 命令：通道的输入写给子进程的 stdin，子进程的 stdout/stderr 写回通道，结束后发送退出码
+    paramiko 在 check_channel_exec_request 返回之后才回复 CHANNEL_SUCCESS，
+    命令结束得太快时通道可能先于这条回复关闭，客户端会报 "Channel closed."，所以至少持续 EXEC_MIN_SECONDS
+    """
+    started = time.monotonic()
+    process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+
+    def feed_stdin():
+        try:
+            for data in iter(lambda: channel.recv(LINK_BUFFER_SIZE), b""):
+                process.stdin.write(data)
+        except (OSError, EOFError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    def forward_stderr():
+        for data in iter(lambda: process.stderr.read(LINK_BUFFER_SIZE), b""):
+            channel.sendall_stderr(data)
+
+    Thread(target=feed_stdin, daemon=True).start()
+    stderr_thread = Thread(target=forward_stderr, daemon=True)
+    stderr_thread.start()
+    try:
+        for data in iter(lambda: process.stdout.read(LINK_BUFFER_SIZE), b""):
+            channel.sendall(data)
+        stderr_thread.join()
+        status = process.wait()
+        time.sleep(max(0, EXEC_MIN_SECONDS - (time.monotonic() - started)))
+        channel.send_exit_status(status)
+    except (OSError, EOFError):
+        process.kill()
+    finally:
+        channel.close()
+
+class BenchSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        try:
+            if attr.st_size is not None:
+                self.writefile.flush()
+                os.ftruncate(self.writefile.fileno(), attr.st_size)
+            if attr.st_mtime is not None:
+                os.utime(self.writefile.fileno(), (attr.st_atime or attr.st_mtime, attr.st_mtime))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+class BenchSFTPServer(paramiko.SFTPServerInterface):
+    """
+    把 SFTP 请求直接映射到本机文件系统
+    """
+    @staticmethod
+    def _call(function, *args):
+        try:
+            function(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def list_folder(self, path):
+        try:
+            entries = []
+            for name in os.listdir(path):
+                attr = paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)))
+                attr.filename = name
+                entries.append(attr)
+            return entries
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        f = os.fdopen(fd, mode)
+        handle = BenchSFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        if os.path.exists(newpath):
+            return paramiko.SFTP_FAILURE
+        return self._call(os.rename, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, path)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+    def chattr(self, path, attr):
+        try:
+            if attr.st_size is not None:
+                os.truncate(path, attr.st_size)
+            if attr.st_mtime is not None:
+                os.utime(path, (attr.st_atime or attr.st_mtime, attr.st_mtime))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def canonicalize(self, path):
+        return os.path.abspath(path)
+
+class SSHBenchServer:
+    """
+    在 127.0.0.1 的随机端口上监听，每个连接一个 paramiko Transport
+    """
+    def __init__(self):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+        Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, BenchSFTPServer)
+            try:
+                transport.start_server(server=BenchServer())
+            except (paramiko.SSHException, EOFError, OSError):
+                transport.close()
+
+    def close(self):
+        self.sock.close()
+
+# ---------------------------------------------------------------------------
+# 注入延迟和带宽限制的 TCP 代理
+# ---------------------------------------------------------------------------
+
+class LinkDirection:
+    """
+    一个方向上的链路：所有连接共享带宽，每个数据块在到达时间加上单向延迟之后、并且轮到它占用带宽时才发出
+    """
+    def __init__(self, latency, bandwidth):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._next_free = 0.0
+        self._lock = Lock()
+
+    def deliver_at(self, arrived, size):
+        """
+        :return: 这个数据块应该发出的时间（time.monotonic()）
+        """
+        ready = arrived + self.latency
+        if not self.bandwidth:
+            return ready
+        with self._lock:
+            self._next_free = max(self._next_free, ready) + size / self.bandwidth
+            return self._next_free
+
+class ShapedLink:
+    """
+    在随机端口上监听，把每个连接转发到 target_port，两个方向分别注入延迟和带宽限制
+    """
+    def __init__(self, target_port, latency=0.0, bandwidth=0.0):
+        self.target_port = target_port
+        self.upstream = LinkDirection(latency, bandwidth)
+        self.downstream = LinkDirection(latency, bandwidth)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+        Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            server = socket.create_connection(("127.0.0.1", self.target_port))
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._pump(client, server, self.upstream)
+            self._pump(server, client, self.downstream)
+
+    @staticmethod
+    def _pump(source, destination, direction):
+        """
+        读线程给每个数据块打上到达时间放入队列，写线程等到发出时间再写出，延迟不会因为带宽限制而叠加到读取上
+        """
+        pending = Queue()
+
+        def read():
+            try:
+                for data in iter(lambda: source.recv(LINK_BUFFER_SIZE), b""):
+                    pending.put((time.monotonic(), data))
+            except OSError:
+                pass
+            pending.put(None)
+
+        def write():
+            try:
+                for arrived, data in iter(pending.get, None):
+                    delay = direction.deliver_at(arrived, len(data)) - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    destination.sendall(data)
+                destination.shutdown(socket.SHUT_WR)
+            except OSError:
+                source.close()
+                destination.close()
+
+        Thread(target=read, daemon=True).start()
+        Thread(target=write, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+
+# ---------------------------------------------------------------------------
+# 合成文件树
+# ---------------------------------------------------------------------------
+
+def tree_spec(name, scale):
+    """
+    :return: [(目录数, 每个目录的文件数, 最小字节数, 最大字节数), ...]
+    """
+    def count(n):
+        return max(1, int(n * scale))
+    if name == "tiny":
+        return [(count(20), 100, 1024, 4096)]
+    if name == "huge":
+        return [(1, count(2), 64 * 1024 * 1024, 64 * 1024 * 1024)]
+    if name == "mixed":
+        return [(count(10), 50, 1024, 64 * 1024), (1, count(20), 1024 * 1024, 4 * 1024 * 1024), (1, 1, 64 * 1024 * 1024, 64 * 1024 * 1024)]
+    raise ValueError(f"未知的文件树: {name}")
+
+def generate_tree(root, name, scale, seed):
+    """
+    用固定的随机种子生成文件树，同样的参数每次生成的内容完全相同
+    :return: (文件数, 总字节数)
+    """
+    rng = random.Random(f"{name}:{seed}")
+    files = total = 0
+    for group, (dirs, per_dir, min_size, max_size) in enumerate(tree_spec(name, scale)):
+        for d in range(dirs):
+            directory = os.path.join(root, f"g{group}", f"d{d:04d}")
+            os.makedirs(directory, exist_ok=True)
+            for index in range(per_dir):
+                size = rng.randint(min_size, max_size)
+                with open(os.path.join(directory, f"f{index:05d}.bin"), "wb") as f:
+                    remaining = size
+                    while remaining:
+                        block = min(remaining, 1024 * 1024)
+                        f.write(rng.randbytes(block))
+                        remaining -= block
+                files += 1
+                total += size
+    return files, total
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def tree_summary(root):
+    """
+    :return: {相对路径: (大小, SHA-256)}；只比较大小发现不了内容损坏或截断后补齐的文件
+    """
+    summary = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            summary[os.path.relpath(path, root)] = (os.path.getsize(path), file_sha256(path))
+    return summary
+
+# ---------------------------------------------------------------------------
+# 运行各个工具并测量
+# ---------------------------------------------------------------------------
+
+# scp 模式关闭所有优化（包括传输校验、去重、压缩、自适应并发和传输参数探测），作为逐个文件 scp 的基线
+SCP_BASELINE = {"delta_threshold": 0, "bundle_threshold": 0, "chunk_threshold": 0, "resume_threshold": 0, "verify": False,
+                "dedup_threshold": 0, "compress": "off", "adaptive_threads": False, "transport_profile": "default"}
+# chunked 模式让 16 MB 以上的文件走分块传输；分块大小改为 8 MB（模块默认 64 MB），64 MB 的文件分成 8 块，能测到多路并发
+CHUNKED = {"chunk_threshold": 16 * 1024 * 1024, "constants": {"CHUNK_PIECE_SIZE": 8 * 1024 * 1024}}
+
+# 每种模式传给 push_files/pull_files 的参数；constants 不是函数参数，由驱动代码在调用前设置为模块常量
+TOOL_MODES = {
+    "push_files": {
+        "default": {},
+        "scp": SCP_BASELINE,
+        "chunked": CHUNKED,
+    },
+    "pull_files": {
+        "default": {},
+        "scp": SCP_BASELINE,
+        "chunked": CHUNKED,
+    },
+    "push_folder": {
+        "default": None,
+    },
+}
+
+# 子进程中运行的驱动代码：导入脚本所在目录的模块、设置 constants 中的模块常量并调用传输函数，或者按 __main__ 运行整个脚本；
+# 结束时把本进程的峰值内存（/proc/self/status 的 VmHWM，exec 之后重新计算，不含 fork 时从父进程继承的页）写到 argv[3]
+DRIVER = """
+import json, runpy, sys
+sys.path.insert(0, sys.argv[1])
+kwargs = json.loads(sys.argv[2])
+try:
+    if "script" in kwargs:
+        runpy.run_path(kwargs["script"], run_name="__main__")
+    else:
+        module = __import__(kwargs.pop("module"))
+        for name, value in kwargs.pop("constants", {}).items():
+            setattr(module, name, value)
+        getattr(module, kwargs.pop("function"))(**kwargs)
+finally:
+    with open("/proc/self/status") as status, open(sys.argv[3], "w") as peak:
+        peak.write(next(line.split()[1] for line in status if line.startswith("VmHWM:")))
+"""
+
+def run_measured(kwargs, cwd, stdin_text=None):
+    """
+    在子进程中运行驱动代码，测量它自己的耗时、CPU 时间和峰值内存（不包括进程内服务器的开销）
+    start_new_session 让子进程脱离控制终端，getpass 会从 stdin 读取密码
+    """
+    peak_path = os.path.join(cwd, "peak_rss_kb")
+    command = [sys.executable, "-c", DRIVER, SCRIPT_DIR, json.dumps(kwargs), peak_path]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               start_new_session=True)
+    if stdin_text is not None:
+        process.stdin.write(stdin_text.encode())
+    process.stdin.close()
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - started
+    try:
+        with open(peak_path) as f:
+            peak_rss_kb = int(f.read())
+        os.remove(peak_path)
+    except (OSError, ValueError):
+        peak_rss_kb = usage.ru_maxrss
+    return {
+        "seconds": round(elapsed, 3),
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+        "peak_rss_kb": peak_rss_kb,
+        "exit_code": process.returncode,
+        "stderr": stderr.decode(errors="replace")[-2000:],
+    }
+
+def tool_arguments(tool, mode, source, destination, port, threads):
+    """
+    :return: (驱动代码的参数, 传给 stdin 的内容)
+    """
+    if tool == "push_folder":
+        # push_folder.py 在模块顶层依次询问：地址、端口、用户名、密码、远程路径、本地路径、线程数
+        answers = ["127.0.0.1", str(port), BENCH_USER, BENCH_PASSWORD, destination, source, str(threads)]
+        return {"script": os.path.join(SCRIPT_DIR, "push_folder.py")}, "\n".join(answers) + "\n"
+    kwargs = dict(TOOL_MODES[tool][mode], module=tool, function=tool, pattern="*", remote_host="127.0.0.1", remote_port=port,
+                  remote_user=BENCH_USER, remote_password=BENCH_PASSWORD, threads=threads, progress_interval=0,
+                  state_path=None)  # 不使用状态库：每个用例都要真实传输到清空的目标目录，不能因上一个用例的记录而跳过
+    if tool == "push_files":
+        kwargs.update(local_path=source, remote_base_path=destination)
+    else:
+        kwargs.update(remote_path=source, local_base_path=destination)
+    return kwargs, None
+
+def run_case(tool, mode, tree, source, expected, workdir, port, threads):
+    """
+    在全新的目标目录上运行一个工具的一种模式，校验结果并计算吞吐
+    """
+    destination = os.path.join(workdir, "dst")
+    shutil.rmtree(destination, ignore_errors=True)
+    os.makedirs(destination)
+    kwargs, stdin_text = tool_arguments(tool, mode, source, destination, port, threads)
+    result = run_measured(kwargs, workdir, stdin_text)
+    received = tree_summary(destination)
+    files, total = len(expected), sum(size for size, _ in expected.values())
+    result.update({
+        "tool": tool,
+        "mode": mode,
+        "tree": tree,
+        "files": files,
+        "bytes": total,
+        "verified": result["exit_code"] == 0 and received == expected,
+        "files_per_second": round(files / result["seconds"], 2),
+        "mb_per_second": round(total / 1024 / 1024 / result["seconds"], 2),
+    })
+    if result["verified"]:
+        del result["stderr"]
+    shutil.rmtree(destination, ignore_errors=True)
+    return result
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, settings, baseline_path):
+    """
+    与之前的结果逐项比较：耗时、吞吐、CPU 和峰值内存的变化百分比
+    """
+    with open(baseline_path) as f:
+        previous = json.load(f)
+    baseline = {(r["tool"], r["mode"], r["tree"]): r for r in previous["results"]}
+    print(f"与 {baseline_path}（版本 {previous.get('revision')}）比较（负数表示耗时、CPU 或内存减少）:")
+    if previous["settings"] != settings:
+        print(f"  注意：两次运行的设置不同，之前为 {previous['settings']}")
+    for result in results:
+        before = baseline.get((result["tool"], result["mode"], result["tree"]))
+        if before is None:
+            continue
+        changes = "，".join(f"{label} {(result[key] - before[key]) / before[key] * 100:+.1f}%"
+                           for label, key in (("耗时", "seconds"), ("吞吐", "mb_per_second"), ("CPU", "cpu_seconds"), ("峰值内存", "peak_rss_kb"))
+                           if before[key])
+        print(f"  {result['tool']:<12}{result['mode']:<9}{result['tree']:<7}{changes}")
+
+def run_benchmark(trees, tools, scale=1.0, threads=4, latency=0.0, bandwidth=0.0, seed=1, output=None, baseline=None):
+    """
+    运行基准测试
+    :param trees: 文件树 tiny（大量小文件）、huge（少量大文件）、mixed（混合）
+    :param tools: push_files、pull_files、push_folder
+    :param scale: 文件树规模倍数
+    :param threads: 每个工具的并发线程数
+    :param latency: 注入的单向延迟（秒），往返延迟是它的两倍
+    :param bandwidth: 注入的带宽上限（字节/秒），每个方向所有连接共享，0 表示不限制
+    :param seed: 生成文件树的随机种子
+    :param output: 结果 JSON 路径
+    :param baseline: 之前的结果 JSON 路径，不为 None 时逐项比较
+    """
+    server = SSHBenchServer()
+    link = ShapedLink(server.port, latency, bandwidth) if latency or bandwidth else None
+    port = link.port if link else server.port
+    workdir = tempfile.mkdtemp(prefix="transfer-benchmark-")
+    results = []
+    try:
+        for tree in trees:
+            source = os.path.join(workdir, f"src-{tree}")
+            files, total = generate_tree(source, tree, scale, seed)
+            expected = tree_summary(source)
+            print(f"文件树 {tree}: {files} 个文件，{total / 1024 / 1024:.1f} MB")
+            for tool in tools:
+                for mode in TOOL_MODES[tool]:
+                    result = run_case(tool, mode, tree, source, expected, workdir, port, threads)
+                    results.append(result)
+                    status = "" if result["verified"] else "  结果校验失败！"
+                    print(f"  {tool:<12}{mode:<9}{result['seconds']:>8.2f} 秒 {result['files_per_second']:>9.1f} 个文件/秒 "
+                          f"{result['mb_per_second']:>8.1f} MB/s  CPU {result['cpu_seconds']:>6.2f} 秒  峰值内存 {result['peak_rss_kb'] / 1024:.0f} MB{status}")
+            shutil.rmtree(source, ignore_errors=True)
+    finally:
+        if link:
+            link.close()
+        server.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "paramiko": paramiko.__version__,
+        "cpus": os.cpu_count(),
+        "settings": {"trees": trees, "tools": tools, "scale": scale, "threads": threads, "latency": latency, "bandwidth": bandwidth, "seed": seed},
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {output}")
+    if baseline:
+        compare(results, report["settings"], baseline)
+    return report
+
+if __name__ == "__main__":
+    # 获取用户输入
+    config = get_user_input()
+
+    # 运行基准测试
+    run_benchmark(
+        trees=config["trees"],
+        tools=config["tools"],
+        scale=config["scale"],
+        threads=config["threads"],
+        latency=config["latency"],
+        bandwidth=config["bandwidth"],
+        seed=config["seed"],
+        output=config["output"],
+        baseline=config["baseline"],
+    )